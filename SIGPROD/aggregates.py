@@ -0,0 +1,415 @@
+import sys
+from config import execute_ddl, fq, table_exists, get_lot_table, _pasfase_columns, invalidate_schema_cache, MATERIALIZED_AGGREGATES_ENABLED, TOQMOVI_LEDGER_ENABLED, SHARED_PASFASE_ENABLED, SHARED_DEVOLUCOES_ENABLED
+
+# Views materializadas mantidas pelo SIGPROD (modo opcional MATERIALIZED_AGGREGATES_ENABLED)
+PASFASE_MV = 'sigprod_mv_pasfase'
+PLANILHA_MV = 'sigprod_mv_planilha'
+TOQMOVI_MV = 'sigprod_mv_toqmovi'
+TOTAL_LOTE_MV = 'sigprod_mv_total_lote'
+
+# Saldos diários da toqmovi mantidos incrementalmente (modo opcional TOQMOVI_LEDGER_ENABLED)
+TOQMOVI_LEDGER = 'sigprod_toqmovi_saldos'
+
+# Fases da pasfase lidas pela passada compartilhada, por fase de monitor (corte baixa na 5 ou na 13)
+SHARED_PASFASE_FASES = {5: (5, 13), 10: (10,), 15: (15,), 30: (30,)}
+
+# Fatia da passada compartilhada recebida pelo monitor como parâmetros pf_* (ordem, fase, quantidade)
+SHARED_PASFASE_RELATION = "unnest(%(pf_ordens)s::text[], %(pf_fases)s::integer[], %(pf_qtds)s::numeric[]) AS pf(ordem, fase, qtd)"
+
+# Monitores com saldo de devolução servido pelo motor de devoluções (maciço e chapa)
+SHARED_DEVOLUCOES_FASES = (25, 30)
+
+# Saldo de devolução por (lote, produto) do motor recebido pelo monitor como parâmetros dv_*
+SHARED_DEVOLUCOES_RELATION = "unnest(%(dv_lotcods)s::text[], %(dv_produtos)s::text[], %(dv_saldos)s::numeric[]) AS ds(lotcod, produto_key, saldo_devolucao)"
+
+
+def materialized_available(name):
+    """Indica se a view materializada deve ser usada: modo habilitado e view presente no catálogo."""
+    return MATERIALIZED_AGGREGATES_ENABLED and table_exists(name)
+
+
+def toqmovi_aggregate_source(fq):
+    """Relação com a toqmovi já agregada (ledger incremental ou view materializada), ou None.
+
+    Ambas expõem priordem, priproduto, pritransac, tipo, motivo_codigo, a_partir_2025, qtd e ultima_data;
+    o ledger tem uma linha por dia, por isso os consumidores sempre somam/maximizam.
+    """
+    if TOQMOVI_LEDGER_ENABLED and table_exists(TOQMOVI_LEDGER):
+        return fq(TOQMOVI_LEDGER)
+    if materialized_available(TOQMOVI_MV):
+        return fq(TOQMOVI_MV)
+    return None
+
+
+def toqmovi_aggregate_select(fq, by_day=False, since=None):
+    """SELECT que agrega as transações '3', '4' e '14' da toqmovi por ordem, produto, transação e motivo.
+
+    `by_day` acrescenta a coluna `dia` (usada pelo ledger); `since` restringe aos movimentos a partir da data
+    e aos sem data (dia nulo no ledger).
+    """
+    day_column = "CAST(m.pridata AS DATE) AS dia," if by_day else ""
+    since_filter = f"AND (m.pridata >= DATE '{since.isoformat()}' OR m.pridata IS NULL)" if since is not None else ""
+    group_by = "1, 2, 3, 4, 5, 6, 7" if by_day else "1, 2, 3, 4, 5, 6"
+    return f"""
+            SELECT
+                {day_column}
+                m.priordem,
+                m.priproduto,
+                m.pritransac,
+                CASE
+                    WHEN m.priobserv ILIKE '%*d:%' THEN 'devolucao'
+                    WHEN m.priobserv IS NULL OR m.priobserv = '' THEN 'vazio'
+                    ELSE 'outro'
+                END AS tipo,
+                -- -1 em vez de NULL: o motivo faz parte do índice único da view, e o REFRESH ... CONCURRENTLY
+                -- não casa linhas com chave nula (-1 não existe na grmotper: o LEFT JOIN segue sem motivo)
+                COALESCE(CASE
+                    WHEN m.priobserv ILIKE '%*d:%' THEN CAST(SUBSTRING(m.priobserv FROM '\\*d:([0-9]+)') AS INTEGER)
+                END, -1) AS motivo_codigo,
+                COALESCE(m.pridata >= DATE '2025-01-01', FALSE) AS a_partir_2025,
+                SUM(COALESCE(m.priquanti, 0)) AS qtd,
+                MAX(m.pridata) AS ultima_data
+            FROM {fq('toqmovi')} m
+            WHERE m.pritransac IN ('3', '4', '14')
+            {since_filter}
+            GROUP BY {group_by}
+        """
+
+
+def shared_pasfase_query(fq, lot_table, ord_col, qtd_col):
+    """Passada única na pasfase: quantidade por (ordem, fase) para todas as fases de SHARED_PASFASE_FASES.
+
+    Restrita às ordens de lotes a partir de 2025, o mesmo recorte aplicado por todas as queries dos monitores.
+    """
+    fases = sorted({f for fases in SHARED_PASFASE_FASES.values() for f in fases})
+    fases_sql = ', '.join(str(f) for f in fases)
+    if materialized_available(PASFASE_MV):
+        source = f"""
+            SELECT pf.ordem AS ordem_origem, pf.fase, pf.qtd
+            FROM {fq(PASFASE_MV)} pf WHERE pf.fase IN ({fases_sql})
+        """
+    else:
+        source = f"""
+            SELECT pf.{ord_col} AS ordem_origem, pf.fase, SUM(COALESCE(pf.{qtd_col}, 0)) AS qtd
+            FROM {fq('pasfase')} pf WHERE pf.fase IN ({fases_sql})
+            GROUP BY pf.{ord_col}, pf.fase
+        """
+    return f"""
+        SELECT CAST(s.ordem_origem AS TEXT) AS ordem, s.fase, s.qtd
+        FROM ({source}) s
+        WHERE EXISTS (
+            SELECT 1 FROM {fq('ordem')} o JOIN {fq(lot_table)} l ON l.lotcod = o.lotcod
+            WHERE o.ordem = s.ordem_origem AND EXTRACT(YEAR FROM l.lotdtini) >= 2025
+        )
+    """
+
+
+# --- Fragmentos SQL usados pelos monitores ---
+def pasfase_qtd_source(fq, ord_col, qtd_col, qtd_alias='qtd', shared=False, ordens=None):
+    """Quantidade apontada na pasfase por ordem para a fase %(fase)s.
+
+    Com `shared`, lê a fatia da passada compartilhada recebida nos parâmetros pf_* (ver snapshots.monitor_params).
+    Com `ordens` (nome de um CTE com a coluna ordem), soma só as ordens desse CTE em vez da fase inteira.
+    """
+    if shared and SHARED_PASFASE_ENABLED:
+        scope = f"AND pf.ordem IN (SELECT CAST(f.ordem AS TEXT) FROM {ordens} f)" if ordens else ""
+        return f"""
+        SELECT pf.ordem, pf.qtd AS {qtd_alias}
+        FROM {SHARED_PASFASE_RELATION} WHERE pf.fase = %(fase)s {scope}
+    """
+    if materialized_available(PASFASE_MV):
+        scope = f"AND EXISTS (SELECT 1 FROM {ordens} f WHERE f.ordem = pf.ordem)" if ordens else ""
+        return f"""
+        SELECT CAST(pf.ordem AS TEXT) AS ordem, pf.qtd AS {qtd_alias}
+        FROM {fq(PASFASE_MV)} pf WHERE pf.fase = %(fase)s {scope}
+    """
+    scope = f"AND EXISTS (SELECT 1 FROM {ordens} f WHERE f.ordem = pf.{ord_col})" if ordens else ""
+    return f"""
+        SELECT CAST(pf.{ord_col} AS TEXT) AS ordem, SUM(COALESCE(pf.{qtd_col}, 0)) AS {qtd_alias}
+        FROM {fq('pasfase')} pf WHERE pf.fase = %(fase)s {scope} GROUP BY pf.{ord_col}
+    """
+
+
+def planilha_qtd_source(fq, filter_clause, qtd_alias='qtd', ordens=None):
+    """Quantidade planilhada por ordem; `filter_clause` filtra por plafase ou plaopera.
+
+    Com `ordens` (nome de um CTE com a coluna ordem), soma só as ordens desse CTE.
+    """
+    scope = f"AND CAST(plaordem AS TEXT) IN (SELECT CAST(f.ordem AS TEXT) FROM {ordens} f)" if ordens else ""
+    if materialized_available(PLANILHA_MV):
+        return f"""
+            SELECT CAST(plaordem AS TEXT) AS ordem, SUM(qtd) AS {qtd_alias}
+            FROM {fq(PLANILHA_MV)} WHERE {filter_clause} {scope} GROUP BY plaordem
+        """
+    return f"""
+            SELECT CAST(plaordem AS TEXT) AS ordem, SUM(COALESCE(CAST(plaquant AS NUMERIC), 0)) AS {qtd_alias}
+            FROM {fq('planilha')} WHERE {filter_clause} {scope} GROUP BY plaordem
+        """
+
+
+def total_historico_source(fq, lot_table, op_filter, fase_sql='%(fase)s'):
+    """Quantidade total planejada por lote (lotdes) para os produtos que passam pela fase."""
+    if materialized_available(TOTAL_LOTE_MV):
+        return f"""
+            SELECT l.lotdes, l.total_qty_lote
+            FROM {fq(TOTAL_LOTE_MV)} l
+            WHERE l.fase = {fase_sql} AND {op_filter}
+        """
+    return f"""
+            SELECT l.lotdes, SUM(o.ordquanti) as total_qty_lote
+            FROM {fq('ordem')} o JOIN {fq(lot_table)} l ON l.lotcod = o.lotcod
+            WHERE {op_filter}
+            AND EXTRACT(YEAR FROM l.lotdtini) >= 2025
+            AND EXISTS (SELECT 1 FROM {fq('processo')} pr WHERE pr.produto = o.ordproduto AND pr.fase = {fase_sql})
+            GROUP BY l.lotdes
+        """
+
+
+def producao_toqmovi_source(fq):
+    """Baixas de produção (transação '3', exceto devoluções) por ordem e produto."""
+    aggregated = toqmovi_aggregate_source(fq)
+    if aggregated:
+        return f"""
+        SELECT TRIM(CAST(m.priordem AS TEXT)) as ordem,
+               TRIM(m.priproduto) as produto,
+               SUM(m.qtd) as qtd
+        FROM {aggregated} m
+        WHERE m.pritransac = '3' AND m.tipo <> 'devolucao'
+        GROUP BY 1, 2
+    """
+    return f"""
+        SELECT TRIM(CAST(m.priordem AS TEXT)) as ordem,
+               TRIM(m.priproduto) as produto,
+               SUM(COALESCE(m.priquanti, 0)) as qtd
+        FROM {fq('toqmovi')} m
+        WHERE m.pritransac = '3' -- Baixa de produção da OP (parcial) para Maciço
+        AND (m.priobserv IS NULL OR m.priobserv NOT ILIKE '%%*d:%%')
+        GROUP BY 1, 2
+    """
+
+
+def devolucoes_saldo_source(fq, shared=False):
+    """Saldo de devoluções (transação '4' menos '14' marcadas com *d:) por lote (lotcod em texto) e produto.
+
+    Com `shared`, lê os saldos do motor de devoluções recebidos nos parâmetros dv_* (ver snapshots.monitor_params).
+    """
+    if shared and SHARED_DEVOLUCOES_ENABLED:
+        return f"""
+            SELECT ds.lotcod, ds.produto_key, ds.saldo_devolucao
+            FROM {SHARED_DEVOLUCOES_RELATION}
+        """
+    aggregated = toqmovi_aggregate_source(fq)
+    if aggregated:
+        return f"""
+            SELECT
+                CAST(o.lotcod AS TEXT) as lotcod,
+                TRIM(m.priproduto) as produto_key,
+                SUM(CASE WHEN m.pritransac = '4' THEN m.qtd ELSE -m.qtd END) as saldo_devolucao
+            FROM {aggregated} m
+            JOIN {fq('ordem')} o ON TRIM(CAST(o.ordem AS TEXT)) = TRIM(CAST(m.priordem AS TEXT))
+            WHERE m.tipo = 'devolucao'
+              AND m.a_partir_2025
+              AND m.pritransac IN ('4', '14')
+            GROUP BY 1, 2
+        """
+    return f"""
+            SELECT
+                CAST(o.lotcod AS TEXT) as lotcod,
+                TRIM(m.priproduto) as produto_key,
+                SUM(CASE WHEN m.pritransac = '4' THEN m.priquanti ELSE -m.priquanti END) as saldo_devolucao
+            FROM {fq('toqmovi')} m
+            JOIN {fq('ordem')} o ON TRIM(CAST(o.ordem AS TEXT)) = TRIM(CAST(m.priordem AS TEXT))
+            WHERE m.priobserv ILIKE '%%*d:%%'
+              AND m.pridata >= '2025-01-01'
+              AND m.pritransac IN ('4', '14')
+            GROUP BY 1, 2
+        """
+
+
+def debito_toqmovi_parts(fq):
+    """Partes da consulta de débitos de requisição (transação '14' sem observação) na toqmovi.
+
+    Retorna (origem, expressão de quantidade, expressão de data, filtro) para uso com o alias `m`.
+    """
+    aggregated = toqmovi_aggregate_source(fq)
+    if aggregated:
+        return (aggregated, 'm.qtd', 'm.ultima_data',
+                "m.pritransac = '14' AND m.tipo = 'vazio' AND m.a_partir_2025")
+    return (fq('toqmovi'), 'm.priquanti', 'm.pridata',
+            "m.pritransac = '14' AND (m.priobserv IS NULL OR m.priobserv = '') AND m.pridata >= '2025-01-01'")
+
+
+def devolucoes_por_motivo_source(fq):
+    """Totais devolvidos ('4') e debitados ('14') por ordem, produto e motivo da devolução."""
+    aggregated = toqmovi_aggregate_source(fq)
+    if aggregated:
+        return f"""
+                SELECT
+                    priordem,
+                    priproduto,
+                    motivo_codigo,
+                    SUM(CASE WHEN pritransac = '4' THEN qtd ELSE 0 END) as total_devolvido,
+                    SUM(CASE WHEN pritransac = '14' THEN qtd ELSE 0 END) as total_debitado,
+                    MAX(CASE WHEN pritransac = '4' THEN ultima_data ELSE NULL END) as ultima_data_devolucao
+                FROM {aggregated}
+                WHERE tipo = 'devolucao'
+                  AND a_partir_2025
+                  AND pritransac IN ('4', '14')
+                GROUP BY priordem, priproduto, motivo_codigo
+            """
+    return f"""
+                SELECT
+                    priordem,
+                    priproduto,
+                    motivo_codigo,
+                    SUM(CASE WHEN pritransac = '4' THEN priquanti ELSE 0 END) as total_devolvido,
+                    SUM(CASE WHEN pritransac = '14' THEN priquanti ELSE 0 END) as total_debitado,
+                    MAX(CASE WHEN pritransac = '4' THEN pridata ELSE NULL END) as ultima_data_devolucao
+                FROM (
+                    SELECT
+                        m.priordem,
+                        m.priproduto,
+                        m.priquanti,
+                        m.pritransac,
+                        m.pridata,
+                        CAST(SUBSTRING(m.priobserv FROM '\\*d:([0-9]+)') AS INTEGER) as motivo_codigo
+                    FROM {fq('toqmovi')} m
+                    WHERE m.priobserv ILIKE '%%*d:%%'
+                      AND m.pridata >= '2025-01-01'
+                      AND m.pritransac IN ('4', '14')
+                ) movimentos
+                GROUP BY priordem, priproduto, motivo_codigo
+            """
+
+
+def devolucoes_balance_query(fq, lot_table):
+    """Motor de devoluções: saldo (devolvido - debitado) por (lote, ordem, produto, motivo) numa leitura da toqmovi.
+
+    Alimenta o saldo de devolução de maciço e chapa e o /api/devolucoes de todas as fases, inclusive o filtro
+    de processo das fases 25 e 30 (colunas fase_25 e fase_30).
+    """
+    if table_exists('grmotper'):
+        motivo_select = "gmp.gmpdescri AS motivo"
+        motivo_join = f"LEFT JOIN {fq('grmotper')} gmp ON gmp.gmpcodigo = s.motivo_codigo"
+    else:
+        # Sem o cadastro de motivos os monitores seguem com o saldo; o /api/devolucoes acusa a tabela ausente
+        motivo_select, motivo_join = "CAST(NULL AS TEXT) AS motivo", ""
+    return f"""
+        SELECT
+            CAST(o.lotcod AS TEXT) AS lotcod,
+            l.lotdes AS lote_descricao,
+            s.priordem AS ordem,
+            TRIM(s.priproduto) AS produto,
+            p.pronome AS descricao,
+            p.produto_key IS NOT NULL AS produto_cadastrado,
+            {motivo_select},
+            s.total_devolvido - s.total_debitado AS saldo,
+            s.ultima_data_devolucao,
+            EXISTS (SELECT 1 FROM {fq('processo')} pr WHERE pr.produto = s.priproduto AND pr.fase = 25) AS fase_25,
+            EXISTS (SELECT 1 FROM {fq('processo')} pr WHERE pr.produto = s.priproduto AND pr.fase = 30) AS fase_30
+        FROM ({devolucoes_por_motivo_source(fq)}) s
+        JOIN {fq('ordem')} o ON TRIM(CAST(o.ordem AS TEXT)) = TRIM(CAST(s.priordem AS TEXT))
+        JOIN {fq(lot_table)} l ON l.lotcod = o.lotcod
+        LEFT JOIN (
+            SELECT DISTINCT ON (TRIM(produto)) TRIM(produto) AS produto_key, pronome
+            FROM {fq('produto')}
+            ORDER BY TRIM(produto), produto
+        ) p ON p.produto_key = TRIM(s.priproduto)
+        {motivo_join}
+    """
+
+
+# --- Definição e manutenção das views materializadas ---
+def _definitions(lot_table, ord_col, qtd_col):
+    """(nome, tabelas de origem, SELECT, colunas do índice único, índices auxiliares) de cada view."""
+    return [
+        (PASFASE_MV, ['pasfase'], f"""
+            SELECT {ord_col} AS ordem, fase, SUM(COALESCE({qtd_col}, 0)) AS qtd
+            FROM {fq('pasfase')}
+            GROUP BY {ord_col}, fase
+        """, ['ordem', 'fase'], [['fase']]),
+        (PLANILHA_MV, ['planilha'], f"""
+            SELECT plaordem, plafase, plaopera, SUM(COALESCE(CAST(plaquant AS NUMERIC), 0)) AS qtd
+            FROM {fq('planilha')}
+            GROUP BY plaordem, plafase, plaopera
+        """, ['plaordem', 'plafase', 'plaopera'], [['plafase'], ['plaopera']]),
+        (TOQMOVI_MV, ['toqmovi'], toqmovi_aggregate_select(fq), ['priordem', 'priproduto', 'pritransac', 'tipo', 'motivo_codigo', 'a_partir_2025'], [['pritransac', 'tipo']]),
+        (TOTAL_LOTE_MV, ['ordem', lot_table, 'processo'], f"""
+            SELECT l.lotdes, pr.fase, SUM(o.ordquanti) AS total_qty_lote
+            FROM {fq('ordem')} o
+            JOIN {fq(lot_table)} l ON l.lotcod = o.lotcod
+            JOIN (SELECT DISTINCT produto, fase FROM {fq('processo')}) pr ON pr.produto = o.ordproduto
+            WHERE EXTRACT(YEAR FROM l.lotdtini) >= 2025
+            GROUP BY l.lotdes, pr.fase
+        """, ['lotdes', 'fase'], [['fase']]),
+    ]
+
+
+def install_materialized_aggregates():
+    """Cria as views materializadas ausentes (com seus índices). Retorna a lista de views criadas."""
+    lot_table = get_lot_table()
+    ord_col, qtd_col = _pasfase_columns()
+    created = []
+    for name, sources, select_sql, unique_cols, indexes in _definitions(lot_table, ord_col, qtd_col):
+        if table_exists(name) or not all(table_exists(src) for src in sources):
+            continue
+        statements = [
+            f"CREATE MATERIALIZED VIEW IF NOT EXISTS {fq(name)} AS {select_sql} WITH DATA",
+            # O índice único é obrigatório para REFRESH ... CONCURRENTLY
+            f"CREATE UNIQUE INDEX IF NOT EXISTS {name}_uk ON {fq(name)} ({', '.join(unique_cols)})",
+        ]
+        for cols in indexes:
+            statements.append(f"CREATE INDEX IF NOT EXISTS {name}_{'_'.join(cols)}_idx ON {fq(name)} ({', '.join(cols)})")
+        execute_ddl(statements)
+        created.append(name)
+    if created:
+        invalidate_schema_cache()
+    return created
+
+
+def refresh_materialized_aggregates():
+    """Atualiza as views existentes sem bloquear as leituras dos monitores."""
+    lot_table = get_lot_table()
+    ord_col, qtd_col = _pasfase_columns()
+    for name, _, _, _, _ in _definitions(lot_table, ord_col, qtd_col):
+        if table_exists(name):
+            execute_ddl([f"REFRESH MATERIALIZED VIEW CONCURRENTLY {fq(name)}"])
+
+
+def drop_materialized_aggregates():
+    """Remove todas as views materializadas do SIGPROD; os monitores voltam às tabelas de origem."""
+    lot_table = get_lot_table()
+    ord_col, qtd_col = _pasfase_columns()
+    execute_ddl([
+        f"DROP MATERIALIZED VIEW IF EXISTS {fq(name)}"
+        for name, _, _, _, _ in _definitions(lot_table, ord_col, qtd_col)
+    ])
+    invalidate_schema_cache()
+
+
+def maintain_materialized_aggregates():
+    """Tarefa periódica do agendador: cria as views ausentes e atualiza as demais. Retorna erro ou None."""
+    try:
+        created = install_materialized_aggregates()
+        refresh_materialized_aggregates()
+        if created:
+            print(f"Views materializadas criadas: {', '.join(created)}")
+        return None
+    except Exception as e:
+        return f"Erro ao manter views materializadas: {e}"
+
+
+if __name__ == '__main__':
+    # Uso: python aggregates.py [install|refresh|drop]
+    command = sys.argv[1] if len(sys.argv) > 1 else 'install'
+    if command == 'install':
+        print(f"Views criadas: {install_materialized_aggregates()}")
+    elif command == 'refresh':
+        refresh_materialized_aggregates()
+        print("Views atualizadas")
+    elif command == 'drop':
+        drop_materialized_aggregates()
+        print("Views removidas")
+    else:
+        print(f"Comando desconhecido: {command}")
+        sys.exit(1)
@@ -1,13 +1,19 @@
 from flask import Flask
 from flask_cors import CORS
 from routes import register_routes
+from scheduler import start_background_services
 
-# Criar a aplicação Flask
-app = Flask(__name__)
+# Criar a aplicação Flask; /static é servido por routes.py (com compressão)
+app = Flask(__name__, static_folder=None)
 CORS(app)
 
 # Registrar todas as rotas
 register_routes(app)
 
 if __name__ == '__main__':
+    # debug=True usa o reloader: os serviços em segundo plano sobem só no processo que atende as requisições
+    start_background_services(use_reloader=True)
     app.run(debug=True, host='0.0.0.0', port=5003)
+else:
+    # Importado por um servidor WSGI
+    start_background_services()
@@ -0,0 +1,77 @@
+"""Benchmark do /api/export: pd.ExcelWriter em BytesIO versus workbook write-only e CSV em blocos.
+
+Mede tempo e pico de memória (tracemalloc) para o mesmo conjunto de linhas de um snapshot.
+Uso: python benchmarks/bench_export.py [linhas] [lotes]
+"""
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from export import EXPORT_COLUMNS, export_rows, _chunks, write_xlsx, write_parquet, iter_csv, pq  # noqa: E402
+from json_encoding import MonitorPayload  # noqa: E402
+from bench_grouped_summary import make_frame  # noqa: E402
+
+
+def legacy_xlsx(payload):
+    df = payload.frames['data']
+    final_df = df[df['status'] == 'atrasado']
+    cols_to_export = [col for col in EXPORT_COLUMNS if col in final_df.columns]
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        final_df[cols_to_export].rename(columns=EXPORT_COLUMNS).to_excel(writer, index=False, sheet_name='Relatorio')
+    return len(output.getvalue())
+
+
+def _to_tempfile(write):
+    def run(payload):
+        with tempfile.TemporaryFile() as output:
+            write(_chunks(*export_rows(payload, 5, 'delayed')), output)
+            return output.tell()
+    return run
+
+
+def streamed_csv(payload):
+    return sum(len(chunk) for chunk in iter_csv(_chunks(*export_rows(payload, 5, 'delayed'))))
+
+
+def measure(func, payload):
+    started = time.perf_counter()
+    size = func(payload)
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    func(payload)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, size
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    lots = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    frame = make_frame(rows, lots)
+    frame['descricao'] = 'Peça ' + frame['produto']
+    frame.loc[frame.index % 2 == 0, 'status'] = 'atrasado'
+    payload = MonitorPayload(False, {'data': frame})
+
+    candidates = [
+        ('ExcelWriter(BytesIO)', legacy_xlsx),
+        ('xlsx write-only', _to_tempfile(write_xlsx)),
+        ('csv em blocos', streamed_csv),
+    ]
+    if pq is not None:
+        candidates.append(('parquet em blocos', _to_tempfile(write_parquet)))
+
+    print(f"{rows} linhas no snapshot, {rows // 2} exportadas")
+    for name, func in candidates:
+        elapsed, peak, size = measure(func, payload)
+        print(f"  {name:22s} {elapsed * 1000:8.1f} ms  pico {peak / 1e6:7.1f} MB  arquivo {size / 1e6:6.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
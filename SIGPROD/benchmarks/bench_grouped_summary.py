@@ -0,0 +1,116 @@
+"""Benchmark do resumo por OP dos monitores agrupados (implementação anterior versus summarize_grouped).
+
+Uso: python benchmarks/bench_grouped_summary.py [linhas] [lotes]
+"""
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data_processing import summarize_grouped, frame_records  # noqa: E402
+
+
+def _legacy_summary(df_processed):
+    """Implementação anterior (cópias encadeadas, regex por linha, drop_duplicates + map)."""
+    df_details = df_processed.copy()
+    df_details['op_group'] = df_details['lote_descricao'].str.extract(r'((?:OP|O\.P\.?)\s?\d+/\d+)', expand=False).fillna(df_details['lote_descricao'])
+    agg_rules = {
+        'saldo_pendente': ('saldo_pendente', 'sum'),
+        'corte_dtini': ('corte_dtini', 'min'),
+        'orddtprev': ('orddtprev', 'min'),
+    }
+    if 'devolucao_saldo' in df_details.columns:
+        agg_rules['devolucao_saldo'] = ('devolucao_saldo', 'sum')
+    df_summary = df_details.groupby('op_group').agg(**agg_rules).reset_index()
+    sub_op_totals = df_details.drop_duplicates(subset=['lote_descricao'])
+    total_historico_map = sub_op_totals.groupby('op_group')['total_historico_lote'].sum()
+    df_summary['total_historico_lote'] = df_summary['op_group'].map(total_historico_map)
+    df_summary = df_summary.rename(columns={'op_group': 'lote_descricao'})
+    today = pd.to_datetime('today').normalize()
+    df_summary['status'] = 'futuro'
+    on_time_mask = (df_summary['corte_dtini'].notna()) & (df_summary['orddtprev'].notna()) & (df_summary['corte_dtini'] <= today) & (df_summary['orddtprev'] >= today)
+    df_summary.loc[on_time_mask, 'status'] = 'em_dia'
+    delayed_mask = (df_summary['orddtprev'].notna()) & (df_summary['orddtprev'] < today)
+    df_summary.loc[delayed_mask, 'status'] = 'atrasado'
+    for df_to_format in [df_summary, df_details]:
+        if not df_to_format.empty:
+            sort_cols = ['corte_dtini']
+            sort_cols.append('ordem' if 'ordem' in df_to_format.columns else 'lote_descricao')
+            df_to_format.sort_values(by=sort_cols, na_position='last', inplace=True)
+            date_cols = [col for col in ['orddtprev', 'orddtence', 'lotdtini', 'lotdtpre', 'corte_dtini', 'data_inicio_prevista', 'data_fim_prevista'] if col in df_to_format.columns]
+            for col in date_cols:
+                if pd.api.types.is_datetime64_any_dtype(df_to_format[col]):
+                    df_to_format[col] = df_to_format[col].dt.strftime('%Y-%m-%d')
+    return {
+        "is_grouped": True,
+        "summary": df_summary.fillna('').to_dict('records'),
+        "details": df_details.fillna('').to_dict('records')
+    }
+
+
+def _engine_summary(df_processed):
+    df_summary, df_details = summarize_grouped(df_processed)
+    return {"is_grouped": True, "summary": frame_records(df_summary), "details": frame_records(df_details)}
+
+
+def make_frame(rows, lots, seed=1):
+    """Frame no formato da saída de process_data (datas já convertidas, status calculado)."""
+    rnd = random.Random(seed)
+    today = date.today()
+    lot_rows = []
+    for i in range(lots):
+        start = today + timedelta(days=rnd.randint(-30, 30))
+        end = start + timedelta(days=rnd.randint(1, 20))
+        name = f"Petra OP {100 + i // 3}/25 parte {i}" if i % 4 else f"Solare lote {i}"
+        lot_rows.append((name, start, end, float(rnd.randint(100, 5000))))
+    picks = [lot_rows[rnd.randrange(lots)] for _ in range(rows)]
+    df = pd.DataFrame({
+        'ordem': np.arange(rows) + 1000,
+        'produto': [f'P{rnd.randint(1, 500):04d}' for _ in range(rows)],
+        'saldo_pendente': [float(rnd.randint(0, 40)) for _ in range(rows)],
+        'devolucao_saldo': [float(rnd.randint(0, 3)) for _ in range(rows)],
+        'lote_descricao': [p[0] if rnd.random() > 0.01 else None for p in picks],
+        'corte_dtini': pd.to_datetime([p[1] for p in picks]),
+        'orddtprev': pd.to_datetime([p[2] for p in picks]),
+        'total_historico_lote': [p[3] for p in picks],
+    })
+    df['data_inicio_prevista'] = df['corte_dtini'].dt.strftime('%Y-%m-%d')
+    df['data_fim_prevista'] = df['orddtprev'].dt.strftime('%Y-%m-%d')
+    df['status'] = 'em_dia'
+    return df
+
+
+def best_of(func, frame, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        df = frame.copy()
+        started = time.perf_counter()
+        result = func(df)
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    lots = int(sys.argv[2]) if len(sys.argv) > 2 else 2_000
+    frame = make_frame(rows, lots)
+
+    legacy_time, legacy_payload = best_of(_legacy_summary, frame)
+    engine_time, engine_payload = best_of(_engine_summary, frame)
+
+    same = json.dumps(legacy_payload, sort_keys=True, default=str) == json.dumps(engine_payload, sort_keys=True, default=str)
+    assert same, "Payloads divergentes"
+    print(f"{rows} linhas, {lots} lotes, {len(engine_payload['summary'])} grupos de OP (payload idêntico)")
+    print(f"  implementação anterior: {legacy_time * 1000:8.1f} ms")
+    print(f"  summarize_grouped:      {engine_time * 1000:8.1f} ms")
+    print(f"  ganho:                  {legacy_time / engine_time:8.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Benchmark da serialização do /api/data: jsonify(fillna('').to_dict('records')) versus encode_records.
+
+Confere que os bytes são idênticos aos do jsonify e mede tempo e pico de memória (tracemalloc).
+Uso: python benchmarks/bench_json_encoding.py [linhas] [lotes]
+"""
+import os
+import sys
+import time
+import tracemalloc
+from datetime import date
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+from flask import Flask, jsonify
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from json_encoding import encode_records  # noqa: E402
+from bench_grouped_summary import make_frame  # noqa: E402
+
+
+def _edge_frame():
+    """Tipos que aparecem nos monitores e nas rotas de concluídos/devoluções, com ausentes."""
+    return pd.DataFrame({
+        'texto': ['Petra "OP" 1/25', 'ção ', None, ''],
+        'inteiro': [1, 2, 3, 4],
+        'real': [1.5, -0.0, np.nan, 1e20],
+        'data_obj': [date(2025, 1, 2), None, date(2025, 3, 4), date(2025, 1, 2)],
+        'timestamp': pd.to_datetime(['2025-01-02 10:00', '2025-02-01 08:30', '2025-01-03 00:00', '2025-01-02 10:00']),
+        'decimal': [Decimal('1.50'), None, Decimal('2'), Decimal('1.50')],
+        'misto': [1, 1.0, True, 'x'],
+        'booleano': [True, False, True, False],
+    })
+
+
+def measure(func, frame, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(frame)
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    func(frame)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings), peak, result
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    lots = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    frame = make_frame(rows, lots)
+    for col in ['corte_dtini', 'orddtprev']:
+        frame[col] = frame[col].dt.strftime('%Y-%m-%d')
+
+    app = Flask(__name__)
+    with app.app_context():
+        def legacy(df):
+            return jsonify(df.fillna('').to_dict('records')).get_data()
+
+        def encoded(df):
+            return (encode_records(df) + '\n').encode('ascii')
+
+        edge = _edge_frame()
+        assert legacy(edge) == encoded(edge), "Bytes divergentes (tipos de borda)"
+        assert legacy(frame.iloc[:0]) == encoded(frame.iloc[:0]), "Bytes divergentes (frame vazio)"
+
+        legacy_time, legacy_peak, legacy_body = measure(legacy, frame)
+        encoded_time, encoded_peak, encoded_body = measure(encoded, frame)
+
+    assert legacy_body == encoded_body, "Bytes divergentes"
+    print(f"{rows} linhas, {len(frame.columns)} colunas, {len(encoded_body) / 1e6:.1f} MB (bytes idênticos)")
+    print(f"  jsonify(to_dict):  {legacy_time * 1000:8.1f} ms  pico {legacy_peak / 1e6:7.1f} MB")
+    print(f"  encode_records:    {encoded_time * 1000:8.1f} ms  pico {encoded_peak / 1e6:7.1f} MB")
+    print(f"  ganho:             {legacy_time / encoded_time:8.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Microbenchmark do parsing das datas de fase do lote_trans (linha a linha versus vetorizado).
+
+Uso: python benchmarks/bench_phase_dates.py [linhas] [lotes]
+"""
+import os
+import random
+import re
+import sys
+import time
+from datetime import date, timedelta
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data_processing import parse_dates_series, _phase_date_pattern  # noqa: E402
+
+
+def _legacy_parse_phase_dates(text, phase_name):
+    """Implementação anterior: regex montada a cada chamada, aplicada linha a linha."""
+    if not text or not phase_name: return None, None
+    try:
+        pattern = rf"\b{re.escape(phase_name)}\b:\s*(\d{{2}}/\d{{2}}/\d{{2,4}})\s*-\s*(\d{{2}}/\d{{2}}/\d{{2,4}})"
+        m = re.search(pattern, str(text), flags=re.IGNORECASE)
+        if not m: return None, None
+        def to_iso(s):
+            parts = s.split('/')
+            if len(parts) != 3: return None
+            dd, mm, yy = parts
+            if len(yy) == 2: yy = '20' + yy
+            return f"{yy}-{mm}-{dd}"
+        return to_iso(m.group(1)), to_iso(m.group(2))
+    except Exception:
+        return None, None
+
+
+def make_lote_trans(rows, lots, seed=1):
+    rnd = random.Random(seed)
+    today = date.today()
+    phases = ['CORTE', 'PRENSA', 'USINAGEM', 'MONTAGEMSEP', 'MONTAGEM', 'PREACABAMENT', 'ACABAMENTO', 'TAPECARIA(136)']
+    texts = []
+    for _ in range(lots):
+        parts = []
+        for phase in phases:
+            start = today + timedelta(days=rnd.randint(-30, 30))
+            end = start + timedelta(days=rnd.randint(1, 20))
+            parts.append(f"{phase}: {start:%d/%m/%y} - {end:%d/%m/%y}")
+        texts.append(' '.join(parts))
+    return pd.Series([texts[rnd.randrange(lots)] if rnd.random() > 0.02 else None for _ in range(rows)])
+
+
+def best_of(func, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    lots = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    lote_trans = make_lote_trans(rows, lots)
+    phase = 'MONTAGEM'
+
+    def legacy():
+        dates = lote_trans.fillna('').apply(lambda x: _legacy_parse_phase_dates(x, phase))
+        return pd.DataFrame(dates.tolist(), index=lote_trans.index)
+
+    def vectorized():
+        start, end = parse_dates_series(lote_trans, _phase_date_pattern(phase))
+        return pd.DataFrame({0: start, 1: end})
+
+    legacy_time, legacy_result = best_of(legacy)
+    vectorized_time, vectorized_result = best_of(vectorized)
+
+    assert legacy_result.fillna('').astype(str).equals(vectorized_result.fillna('').astype(str)), "Resultados divergentes"
+    print(f"{rows} linhas, {lots} lote_trans distintos, fase {phase}")
+    print(f"  linha a linha (apply): {legacy_time * 1000:8.1f} ms")
+    print(f"  vetorizado:            {vectorized_time * 1000:8.1f} ms")
+    print(f"  ganho:                 {legacy_time / vectorized_time:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+import re
+import select
+import sys
+import threading
+import time
+from datetime import date
+from config import engine, execute_ddl, fq, table_exists, get_lot_table, schema_catalog, fetch_data_from_db, DB_SCHEMA, CHANGE_PROBE_TTL_SECONDS
+
+# Canal e nome do gatilho usados no modo push (LISTEN/NOTIFY)
+CHANGE_CHANNEL = 'sigprod_changes'
+NOTIFY_TRIGGER = 'sigprod_notify_change'
+
+_WORD_RE = re.compile(r'\b\w+\b')
+
+
+def source_tables():
+    """Tabelas do ERP lidas pelos monitores, candidatas ao gatilho de notificação."""
+    tables = ['pasfase', 'planilha', 'toqmovi', 'reqordem', 'ordem', get_lot_table(), 'produto', 'processo', 'perdas']
+    return [t for t in tables if table_exists(t)]
+
+
+def tables_in_sql(sql):
+    """Tabelas do catálogo referenciadas no SQL (inclui views materializadas e o ledger do SIGPROD)."""
+    columns = schema_catalog.columns() or {}
+    return sorted({word for word in _WORD_RE.findall(sql) if word in columns})
+
+
+class ChangeTracker:
+    """Contadores de modificação por tabela usados como impressão digital barata dos dados dos monitores.
+
+    Por padrão consulta pg_stat_user_tables (inserções + atualizações + exclusões). Com o ouvinte
+    LISTEN/NOTIFY ativo, as tabelas com o gatilho do SIGPROD passam a ser contadas em memória, sem consulta.
+    As estatísticas do Postgres chegam com até ~1s de atraso após o commit.
+    """
+
+    def __init__(self, probe_ttl):
+        self.probe_ttl = probe_ttl
+        self._lock = threading.Lock()
+        self._probe = None
+        self._probed_at = 0.0
+        self._notified = {}
+        self._pushed_tables = set()
+        self._listening = False
+        # Incrementado a cada (re)conexão do ouvinte: notificações perdidas no intervalo invalidam tudo
+        self._epoch = 0
+        self._listener = None
+        self._stop = threading.Event()
+
+    def invalidate(self):
+        """Força uma nova consulta ao pg_stat_user_tables na próxima impressão digital."""
+        with self._lock:
+            self._probe = None
+
+    def _probe_counters(self):
+        with self._lock:
+            if self._probe is not None and time.monotonic() - self._probed_at < self.probe_ttl:
+                return self._probe
+        query = """
+            SELECT relname, n_tup_ins + n_tup_upd + n_tup_del AS modificacoes
+            FROM pg_stat_user_tables
+            WHERE schemaname = %(schema)s
+        """
+        df, error = fetch_data_from_db(query, params={'schema': DB_SCHEMA or 'public'})
+        if error:
+            return None
+        probe = dict(zip(df['relname'], df['modificacoes'].astype(int)))
+        with self._lock:
+            self._probe = probe
+            self._probed_at = time.monotonic()
+        return probe
+
+    def fingerprint(self, tables):
+        """Impressão digital das tabelas (com a data de hoje, que muda o status dos lotes), ou None se indisponível."""
+        with self._lock:
+            pushed = self._pushed_tables if self._listening else set()
+            notified = dict(self._notified)
+            epoch = self._epoch
+        probe = {}
+        if any(t not in pushed for t in tables):
+            probe = self._probe_counters()
+            if probe is None:
+                return None
+        values = tuple(
+            (t, 'push', epoch, notified.get(t, 0)) if t in pushed else (t, probe.get(t))
+            for t in sorted(tables)
+        )
+        return (date.today().isoformat(), values)
+
+    # --- Modo push (LISTEN/NOTIFY) ---
+    def start_listener(self):
+        """Inicia a thread que escuta as notificações dos gatilhos (idempotente)."""
+        if self._listener and self._listener.is_alive():
+            return
+        self._stop.clear()
+        self._listener = threading.Thread(target=self._listen, name='sigprod-change-listener', daemon=True)
+        self._listener.start()
+
+    def stop_listener(self):
+        self._stop.set()
+        if self._listener:
+            self._listener.join()
+
+    def _listen(self):
+        while not self._stop.is_set():
+            connection = None
+            try:
+                connection = engine.raw_connection()
+                connection.set_session(autocommit=True)
+                cursor = connection.cursor()
+                cursor.execute(
+                    "SELECT DISTINCT c.relname FROM pg_trigger t JOIN pg_class c ON c.oid = t.tgrelid "
+                    "JOIN pg_namespace n ON n.oid = c.relnamespace WHERE t.tgname = %(trigger)s AND n.nspname = %(schema)s",
+                    {'trigger': NOTIFY_TRIGGER, 'schema': DB_SCHEMA or 'public'}
+                )
+                pushed = {row[0] for row in cursor.fetchall()}
+                cursor.execute(f"LISTEN {CHANGE_CHANNEL}")
+                with self._lock:
+                    self._pushed_tables = pushed
+                    self._epoch += 1
+                    self._listening = True
+                print(f"Ouvindo alterações via NOTIFY em: {', '.join(sorted(pushed)) or 'nenhuma tabela'}")
+
+                while not self._stop.is_set():
+                    if select.select([connection], [], [], 5) == ([], [], []):
+                        continue
+                    connection.poll()
+                    with self._lock:
+                        while connection.notifies:
+                            table = connection.notifies.pop(0).payload
+                            self._notified[table] = self._notified.get(table, 0) + 1
+            except Exception as e:
+                print(f"Falha no ouvinte de alterações (voltando ao pg_stat_user_tables): {e}")
+                with self._lock:
+                    self._listening = False
+                if connection is not None:
+                    connection.invalidate()
+                    connection = None
+                self._stop.wait(5)
+            finally:
+                if connection is not None:
+                    connection.close()
+        with self._lock:
+            self._listening = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'modo': 'push' if self._listening else 'pg_stat',
+                'tabelas_com_gatilho': sorted(self._pushed_tables),
+                'notificacoes': dict(self._notified),
+            }
+
+
+change_tracker = ChangeTracker(CHANGE_PROBE_TTL_SECONDS)
+
+
+def install_notify_triggers():
+    """Cria a função e os gatilhos por instrução que publicam o nome da tabela alterada no canal do SIGPROD."""
+    tables = source_tables()
+    statements = [f"""
+        CREATE OR REPLACE FUNCTION {fq(NOTIFY_TRIGGER)}() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            PERFORM pg_notify('{CHANGE_CHANNEL}', TG_TABLE_NAME);
+            RETURN NULL;
+        END
+        $$
+    """]
+    for table in tables:
+        statements.append(f"DROP TRIGGER IF EXISTS {NOTIFY_TRIGGER} ON {fq(table)}")
+        statements.append(
+            f"CREATE TRIGGER {NOTIFY_TRIGGER} AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {fq(table)} "
+            f"FOR EACH STATEMENT EXECUTE PROCEDURE {fq(NOTIFY_TRIGGER)}()"
+        )
+    execute_ddl(statements)
+    return tables
+
+
+def drop_notify_triggers():
+    """Remove os gatilhos e a função de notificação do SIGPROD."""
+    statements = [f"DROP TRIGGER IF EXISTS {NOTIFY_TRIGGER} ON {fq(table)}" for table in source_tables()]
+    statements.append(f"DROP FUNCTION IF EXISTS {fq(NOTIFY_TRIGGER)}()")
+    execute_ddl(statements)
+
+
+if __name__ == '__main__':
+    # Uso: python change_detection.py [install-triggers|drop-triggers]
+    command = sys.argv[1] if len(sys.argv) > 1 else 'install-triggers'
+    if command == 'install-triggers':
+        print(f"Gatilhos criados em: {install_notify_triggers()}")
+    elif command == 'drop-triggers':
+        drop_notify_triggers()
+        print("Gatilhos removidos")
+    else:
+        print(f"Comando desconhecido: {command}")
+        sys.exit(1)
@@ -0,0 +1,102 @@
+"""Canais multiplexados: várias fases e tipos de monitor numa única conexão (/api/stream/multi e /api/batch).
+
+Um canal é `<tipo>:<fase>`:
+  data:<fase>        payload do /api/data (delta desde a versão do cliente)
+  devolucoes:<fase>  lista do /api/devolucoes (fases 25, 30 e 999)
+  completed:<fase>   OPs concluídas e quantidade produzida por lote
+
+O cursor do cliente guarda a versão de cada canal (`data:5=1712,devolucoes:25=ab12`); só os canais cujo
+conteúdo mudou desde o cursor são enviados. Todos os canais leem os snapshots compartilhados entre as telas.
+"""
+import json
+from snapshots import (
+    MONITOR_MODULES, DEVOLUCOES_FASES, get_production_snapshot, get_devolucoes_snapshot,
+    get_completed_counts_snapshot, snapshot_versions
+)
+
+CHANNEL_KINDS = ('data', 'devolucoes', 'completed')
+
+
+def parse_channels(param):
+    """Lista de canais (nome, tipo, fase) a partir de `data:5,devolucoes:25,...`; retorna (canais, erro)."""
+    channels = []
+    for name in (param or '').split(','):
+        name = name.strip()
+        if not name:
+            continue
+        kind, _, fase = name.partition(':')
+        if kind not in CHANNEL_KINDS or not fase.isdigit():
+            return None, f"Canal inválido '{name}' (use {'|'.join(CHANNEL_KINDS)}:<fase>)"
+        fase = int(fase)
+        valid = DEVOLUCOES_FASES if kind == 'devolucoes' else MONITOR_MODULES
+        if fase not in valid:
+            return None, f"Fase {fase} sem canal {kind}"
+        name = f"{kind}:{fase}"
+        if name not in (channel[0] for channel in channels):
+            channels.append((name, kind, fase))
+    if not channels:
+        return None, "Nenhum canal informado (parâmetro canais)"
+    return channels, None
+
+
+def parse_cursor(value):
+    """{canal: versão} a partir de `data:5=1712,devolucoes:25=ab12` (vazio se ausente)."""
+    cursor = {}
+    for item in (value or '').split(','):
+        name, _, version = item.strip().partition('=')
+        if name and version:
+            cursor[name] = version
+    return cursor
+
+
+def format_cursor(cursor):
+    return ','.join(f"{name}={version}" for name, version in cursor.items())
+
+
+def channel_update(channel, since, lot_table, ord_col, qtd_col):
+    """(versão atual, corpo JSON ou None se o cliente já está nela, erro) de um canal desde a versão `since`."""
+    name, kind, fase = channel
+    if kind == 'data':
+        key = (fase, lot_table, ord_col, qtd_col)
+        payload, error = get_production_snapshot(fase, lot_table, ord_col, qtd_col)
+        if error:
+            return None, None, error
+        since = int(since) if since and since.isdigit() else None
+        version, previous = snapshot_versions.resolve(key, payload, since)
+        if version == since:
+            return str(version), None, None
+        return str(version), payload.delta_body(version, since, previous), None
+
+    if kind == 'devolucoes':
+        snapshot, error = get_devolucoes_snapshot(fase, lot_table)
+    else:
+        snapshot, error = get_completed_counts_snapshot(fase, lot_table, ord_col, qtd_col)
+    if error:
+        return None, None, error
+    # Listas pequenas e sem histórico: a versão é a ETag do conteúdo e a resposta é sempre a lista inteira
+    version = snapshot.etag('rows', snapshot.body)
+    if version == since:
+        return version, None, None
+    return version, snapshot.body, None
+
+
+def channel_message(name, body):
+    """Mensagem marcada com o canal, sem decodificar o corpo já serializado."""
+    return f'{{"canal":{json.dumps(name)},"dados":{body.decode("ascii").rstrip()}}}'
+
+
+def batch_body(channels, cursor, lot_table, ord_col, qtd_col):
+    """Resposta do /api/batch: canais alterados desde o cursor, erros por canal e o novo cursor."""
+    updates, errors = [], {}
+    cursor = dict(cursor)
+    for channel in channels:
+        name = channel[0]
+        version, body, error = channel_update(channel, cursor.get(name), lot_table, ord_col, qtd_col)
+        if error:
+            errors[name] = error
+            continue
+        cursor[name] = version
+        if body is not None:
+            updates.append(f'{json.dumps(name)}:{body.decode("ascii").rstrip()}')
+    current = format_cursor({channel[0]: cursor[channel[0]] for channel in channels if channel[0] in cursor})
+    return (f'{{"canais":{{{",".join(updates)}}},"cursor":{json.dumps(current)},"erros":{json.dumps(errors)}}}\n').encode('ascii')
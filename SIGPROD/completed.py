@@ -0,0 +1,312 @@
+"""Consulta dos concluídos por fase (/api/completed, jobs de exportação) com filtro de lote e paginação por chave.
+
+O filtro de lote é repassado ao get_completed_query de cada monitor, que o aplica também dentro dos CTEs de
+quantidade (pasfase, planilha, toqmovi); a paginação usa a chave (data_conclusao, ordem) com LIMIT em vez de OFFSET,
+então abrir o modal de concluídos de um lote custa proporcional ao lote, e o banco só ordena os primeiros da página.
+
+Sem paginação, o resultado é guardado por (fase, lote): as telas pedem conjuntos de lotes que mudam a cada
+atualização, e cada pedido é montado das peças em cache, buscando só os lotes ausentes numa única consulta.
+Cada peça vale enquanto a marca de produção do seu lote não muda: linhas e maior xmin, por tabela lida pela
+query, das linhas das ordens do lote (uma consulta barata para todos os lotes pedidos). Um apontamento no lote A
+invalida só a peça de A.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+import pandas as pd
+from config import (
+    fq, fetch_data_from_db, COMPLETED_PAGE_MAX_ORDERS, COMPLETED_CACHE_ENABLED, COMPLETED_CACHE_MAX_BYTES,
+    COMPLETED_CACHE_MAX_AGE_SECONDS
+)
+from aggregates import PASFASE_MV, PLANILHA_MV, TOQMOVI_MV, TOQMOVI_LEDGER
+from change_detection import tables_in_sql
+from snapshots import EMPTY_COMPLETED_QUERY
+
+# Separador entre data e ordem no cursor da paginação (ex.: 2025-03-14|123456)
+_CURSOR_SEPARATOR = '|'
+
+
+def parse_lotes(param):
+    """Lista de lotes de um parâmetro separado por vírgulas, ou None se vazio."""
+    if not param:
+        return None
+    lotes = [lote.strip() for lote in param.split(',') if lote.strip()]
+    return lotes or None
+
+
+def completed_query(monitor_module, fase, lot_table, ord_col, qtd_col, lotes=None):
+    """(SQL, params) dos concluídos da fase, com o filtro de lote empurrado para os CTEs do monitor."""
+    params = {'fase': fase}
+    lote_filter_clause = ""
+    if lotes:
+        lote_filter_clause = "AND l.lotdes = ANY(%(lotes)s)"
+        params['lotes'] = list(lotes)
+    return monitor_module.get_completed_query(fq, lot_table, ord_col, qtd_col, lote_filter_clause), params
+
+
+def parse_page(limite_param, cursor_param):
+    """((limite, cursor), erro) dos parâmetros de paginação; limite None quando a paginação não foi pedida.
+
+    O limite conta linhas (uma por ordem, exceto nas saídas, que têm uma por produto); uma página nunca divide
+    uma ordem ao meio: a última ordem cortada pelo limite vem completa.
+    """
+    if limite_param is None:
+        if cursor_param:
+            return (None, None), "Parâmetro cursor exige limite"
+        return (None, None), None
+    try:
+        limite = int(limite_param)
+    except ValueError:
+        return (None, None), f"Limite inválido: {limite_param}"
+    if not 1 <= limite <= COMPLETED_PAGE_MAX_ORDERS:
+        return (None, None), f"Limite deve estar entre 1 e {COMPLETED_PAGE_MAX_ORDERS}"
+    if not cursor_param:
+        return (limite, None), None
+    data, separator, ordem = cursor_param.partition(_CURSOR_SEPARATOR)
+    try:
+        date.fromisoformat(data[:10])
+    except ValueError:
+        return (None, None), f"Cursor inválido: {cursor_param}"
+    if not separator or not ordem:
+        return (None, None), f"Cursor inválido: {cursor_param}"
+    return (limite, (data, ordem)), None
+
+
+def paged_query(query, params, limite, cursor=None):
+    """Página da consulta de concluídos: as `limite` linhas seguintes ao cursor na ordem (data_conclusao DESC, ordem).
+
+    Traz também a linha seguinte (LIMIT limite + 1), que indica se há mais páginas e se a última ordem foi cortada.
+    """
+    params = dict(params, limite_pagina=limite + 1)
+    after = ""
+    if cursor is not None:
+        # (data_conclusao DESC, ordem ASC): direções opostas, então a comparação de linha (a, b) < (x, y) não serve
+        after = """WHERE c.data_conclusao < %(cursor_data)s
+               OR (c.data_conclusao = %(cursor_data)s AND c.ordem > %(cursor_ordem)s)"""
+        params['cursor_data'], params['cursor_ordem'] = cursor
+    paged = f"""
+        SELECT c.* FROM ({query}) c
+        {after}
+        ORDER BY c.data_conclusao DESC, c.ordem
+        LIMIT %(limite_pagina)s
+    """
+    return paged, params
+
+
+def order_query(query, params, data, ordem):
+    """Todas as linhas (produtos) de uma ordem da consulta de concluídos: completa a última ordem da página."""
+    params = dict(params, ordem_data=data, ordem_pagina=ordem)
+    return f"""
+        SELECT c.* FROM ({query}) c
+        WHERE c.data_conclusao = %(ordem_data)s AND c.ordem = %(ordem_pagina)s
+    """, params
+
+
+def split_page(df, limite):
+    """(linhas da página, cursor da próxima página ou None, ordem cortada ou None) a partir do resultado de paged_query.
+
+    A ordem cortada é a (data_conclusao, ordem) da última linha quando a linha seguinte ao limite é da mesma ordem;
+    as linhas dessa ordem na página estão incompletas.
+    """
+    if len(df) <= limite:
+        return df.reset_index(drop=True), None, None
+    page = df.iloc[:limite].reset_index(drop=True)
+    last, following = page.iloc[-1], df.iloc[limite]
+    next_cursor = f"{last['data_conclusao']}{_CURSOR_SEPARATOR}{last['ordem']}"
+    cut = None
+    if following['data_conclusao'] == last['data_conclusao'] and following['ordem'] == last['ordem']:
+        cut = (last['data_conclusao'], last['ordem'])
+    return page, next_cursor, cut
+
+
+def fetch_page(query, params, limite, cursor=None):
+    """((linhas da página, cursor da próxima página ou None), erro): a página e, se cortada, o resto da última ordem.
+
+    A existência de mais páginas é estimada pela linha seguinte; se ela era da própria ordem completada, a página
+    seguinte pode vir vazia e sem cursor.
+    """
+    if query.strip() == EMPTY_COMPLETED_QUERY:
+        # Monitor sem as tabelas necessárias: página vazia, sem colunas para ordenar
+        return (pd.DataFrame(), None), None
+    df, error = fetch_data_from_db(*paged_query(query, params, limite, cursor))
+    if error:
+        return (None, None), error
+    page, next_cursor, cut = split_page(df, limite)
+    if cut is not None:
+        rows, error = fetch_data_from_db(*order_query(query, params, *cut))
+        if error:
+            return (None, None), error
+        same = (page['data_conclusao'] == cut[0]) & (page['ordem'] == cut[1])
+        page = pd.concat([page[~same], rows], ignore_index=True)
+    return (page, next_cursor), None
+
+
+class CompletedLotCache:
+    """Concluídos por (fase, lote) com a marca d'água dos dados, despejados por LRU acima de `max_bytes`."""
+
+    def __init__(self, max_bytes, max_age):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._stats = {'acertos': 0, 'faltas': 0, 'invalidadas': 0, 'despejadas': 0, 'consultas': 0}
+
+    def get(self, key, watermark):
+        """Peça do lote se ainda vale para a marca d'água atual, senão None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] != watermark or time.monotonic() - entry[1] > self.max_age):
+                self._drop(key)
+                self._stats['invalidadas'] += 1
+                entry = None
+            if entry is None:
+                self._stats['faltas'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['acertos'] += 1
+            return entry[2]
+
+    def put(self, key, watermark, frame):
+        size = int(frame.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (watermark, time.monotonic(), frame, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self._stats['despejadas'] += 1
+
+    def _drop(self, key):
+        self._bytes -= self._entries.pop(key)[3]
+
+    def count_query(self):
+        with self._lock:
+            self._stats['consultas'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, pecas=len(self._entries), bytes=self._bytes, max_bytes=self.max_bytes)
+
+
+completed_cache = CompletedLotCache(COMPLETED_CACHE_MAX_BYTES, COMPLETED_CACHE_MAX_AGE_SECONDS)
+
+
+# Maior xmin das linhas: muda quando uma linha é incluída ou alterada
+_XMIN_MARKER = "CAST(MAX(CAST(CAST(x.xmin AS TEXT) AS BIGINT)) AS TEXT)"
+
+# Tabelas de movimento (e seus agregados do SIGPROD) que os concluídos leem: ligação à ordem do lote e marca.
+# Ligação None é a coluna de ordem da pasfase (ord_col). O ledger regrava a janela recente a cada atualização,
+# então sua marca é o conteúdo (soma e última data), não o xmin.
+_LOT_MARKERS = {
+    'pasfase': (None, _XMIN_MARKER),
+    PASFASE_MV: ("x.ordem = ol.ordem", _XMIN_MARKER),
+    'planilha': ("CAST(x.plaordem AS TEXT) = CAST(ol.ordem AS TEXT)", _XMIN_MARKER),
+    PLANILHA_MV: ("CAST(x.plaordem AS TEXT) = CAST(ol.ordem AS TEXT)", _XMIN_MARKER),
+    'toqmovi': ("x.priordem = ol.ordem", _XMIN_MARKER),
+    TOQMOVI_MV: ("x.priordem = ol.ordem", _XMIN_MARKER),
+    TOQMOVI_LEDGER: ("x.priordem = ol.ordem", "CONCAT(SUM(x.qtd), '|', MAX(x.ultima_data))"),
+    'reqordem': ("x.reqord = ol.ordem", _XMIN_MARKER),
+}
+
+
+def lot_markers_query(tables, lot_table, ord_col, lotes=None):
+    """(SQL, params) da marca de produção por lote: (tabela, linhas, marca) das linhas das ordens do lote.
+
+    Inclusões mudam as linhas, alterações o xmin e exclusões as linhas; o custo acompanha os lotes pedidos
+    (sem lotes, todos os lotes da tabela de lotes da fase).
+    """
+    parts = [f"""
+        SELECT ol.lote_descricao, 'ordem' AS tabela, COUNT(*) AS linhas,
+               CAST(MAX(CAST(CAST(ol.xmin_ordem AS TEXT) AS BIGINT)) AS TEXT) AS marca
+        FROM ordens_lote ol GROUP BY ol.lote_descricao
+    """]
+    for table in tables:
+        if table not in _LOT_MARKERS:
+            continue
+        join, marker = _LOT_MARKERS[table]
+        join = join or f"x.{ord_col} = ol.ordem"
+        parts.append(f"""
+        SELECT ol.lote_descricao, '{table}' AS tabela, COUNT(*) AS linhas, {marker} AS marca
+        FROM ordens_lote ol JOIN {fq(table)} x ON {join}
+        GROUP BY ol.lote_descricao
+    """)
+    where = "WHERE l.lotdes = ANY(%(lotes)s)" if lotes else ""
+    query = f"""
+        WITH ordens_lote AS (
+            SELECT l.lotdes AS lote_descricao, o.ordem, o.xmin AS xmin_ordem
+            FROM {fq('ordem')} o JOIN {fq(lot_table)} l ON l.lotcod = o.lotcod
+            {where}
+        )
+        {' UNION ALL '.join(parts)}
+    """
+    return query, ({'lotes': list(lotes)} if lotes else {})
+
+
+def lot_watermarks(monitor_module, fase, lot_table, ord_col, qtd_col, lotes):
+    """{lote: marca d'água} dos lotes pedidos, numa consulta; None se o catálogo ou a consulta falharem.
+
+    A data entra porque ordens abertas concluem hoje.
+    """
+    query, _ = completed_query(monitor_module, fase, lot_table, ord_col, qtd_col)
+    tables = tables_in_sql(query)
+    if not tables:
+        return None
+    markers, error = fetch_data_from_db(*lot_markers_query(tables, lot_table, ord_col, lotes))
+    if error:
+        return None
+    today = date.today().isoformat()
+    by_lot = {lote: [] for lote in lotes}
+    for lote, tabela, linhas, marca in markers[['lote_descricao', 'tabela', 'linhas', 'marca']].itertuples(index=False):
+        if lote in by_lot:
+            by_lot[lote].append((tabela, int(linhas), None if pd.isna(marca) else str(marca)))
+    return {lote: (today, tuple(sorted(values))) for lote, values in by_lot.items()}
+
+
+def _sorted_completed(frames):
+    # Mesma ordem da query de concluídos: data de conclusão decrescente e ordem
+    df = pd.concat([frame for frame in frames if not frame.empty] or frames[:1], ignore_index=True)
+    return df.sort_values(['data_conclusao', 'ordem'], ascending=[False, True], kind='stable').reset_index(drop=True)
+
+
+def cached_completed(monitor_module, fase, lot_table, ord_col, qtd_col, lotes):
+    """(frame, erro) dos concluídos dos lotes, montado das peças por lote; os lotes ausentes vêm numa só consulta."""
+    lotes = list(dict.fromkeys(lotes))
+    watermarks = lot_watermarks(monitor_module, fase, lot_table, ord_col, qtd_col, lotes) if COMPLETED_CACHE_ENABLED else None
+    if watermarks is None:
+        query, params = completed_query(monitor_module, fase, lot_table, ord_col, qtd_col, lotes)
+        return fetch_data_from_db(query, params=params)
+
+    pieces, missing = {}, []
+    for lote in lotes:
+        piece = completed_cache.get((fase, lot_table, ord_col, qtd_col, lote), watermarks[lote])
+        if piece is None:
+            missing.append(lote)
+        else:
+            pieces[lote] = piece
+
+    if missing:
+        query, params = completed_query(monitor_module, fase, lot_table, ord_col, qtd_col, missing)
+        df, error = fetch_data_from_db(query, params=params)
+        if error:
+            return None, error
+        completed_cache.count_query()
+        if 'lote_descricao' not in df.columns:
+            # Monitor sem as tabelas necessárias (SELECT 1 WHERE 1=0): nada a guardar
+            return df, None
+        positions = df.groupby('lote_descricao', sort=False).indices
+        for lote in missing:
+            piece = df.iloc[positions.get(lote, [])].reset_index(drop=True)
+            completed_cache.put((fase, lot_table, ord_col, qtd_col, lote), watermarks[lote], piece)
+            pieces[lote] = piece
+
+    return _sorted_completed([pieces[lote] for lote in dict.fromkeys(lotes)]), None
@@ -0,0 +1,90 @@
+"""Compressão gzip/brotli das respostas, feita uma vez por conteúdo e escolhida pelo Accept-Encoding."""
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+from flask import Response, current_app, request, send_from_directory
+from werkzeug.security import safe_join
+from config import COMPRESSION_ENABLED, COMPRESSION_MIN_BYTES, COMPRESSION_GZIP_LEVEL, COMPRESSION_BROTLI_QUALITY
+
+try:
+    import brotli
+except ImportError:  # brotli é opcional; sem ele só gzip
+    brotli = None
+
+# Em ordem de preferência quando o cliente aceita ambas com o mesmo peso
+CONTENT_ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+# Texto e fontes TTF; as imagens (jpg) já são comprimidas
+STATIC_COMPRESSIBLE = ('.css', '.js', '.svg', '.ttf', '.html', '.json')
+
+
+def compress(body: bytes, encoding) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+    # mtime fixo: o mesmo conteúdo gera sempre os mesmos bytes
+    return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+def accepted_encoding(size):
+    """Codificação aceita pelo cliente para um corpo de `size` bytes, ou None para enviar sem compressão."""
+    if not COMPRESSION_ENABLED or size < COMPRESSION_MIN_BYTES:
+        return None
+    accepted = request.accept_encodings
+    encoding = max(CONTENT_ENCODINGS, key=accepted.quality)
+    return encoding if accepted.quality(encoding) > 0 else None
+
+
+def variant_etag(etag, encoding):
+    """ETag forte da representação: cada codificação tem bytes diferentes, então uma ETag própria."""
+    return f"{etag}-{encoding}" if encoding else etag
+
+
+def encode_response(response, encoding):
+    """Marca a resposta com a codificação usada; Vary sempre, pois o recurso tem várias representações."""
+    if not COMPRESSION_ENABLED:
+        return response
+    response.vary.add('Accept-Encoding')
+    if encoding and response.status_code != 304:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+class StaticFiles:
+    """Arquivos estáticos comprimidos na primeira requisição e mantidos em memória enquanto não mudam no disco."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def _compressed(self, path, stat, encoding):
+        key = (path, encoding)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != (stat.st_mtime_ns, stat.st_size):
+            with open(path, 'rb') as f:
+                raw = f.read()
+            etag = variant_etag(hashlib.blake2b(raw, digest_size=16).hexdigest(), encoding)
+            entry = ((stat.st_mtime_ns, stat.st_size), compress(raw, encoding), etag)
+            with self._lock:
+                self._entries[key] = entry
+        return entry[1], entry[2]
+
+    def response(self, filename):
+        directory = os.path.join(current_app.root_path, self.directory)
+        path = safe_join(directory, filename)
+        if path is None or not filename.lower().endswith(STATIC_COMPRESSIBLE) or not os.path.isfile(path):
+            return send_from_directory(directory, filename)
+        stat = os.stat(path)
+        encoding = accepted_encoding(stat.st_size)
+        if encoding is None:
+            return encode_response(send_from_directory(directory, filename), None)
+        body, etag = self._compressed(path, stat, encoding)
+        response = Response(body, mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.make_conditional(request)
+        return encode_response(response, encoding)
+
+
+static_assets = StaticFiles('static')
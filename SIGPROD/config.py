@@ -1,4 +1,7 @@
 import os
+import tempfile
+import threading
+import time
 from dotenv import load_dotenv
 from sqlalchemy import create_engine, text
 import pandas as pd
@@ -14,6 +17,119 @@ DB_PORT = os.environ.get("DB_PORT", "5432")
 DB_NAME = os.environ.get("DB_NAME", "your_dbname")
 DB_SCHEMA = os.environ.get("DB_SCHEMA", "public").strip()
 
+# --- Configuração do Cache de Snapshots ---
+# Tempo (em segundos) que um snapshot de monitor é reaproveitado entre as TVs
+SNAPSHOT_TTL_SECONDS = float(os.environ.get("SNAPSHOT_TTL_SECONDS", "10"))
+
+# --- Configuração do Agendador de Atualização ---
+# Quando ativo, os monitores são recalculados em segundo plano e as rotas apenas leem o último snapshot
+REFRESH_SCHEDULER_ENABLED = os.environ.get("REFRESH_SCHEDULER_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+REFRESH_INTERVAL_SECONDS = float(os.environ.get("REFRESH_INTERVAL_SECONDS", "15"))
+REFRESH_WORKERS = int(os.environ.get("REFRESH_WORKERS", "4"))
+# Snapshots publicados mais antigos que isso são ignorados e a rota volta a calcular sob demanda
+REFRESH_MAX_STALENESS_SECONDS = float(os.environ.get("REFRESH_MAX_STALENESS_SECONDS", "60"))
+
+# --- Configuração do Cache de Catálogo ---
+# Intervalo (em segundos) para recarregar tabelas e colunas do schema
+SCHEMA_CACHE_TTL_SECONDS = float(os.environ.get("SCHEMA_CACHE_TTL_SECONDS", "300"))
+
+# --- Configuração de Prepared Statements ---
+# Executa as queries dos monitores como prepared statements no servidor (desative atrás de poolers em modo transação)
+PREPARED_STATEMENTS_ENABLED = os.environ.get("PREPARED_STATEMENTS_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+# O tempo de planejamento é amostrado no PREPARE e a cada N execuções (o Postgres troca plano custom/genérico após a 5ª)
+PREPARED_PLAN_SAMPLE_EVERY = int(os.environ.get("PREPARED_PLAN_SAMPLE_EVERY", "20"))
+
+# --- Configuração dos Agregados Materializados ---
+# Modo opcional: o SIGPROD cria e mantém views materializadas com os totais por ordem/fase
+MATERIALIZED_AGGREGATES_ENABLED = os.environ.get("MATERIALIZED_AGGREGATES_ENABLED", "0").strip().lower() in ("1", "true", "yes")
+MATERIALIZED_REFRESH_SECONDS = float(os.environ.get("MATERIALIZED_REFRESH_SECONDS", "300"))
+
+# --- Configuração da Detecção de Mudanças ---
+# Antes da query pesada, compara contadores de modificação das tabelas lidas e reaproveita o último resultado
+CHANGE_DETECTION_ENABLED = os.environ.get("CHANGE_DETECTION_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+CHANGE_PROBE_TTL_SECONDS = float(os.environ.get("CHANGE_PROBE_TTL_SECONDS", "5"))
+# Mesmo sem mudanças detectadas, o resultado é recalculado após esse tempo
+CHANGE_MAX_REUSE_SECONDS = float(os.environ.get("CHANGE_MAX_REUSE_SECONDS", "300"))
+# Modo push opcional: escuta os gatilhos LISTEN/NOTIFY (instale com `python change_detection.py install-triggers`)
+CHANGE_NOTIFY_ENABLED = os.environ.get("CHANGE_NOTIFY_ENABLED", "0").strip().lower() in ("1", "true", "yes")
+
+# --- Configuração da Passada Compartilhada da pasfase ---
+# Uma única leitura da pasfase por ciclo alimenta corte, prensa, usinagem e chapa (repassada como parâmetros)
+SHARED_PASFASE_ENABLED = os.environ.get("SHARED_PASFASE_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+
+# --- Configuração do Motor de Devoluções ---
+# Uma única leitura da toqmovi por ciclo dá o saldo de devolução de maciço, chapa e do /api/devolucoes (parâmetros dv_*)
+SHARED_DEVOLUCOES_ENABLED = os.environ.get("SHARED_DEVOLUCOES_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+
+# --- Configuração do Ledger Incremental da toqmovi ---
+# Modo opcional: saldos diários da toqmovi mantidos a partir de uma marca d'água, atualizando apenas os movimentos novos
+TOQMOVI_LEDGER_ENABLED = os.environ.get("TOQMOVI_LEDGER_ENABLED", "0").strip().lower() in ("1", "true", "yes")
+TOQMOVI_LEDGER_REFRESH_SECONDS = float(os.environ.get("TOQMOVI_LEDGER_REFRESH_SECONDS", "15"))
+# Cada atualização refaz também os N dias antes da marca d'água e os movimentos sem data (lançamentos retroativos)
+TOQMOVI_LEDGER_RESCAN_DAYS = int(os.environ.get("TOQMOVI_LEDGER_RESCAN_DAYS", "7"))
+# Reconstrução completa na primeira atualização do processo e depois periodicamente (alterações mais antigas)
+TOQMOVI_LEDGER_REBUILD_SECONDS = float(os.environ.get("TOQMOVI_LEDGER_REBUILD_SECONDS", "86400"))
+
+# --- Configuração dos Deltas do /api/data (since=) ---
+# Versões guardadas por monitor; um cliente mais atrasado que isso recebe o payload completo
+DELTA_HISTORY_VERSIONS = int(os.environ.get("DELTA_HISTORY_VERSIONS", "4"))
+
+# --- Configuração do Push via SSE (/api/stream) ---
+# Intervalo dos heartbeats; também é o intervalo de consulta ao snapshot quando o agendador está desligado
+STREAM_HEARTBEAT_SECONDS = float(os.environ.get("STREAM_HEARTBEAT_SECONDS", "15"))
+# Tempo que o navegador espera antes de reconectar (campo retry do SSE)
+STREAM_RETRY_MS = int(os.environ.get("STREAM_RETRY_MS", "5000"))
+# Validade da contagem de concluídos por lote servida no canal completed:<fase> (consulta sobre todos os concluídos)
+COMPLETED_COUNTS_TTL_SECONDS = float(os.environ.get("COMPLETED_COUNTS_TTL_SECONDS", "60"))
+
+# --- Configuração dos Concluídos (/api/completed) ---
+# Maior página do /api/completed (parâmetro limite, em ordens)
+COMPLETED_PAGE_MAX_ORDERS = int(os.environ.get("COMPLETED_PAGE_MAX_ORDERS", "1000"))
+# Concluídos guardados por (fase, lote): qualquer conjunto de lotes é montado das peças, só os lotes ausentes vão ao banco
+# Cada peça vale enquanto a marca de produção do seu lote (linhas e xmin das ordens do lote) não muda
+COMPLETED_CACHE_ENABLED = os.environ.get("COMPLETED_CACHE_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+# Memória máxima das peças (despejo LRU) e idade máxima de uma peça, mesmo sem mudança detectada
+COMPLETED_CACHE_MAX_BYTES = int(os.environ.get("COMPLETED_CACHE_MAX_BYTES", str(64 * 1024 ** 2)))
+COMPLETED_CACHE_MAX_AGE_SECONDS = float(os.environ.get("COMPLETED_CACHE_MAX_AGE_SECONDS", "600"))
+
+# --- Configuração do Pipeline Enxuto em Memória ---
+# Textos repetidos (lotes, descrições, produtos, status) como categorias e inteiros no menor tipo possível
+LEAN_FRAMES_ENABLED = os.environ.get("LEAN_FRAMES_ENABLED", "0").strip().lower() in ("1", "true", "yes")
+# Relatório de pico de memória por requisição e por atualização de monitor (tracemalloc; serializa as medições)
+MEMORY_REPORT_ENABLED = os.environ.get("MEMORY_REPORT_ENABLED", "0").strip().lower() in ("1", "true", "yes")
+# O pandas >= 3 sempre usa copy-on-write; em versões anteriores o modo enxuto o liga para dispensar cópias defensivas
+if LEAN_FRAMES_ENABLED and int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
+# --- Configuração das Respostas JSON ---
+# JSON indentado no formato de linhas, para inspeção manual; vale só por essa variável, não pelo modo debug do Flask
+JSON_INDENT_ENABLED = os.environ.get("JSON_INDENT_ENABLED", "0").strip().lower() in ("1", "true", "yes")
+
+# --- Configuração da Compressão das Respostas ---
+# Corpos dos snapshots e arquivos estáticos comprimidos uma vez (gzip e, com o pacote brotli, br) conforme o Accept-Encoding
+COMPRESSION_ENABLED = os.environ.get("COMPRESSION_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+# Corpos menores que isso seguem sem compressão (o ganho não paga o cabeçalho e o custo na TV)
+COMPRESSION_MIN_BYTES = int(os.environ.get("COMPRESSION_MIN_BYTES", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get("COMPRESSION_BROTLI_QUALITY", "5"))
+
+# --- Configuração da Exportação (/api/export) ---
+# Linhas lidas do snapshot por vez ao montar o XLSX/CSV/Parquet
+EXPORT_CHUNK_ROWS = int(os.environ.get("EXPORT_CHUNK_ROWS", "5000"))
+
+# --- Configuração dos Jobs de Exportação (/api/export_jobs) ---
+# Extrações longas de concluídos rodam em segundo plano, com no máximo N em paralelo e M aguardando
+EXPORT_JOB_WORKERS = int(os.environ.get("EXPORT_JOB_WORKERS", "2"))
+EXPORT_JOB_MAX_PENDING = int(os.environ.get("EXPORT_JOB_MAX_PENDING", "10"))
+# Linhas lidas do banco por vez (cursor no servidor)
+EXPORT_JOB_FETCH_ROWS = int(os.environ.get("EXPORT_JOB_FETCH_ROWS", "20000"))
+# Resultados guardados em disco; removidos por idade e, acima do tamanho máximo, os mais antigos primeiro
+EXPORT_CACHE_DIR = os.environ.get("EXPORT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "sigprod_exports"))
+EXPORT_CACHE_MAX_AGE_SECONDS = float(os.environ.get("EXPORT_CACHE_MAX_AGE_SECONDS", "604800"))
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get("EXPORT_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+# Sem a marca de produção dos lotes (catálogo ou consulta indisponível), um resultado é reaproveitado só dentro desta janela
+EXPORT_CACHE_FRESH_SECONDS = float(os.environ.get("EXPORT_CACHE_FRESH_SECONDS", "900"))
+
 # URL de conexão para o SQLAlchemy
 DATABASE_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
@@ -37,39 +153,102 @@ def fetch_data_from_db(query, params=None):
         print(f"Erro ao executar a consulta com SQLAlchemy: {e}")
         return None, f"Erro ao executar a consulta: {e}"
 
-def table_exists(table_name: str) -> bool:
-    """Verifica se uma tabela existe usando o engine do SQLAlchemy."""
+def execute_ddl(statements):
+    """Executa os comandos (DDL, REFRESH) numa única transação; erros são propagados como exceção."""
+    connection = engine.raw_connection()
     try:
+        cursor = connection.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+def stream_data_from_db(query, params=None, chunksize=10000):
+    """Como fetch_data_from_db, mas gera DataFrames de `chunksize` linhas lidos com cursor no servidor.
+
+    Para extrações grandes; erros são propagados como exceção.
+    """
+    with engine.connect().execution_options(stream_results=True) as connection:
+        yield from pd.read_sql_query(sql=query, con=connection, params=params, chunksize=chunksize)
+
+class SchemaCatalog:
+    """Cache em memória das tabelas e colunas do DB_SCHEMA, carregado em uma única consulta."""
+
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self.version = 0
+        self._columns = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self):
         with engine.connect() as connection:
+            # Views materializadas não aparecem no information_schema; vêm do pg_catalog
             sql = text("""
-                SELECT EXISTS (
-                    SELECT 1 FROM information_schema.tables 
-                    WHERE table_schema = :schema AND table_name = :table
-                )
+                SELECT table_name, column_name
+                FROM information_schema.columns
+                WHERE table_schema = :schema
+                UNION ALL
+                SELECT c.relname, a.attname
+                FROM pg_catalog.pg_class c
+                JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+                JOIN pg_catalog.pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+                WHERE n.nspname = :schema AND c.relkind = 'm'
             """)
-            result = connection.execute(sql, {"schema": (DB_SCHEMA or 'public'), "table": table_name})
-            return bool(result.scalar_one())
-    except Exception as e:
-        print(f"Falha ao checar existencia de tabela {DB_SCHEMA}.{table_name}: {e}")
+            result = connection.execute(sql, {"schema": (DB_SCHEMA or 'public')})
+            columns = {}
+            for table_name, column_name in result:
+                columns.setdefault(table_name, set()).add(column_name.lower())
+            return columns
+
+    def columns(self):
+        """Retorna {tabela: {colunas}}, recarregando quando o TTL expira. None se o banco estiver indisponível."""
+        if self._columns is not None and time.monotonic() - self._loaded_at < self.ttl_seconds:
+            return self._columns
+        with self._lock:
+            if self._columns is not None and time.monotonic() - self._loaded_at < self.ttl_seconds:
+                return self._columns
+            try:
+                columns = self._load()
+            except Exception as e:
+                print(f"Falha ao carregar o catalogo do schema {DB_SCHEMA}: {e}")
+                return self._columns
+            if columns != self._columns:
+                self.version += 1
+            self._columns = columns
+            self._loaded_at = time.monotonic()
+            return self._columns
+
+    def invalidate(self):
+        """Força o recarregamento do catálogo no próximo acesso."""
+        with self._lock:
+            self._loaded_at = 0.0
+
+
+schema_catalog = SchemaCatalog(SCHEMA_CACHE_TTL_SECONDS)
+
+def invalidate_schema_cache():
+    """Invalida explicitamente o catálogo (ex.: após criar ou remover tabelas)."""
+    schema_catalog.invalidate()
+
+def table_exists(table_name: str) -> bool:
+    """Verifica se uma tabela existe consultando o catálogo em memória."""
+    columns = schema_catalog.columns()
+    if columns is None:
         return False
+    return table_name in columns
 
-_pasfase_cols_cache = {}
 def _pasfase_columns():
-    """Busca os nomes das colunas da tabela pasfase usando SQLAlchemy."""
-    if 'cols' in _pasfase_cols_cache:
-        return _pasfase_cols_cache['cols']
-    
-    try:
-        with engine.connect() as connection:
-            sql = text("SELECT column_name FROM information_schema.columns WHERE table_schema = :schema AND table_name = 'pasfase'")
-            result = connection.execute(sql, {"schema": (DB_SCHEMA or 'public')})
-            cols = {row[0].lower() for row in result}
-            ordem_col = next((c for c in ['ordem', 'pasordem', 'ordnum'] if c in cols), 'ordem')
-            qtd_col = next((c for c in ['pasquanti', 'pasquant', 'pasqtd'] if c in cols), 'pasquanti')
-            _pasfase_cols_cache['cols'] = (ordem_col, qtd_col)
-            return ordem_col, qtd_col
-    except Exception:
-        return 'ordem', 'pasquanti'
+    """Retorna os nomes das colunas de ordem e quantidade da tabela pasfase a partir do catálogo."""
+    columns = schema_catalog.columns() or {}
+    cols = columns.get('pasfase', set())
+    ordem_col = next((c for c in ['ordem', 'pasordem', 'ordnum'] if c in cols), 'ordem')
+    qtd_col = next((c for c in ['pasquanti', 'pasquant', 'pasqtd'] if c in cols), 'pasquanti')
+    return ordem_col, qtd_col
 
 def get_lot_table():
     """Retorna o nome da tabela de lote apropriada."""
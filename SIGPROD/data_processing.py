@@ -1,46 +1,159 @@
+import numpy as np
 import pandas as pd
 import re
+import threading
+import time
+from functools import lru_cache
 
-def _parse_phase_dates(text: str, phase_name: str):
-    """Parse de datas para fases específicas."""
-    if not text or not phase_name: return None, None
-    try:
-        # Usamos `\b` para garantir que estamos pegando a palavra exata (ex: "MONTAGEM" e não "MONTAGEMSEP")
-        pattern = rf"\b{re.escape(phase_name)}\b:\s*(\d{{2}}/\d{{2}}/\d{{2,4}})\s*-\s*(\d{{2}}/\d{{2}}/\d{{2,4}})"
-        m = re.search(pattern, str(text), flags=re.IGNORECASE)
-        if not m: return None, None
-        def to_iso(s: str):
-            parts = s.split('/')
-            if len(parts) != 3: return None
-            dd, mm, yy = parts
-            if len(yy) == 2: yy = '20' + yy
-            return f"{yy}-{mm}-{dd}"
-        return to_iso(m.group(1)), to_iso(m.group(2))
-    except Exception:
-        return None, None
+# Data dd/mm/aa ou dd/mm/aaaa com dia, mês e ano em grupos separados
+_DATE_GROUPS = r"(\d{2})/(\d{2})/(\d{2,4})"
+
+@lru_cache(maxsize=None)
+def _phase_date_pattern(phase_name: str):
+    """Regex compilada (uma vez por fase) para "FASE: dd/mm/aa - dd/mm/aa" no lote_trans."""
+    # Usamos `\b` para garantir que estamos pegando a palavra exata (ex: "MONTAGEM" e não "MONTAGEMSEP")
+    return re.compile(rf"\b{re.escape(phase_name)}\b:\s*{_DATE_GROUPS}\s*-\s*{_DATE_GROUPS}", flags=re.IGNORECASE)
+
+def _iso_from_groups(dd: pd.Series, mm: pd.Series, yy: pd.Series) -> pd.Series:
+    """Monta 'aaaa-mm-dd' a partir das partes extraídas; ano com 2 dígitos vira 20aa e ausências viram None."""
+    yy = yy.where(yy.str.len() != 2, '20' + yy)
+    iso = yy + '-' + mm + '-' + dd
+    return iso.astype(object).where(iso.notna(), None)
+
+def parse_dates_series(lote_trans: pd.Series, pattern, single_pattern=None):
+    """Datas (início, fim) de cada linha, parseando cada lote_trans distinto uma única vez.
+
+    `pattern` captura dia/mês/ano das duas datas; `single_pattern`, se informado, é tentado quando
+    não há intervalo e usa a mesma data como início e fim. Retorna duas Series alinhadas ao índice.
+    """
+    codes, uniques = pd.factorize(lote_trans.fillna(''))
+    texts = pd.Series([str(text) for text in uniques], dtype=object)
+
+    found = texts.str.extract(pattern)
+    start = _iso_from_groups(found[0], found[1], found[2])
+    end = _iso_from_groups(found[3], found[4], found[5])
+    if single_pattern is not None:
+        missing = start.isna()
+        if missing.any():
+            single = texts[missing].str.extract(single_pattern)
+            single_iso = _iso_from_groups(single[0], single[1], single[2])
+            start[missing] = single_iso
+            end[missing] = single_iso
+            start = start.where(start.notna(), None)
+            end = end.where(end.notna(), None)
+
+    return (pd.Series(start.to_numpy()[codes], index=lote_trans.index, dtype=object),
+            pd.Series(end.to_numpy()[codes], index=lote_trans.index, dtype=object))
+
+# O nome da fase para o parsing das datas pode ser diferente do nome do monitor.
+PHASE_PARSE_KEYS = {
+    5: 'CORTE',
+    10: 'PRENSA',
+    15: 'USINAGEM',
+    25: 'MONTAGEM',
+    30: 'MONTAGEM',
+    35: 'ACABAMENTO',
+    40: 'GARLANDACABAMENTO',  # Template para o monitor Garland
+    998: 'MONTAGEMSEP', # Chave para Saida para Montagem
+    999: 'PREACABAMENT'  # Chave EXATA para o monitor Saída para Pintura
+}
+
+# Tapeçaria: intervalo "TAPECARIA(136): dd/mm/aa - dd/mm/aa" ou, na falta dele, data única
+TAPECARIA_KEY = 'TAPECARIA(136)'
+_TAPECARIA_PATTERN = re.compile(r"TAPECARIA\(136\):\s*(\d{2})/(\d{2})/(\d{2,4})\s*-\s*(\d{2})/(\d{2})/(\d{2,4})", flags=re.IGNORECASE)
+_TAPECARIA_SINGLE_PATTERN = re.compile(r"TAPECARIA\(136\):\s*(\d{2})/(\d{2})/(\d{2,4})", flags=re.IGNORECASE)
+
+def _schedule_patterns():
+    """(padrão do intervalo, padrão de data única) de cada fase mantida no cronograma dos lotes."""
+    patterns = {key: (_phase_date_pattern(key), None) for key in sorted(set(PHASE_PARSE_KEYS.values()))}
+    patterns[TAPECARIA_KEY] = (_TAPECARIA_PATTERN, _TAPECARIA_SINGLE_PATTERN)
+    return patterns
+
+class LotScheduleIndex:
+    """Cronograma (início, fim) de todas as fases de cada lote, extraído do lote_trans uma única vez.
+
+    As entradas são chaveadas por (lote_descricao, lote_trans): um lote só é reprocessado quando o texto
+    muda, e as entradas que deixam de aparecer nos monitores expiram após `retention_seconds`.
+    """
+
+    def __init__(self, retention_seconds=6 * 3600):
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        self._lots = {}
+        self._pruned_at = time.monotonic()
+
+    def _parse_texts(self, texts):
+        series = pd.Series(texts, dtype=object)
+        per_phase = {
+            key: parse_dates_series(series, pattern, single_pattern)
+            for key, (pattern, single_pattern) in _schedule_patterns().items()
+        }
+        return [
+            {key: (start.iat[i], end.iat[i]) for key, (start, end) in per_phase.items()}
+            for i in range(len(texts))
+        ]
+
+    def _update(self, keys):
+        """Garante no índice as chaves (lote, texto) informadas, processando só as novas."""
+        now = time.monotonic()
+        with self._lock:
+            missing = [key for key in keys if key not in self._lots]
+            for key in keys:
+                if key in self._lots:
+                    self._lots[key]['visto_em'] = now
+        if missing:
+            parsed = self._parse_texts([text for _, text in missing])
+            with self._lock:
+                for key, phases in zip(missing, parsed):
+                    self._lots[key] = {'fases': phases, 'visto_em': now}
+        if now - self._pruned_at > 60:
+            with self._lock:
+                self._lots = {key: entry for key, entry in self._lots.items() if now - entry['visto_em'] <= self.retention_seconds}
+                self._pruned_at = now
+
+    def phase_dates(self, df: pd.DataFrame, phase_key: str):
+        """(início, fim) da fase para cada linha do frame, como Series alinhadas ao índice."""
+        texts = df['lote_trans'].astype(object).fillna('')
+        lots = df['lote_descricao'].astype(object) if 'lote_descricao' in df.columns else texts
+        pairs = pd.DataFrame({'lote': lots, 'texto': texts}, index=df.index)
+        codes = pairs.groupby(['lote', 'texto'], sort=False, dropna=False).ngroup().to_numpy()
+        keys = list(pairs.drop_duplicates().itertuples(index=False, name=None))
+
+        self._update(keys)
+        with self._lock:
+            dates = [self._lots[key]['fases'][phase_key] for key in keys]
+        starts = pd.Series([start for start, _ in dates], dtype=object).to_numpy()
+        ends = pd.Series([end for _, end in dates], dtype=object).to_numpy()
+        return (pd.Series(starts[codes], index=df.index, dtype=object),
+                pd.Series(ends[codes], index=df.index, dtype=object))
+
+    def timeline(self, lots=None):
+        """Visão entre fases: o cronograma mais recente de cada lote visto pelos monitores."""
+        with self._lock:
+            entries = sorted(self._lots.items(), key=lambda item: item[1]['visto_em'])
+        latest = {}
+        for (lot, text), entry in entries:
+            if lot and lot != text and (not lots or lot in lots):
+                latest[lot] = entry['fases']
+        return [
+            {
+                'lote_descricao': lot,
+                'fases': {key: {'inicio': start, 'fim': end} for key, (start, end) in phases.items() if pd.notna(start) or pd.notna(end)},
+            }
+            for lot, phases in sorted(latest.items())
+        ]
+
+lot_schedule_index = LotScheduleIndex()
 
 def process_data_generic(df: pd.DataFrame, fase: int) -> pd.DataFrame:
     """Processamento genérico de dados para a maioria dos monitores."""
     if df.empty: return df
 
-    # O nome da fase para o parsing das datas pode ser diferente do nome do monitor.
-    phase_parse_key_map = {
-        5: 'CORTE',
-        10: 'PRENSA',
-        15: 'USINAGEM',
-        25: 'MONTAGEM',
-        30: 'MONTAGEM',
-        35: 'ACABAMENTO',
-        40: 'GARLANDACABAMENTO',  # Template para o monitor Garland
-        998: 'MONTAGEMSEP', # Chave para Saida para Montagem
-        999: 'PREACABAMENT'  # Chave EXATA para o monitor Saída para Pintura
-    }
-    phase_name_for_parsing = phase_parse_key_map.get(fase, 'CORTE')
+    phase_name_for_parsing = PHASE_PARSE_KEYS.get(fase, 'CORTE')
 
-    # 1. Parse de Datas
+    # 1. Datas da fase a partir do cronograma dos lotes (cada lote_trans é lido uma única vez)
     if 'lote_trans' in df.columns:
-        dates = df['lote_trans'].fillna('').apply(lambda x: _parse_phase_dates(x, phase_name_for_parsing))
-        df[['data_inicio_prevista', 'data_fim_prevista']] = pd.DataFrame(dates.tolist(), index=df.index)
+        df['data_inicio_prevista'], df['data_fim_prevista'] = lot_schedule_index.phase_dates(df, phase_name_for_parsing)
         df['corte_dtini'] = pd.to_datetime(df['data_inicio_prevista'], errors='coerce')
         df['orddtprev'] = pd.to_datetime(df['data_fim_prevista'], errors='coerce')
     else:
@@ -81,6 +194,94 @@ def process_data_generic(df: pd.DataFrame, fase: int) -> pd.DataFrame:
     # Para outras fases, apenas retorna o que está em dia ou atrasado
     return df[df['status'].isin(['atrasado', 'em_dia'])]
 
+# Número da OP dentro do lote_descricao (ex: "OP 123/25", "O.P. 123/25")
+_OP_PATTERN = re.compile(r'((?:OP|O\.P\.?)\s?\d+/\d+)')
+
+# Colunas de data enviadas como 'aaaa-mm-dd' no JSON
+_JSON_DATE_COLUMNS = ['orddtprev', 'orddtence', 'lotdtini', 'lotdtpre', 'corte_dtini', 'data_inicio_prevista', 'data_fim_prevista']
+
+@lru_cache(maxsize=4096)
+def _op_group(lote_descricao):
+    """Grupo de OP do lote; sem número de OP, o próprio lote_descricao."""
+    m = _OP_PATTERN.search(lote_descricao)
+    return m.group(1) if m else lote_descricao
+
+def _sort_and_format_dates(df: pd.DataFrame):
+    """Ordena por data de início e ordem (ou lote) e converte as datas para texto, no próprio frame."""
+    sort_cols = ['corte_dtini', 'ordem' if 'ordem' in df.columns else 'lote_descricao']
+    df.sort_values(by=sort_cols, na_position='last', inplace=True)
+    for col in _JSON_DATE_COLUMNS:
+        if col in df.columns and pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = df[col].dt.strftime('%Y-%m-%d')
+
+def frame_records(df: pd.DataFrame):
+    """Equivalente a df.fillna('').to_dict('records'), convertendo coluna a coluna em vez de linha a linha."""
+    columns = list(df.columns)
+    values = []
+    for col in columns:
+        series = df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.astype(object)
+        values.append(series.fillna('').tolist())
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
+# Colunas de texto muito repetidas entre as linhas de um monitor (o lote_trans é o maior texto do frame)
+LEAN_CATEGORY_COLUMNS = ['lote_descricao', 'lote_trans', 'descricao', 'produto', 'status']
+
+def lean_frame(df: pd.DataFrame, columns=LEAN_CATEGORY_COLUMNS):
+    """Reduz o frame no próprio lugar: textos repetidos viram categorias e inteiros o menor tipo que os comporta.
+
+    Colunas float ficam como estão: reduzir para float32 mudaria os valores enviados no JSON.
+    """
+    if df is None or df.empty:
+        return df
+    for col in columns:
+        if col in df.columns and (pd.api.types.is_string_dtype(df[col]) or df[col].dtype == object):
+            df[col] = df[col].astype('category')
+    for col in df.columns:
+        if pd.api.types.is_integer_dtype(df[col]) and not pd.api.types.is_bool_dtype(df[col]) and df[col].dtype != np.int8:
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+    return df
+
+def summarize_grouped(df: pd.DataFrame):
+    """Resumo por OP dos monitores agrupados. Retorna (summary, details) já ordenados e com datas em texto.
+
+    O frame recebido é reaproveitado como detalhe (recebe a coluna op_group), sem cópias.
+    """
+    codes, lotes = pd.factorize(df['lote_descricao'])
+    op_by_lote = pd.Series([_op_group(lote) if isinstance(lote, str) else lote for lote in lotes], dtype=object)
+    df['op_group'] = pd.Series(op_by_lote.to_numpy()[codes], index=df.index, dtype=object).where(codes >= 0)
+    op_key = pd.Categorical(df['op_group'])
+
+    agg_rules = {
+        'saldo_pendente': ('saldo_pendente', 'sum'),
+        'corte_dtini': ('corte_dtini', 'min'),
+        'orddtprev': ('orddtprev', 'min'),
+    }
+    if 'devolucao_saldo' in df.columns:
+        agg_rules['devolucao_saldo'] = ('devolucao_saldo', 'sum')
+    df_summary = df.groupby(op_key, observed=True).agg(**agg_rules)
+
+    # Total histórico: cada lote entra uma única vez na soma do seu grupo de OP
+    first_of_lote = ~df['lote_descricao'].duplicated()
+    total_historico = df.loc[first_of_lote, 'total_historico_lote'].groupby(op_key[first_of_lote.to_numpy()], observed=True).sum()
+    df_summary['total_historico_lote'] = total_historico.reindex(df_summary.index)
+    df_summary.index = df_summary.index.astype(object)
+    df_summary = df_summary.rename_axis('lote_descricao').reset_index()
+
+    today = pd.to_datetime('today').normalize()
+    df_summary['status'] = 'futuro'
+    on_time_mask = (df_summary['corte_dtini'].notna()) & (df_summary['orddtprev'].notna()) & (df_summary['corte_dtini'] <= today) & (df_summary['orddtprev'] >= today)
+    df_summary.loc[on_time_mask, 'status'] = 'em_dia'
+    delayed_mask = (df_summary['orddtprev'].notna()) & (df_summary['orddtprev'] < today)
+    df_summary.loc[delayed_mask, 'status'] = 'atrasado'
+
+    for df_to_format in [df_summary, df]:
+        if not df_to_format.empty:
+            _sort_and_format_dates(df_to_format)
+
+    return df_summary, df
+
 def format_dataframe_for_json(df: pd.DataFrame, is_grouped: bool = False):
     """Formata DataFrame para retorno JSON."""
     if df.empty:
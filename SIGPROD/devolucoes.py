@@ -0,0 +1,78 @@
+"""Motor de devoluções: saldos por (lote, ordem, produto, motivo) lidos uma vez por ciclo (aggregates.devolucoes_balance_query).
+
+Os monitores de maciço e chapa recebem o saldo por (lote, produto) como parâmetros dv_*, e o /api/devolucoes de
+cada fase é filtrado do mesmo frame; nenhum deles lê a toqmovi por conta própria.
+"""
+import threading
+import pandas as pd
+from json_encoding import RecordsSnapshot
+
+# Mesmo filtro de lote (ILIKE) dos monitores de maciço e chapa e do quadro de devoluções
+DEVOLUCOES_LOTES_PATTERN = 'petra|solare|garland'
+
+DEVOLUCOES_COLUMNS = ['lote_descricao', 'ordem', 'descricao', 'data', 'quantidade', 'motivo']
+
+
+class DevolucaoBalances:
+    """Resultado do motor de um ciclo; as visões derivadas (parâmetros e quadros por fase) são calculadas uma vez."""
+
+    def __init__(self, frame):
+        self.frame = frame
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, key, build):
+        view = self._views.get(key)
+        if view is None:
+            with self._lock:
+                view = self._views.get(key)
+                if view is None:
+                    view = self._views[key] = build()
+        return view
+
+    def saldo_params(self):
+        """Parâmetros dv_*: saldo por (lote, produto) somado sobre ordens e motivos, como devolucoes_saldo_source."""
+        return self._cached('saldo_params', self._build_saldo_params)
+
+    def _build_saldo_params(self):
+        df = self.frame
+        if df.empty:
+            return {'dv_lotcods': [], 'dv_produtos': [], 'dv_saldos': []}
+        saldos = df.groupby(['lotcod', 'produto'], sort=False)['saldo'].sum()
+        # Soma em float: arredondada para não deixar resíduo que mude o GREATEST(..., 0) do monitor
+        saldos = saldos.round(6)
+        return {
+            'dv_lotcods': saldos.index.get_level_values('lotcod').tolist(),
+            'dv_produtos': saldos.index.get_level_values('produto').tolist(),
+            'dv_saldos': saldos.tolist(),
+        }
+
+    def snapshot(self, fase):
+        """RecordsSnapshot do /api/devolucoes: saldo positivo por OP/motivo dos lotes Petra/Solare/Garland.
+
+        Nas fases 25 e 30 só entram produtos com essa fase no processo.
+        """
+        return self._cached(('snapshot', fase), lambda: self._build_snapshot(fase))
+
+    def _build_snapshot(self, fase):
+        df = self.frame
+        if df.empty:
+            return RecordsSnapshot(pd.DataFrame(columns=DEVOLUCOES_COLUMNS))
+        mask = (
+            df['produto_cadastrado'].astype(bool)
+            & (df['saldo'] > 0)
+            & df['lote_descricao'].astype(str).str.contains(DEVOLUCOES_LOTES_PATTERN, case=False, regex=True)
+        )
+        if fase in (25, 30):
+            mask &= df[f'fase_{fase}'].astype(bool)
+        # Como o ORDER BY ... DESC do banco: sem data primeiro, depois da devolução mais recente
+        rows = df[mask].sort_values('ultima_data_devolucao', ascending=False, na_position='first', kind='stable')
+        result = pd.DataFrame({
+            'lote_descricao': rows['lote_descricao'],
+            'ordem': rows['ordem'],
+            'descricao': rows['descricao'],
+            'data': pd.to_datetime(rows['ultima_data_devolucao'], errors='coerce').dt.strftime('%d/%m/%Y'),
+            'quantidade': rows['saldo'],
+            'motivo': rows['motivo'],
+        }).reset_index(drop=True)
+        return RecordsSnapshot(result)
@@ -0,0 +1,258 @@
+import argparse
+import json
+import os
+import re
+import sys
+from datetime import datetime
+from config import engine, fq, DB_SCHEMA, get_lot_table, _pasfase_columns
+from snapshots import MONITOR_MODULES, monitor_params
+from aggregates import shared_pasfase_query
+
+# Diretório padrão dos relatórios de EXPLAIN
+REPORTS_DIR = os.path.join(os.path.dirname(__file__), 'explain_reports')
+
+# Aumento de custo/tempo considerado regressão ao comparar dois relatórios
+REGRESSION_RATIO = 1.5
+
+# Tabelas "schema.tabela alias" nas cláusulas FROM/JOIN (CTEs ficam de fora por não terem schema)
+_SOURCE_RE = re.compile(r'\b(?:FROM|JOIN)\s+([\w"]+\.[\w"]+)\s+(?:AS\s+)?(?!(?:ON|WHERE|JOIN|LEFT|RIGHT|INNER|CROSS|GROUP|ORDER|UNION|LIMIT)\b)(\w+)', re.IGNORECASE)
+
+# Predicados que impedem o uso de índices B-tree comuns
+_TRIM_CAST_RE = re.compile(r'TRIM\(\s*CAST\(\s*(\w+)\.(\w+)\s+AS\s+TEXT\s*\)\s*\)', re.IGNORECASE)
+_CAST_RE = re.compile(r'(?<!TRIM\()CAST\(\s*(\w+)\.(\w+)\s+AS\s+TEXT\s*\)\s*=', re.IGNORECASE)
+_EXTRACT_RE = re.compile(r'EXTRACT\(\s*YEAR\s+FROM\s+(\w+)\.(\w+)\s*\)\s*(>=|>|=)\s*(\d{4})', re.IGNORECASE)
+_ILIKE_RE = re.compile(r'(\w+)\.(\w+)\s+(?:NOT\s+)?ILIKE\s+\'%', re.IGNORECASE)
+
+
+def _alias_map(sql):
+    """Mapeia alias -> tabela (sem schema) a partir das cláusulas FROM/JOIN."""
+    aliases = {}
+    for table, alias in _SOURCE_RE.findall(sql):
+        aliases.setdefault(alias, table.split('.')[-1].strip('"'))
+    return aliases
+
+
+def find_non_sargable(sql):
+    """Detecta predicados não sargáveis e propõe o índice de expressão/trigram correspondente."""
+    aliases = _alias_map(sql)
+    findings = []
+
+    def add(kind, alias, column, predicate, index_sql, hint):
+        table = aliases.get(alias)
+        if table is None:
+            return
+        findings.append({
+            'tipo': kind,
+            'tabela': table,
+            'coluna': column,
+            'predicado': predicate,
+            'indice_sugerido': index_sql.format(table=fq(table), name=f'{table}_{column}'),
+            'observacao': hint,
+        })
+
+    for match in _TRIM_CAST_RE.finditer(sql):
+        alias, column = match.groups()
+        add('trim_cast', alias, column, match.group(0),
+            "CREATE INDEX IF NOT EXISTS {name}_trim_txt_idx ON {table} ((TRIM(CAST(" + column + " AS TEXT))))",
+            "Comparação com TRIM(CAST(...)) ignora o índice da coluna; use índice de expressão ou compare os tipos nativos.")
+    for match in _CAST_RE.finditer(sql):
+        alias, column = match.groups()
+        add('cast', alias, column, match.group(0).rstrip('= '),
+            "CREATE INDEX IF NOT EXISTS {name}_txt_idx ON {table} ((CAST(" + column + " AS TEXT)))",
+            "CAST para TEXT na junção impede o índice da coluna; use índice de expressão ou compare os tipos nativos.")
+    for match in _EXTRACT_RE.finditer(sql):
+        alias, column, operator, year = match.groups()
+        add('extract_year', alias, column, match.group(0),
+            "CREATE INDEX IF NOT EXISTS {name}_idx ON {table} (" + column + ")",
+            f"Reescreva como {alias}.{column} {operator} DATE '{year}-01-01' para usar o índice da coluna." if operator == '>=' else
+            "EXTRACT(YEAR ...) não usa o índice da coluna; prefira um intervalo de datas.")
+    for match in _ILIKE_RE.finditer(sql):
+        alias, column = match.groups()
+        add('ilike_curinga', alias, column, match.group(0),
+            "CREATE INDEX IF NOT EXISTS {name}_trgm_idx ON {table} USING gin (" + column + " gin_trgm_ops)",
+            "ILIKE com curinga inicial só usa índice trigram (CREATE EXTENSION IF NOT EXISTS pg_trgm).")
+
+    unique = {}
+    for finding in findings:
+        unique.setdefault((finding['tipo'], finding['tabela'], finding['coluna']), finding)
+    return list(unique.values())
+
+
+def _walk(node, depth=0):
+    yield node, depth
+    for child in node.get('Plans', []):
+        yield from _walk(child, depth + 1)
+
+
+def summarize_plan(plan):
+    """Extrai do EXPLAIN em JSON os tempos, buffers e as varreduras sequenciais."""
+    root = plan['Plan']
+    seq_scans = []
+    node_types = {}
+    for node, _ in _walk(root):
+        node_types[node['Node Type']] = node_types.get(node['Node Type'], 0) + 1
+        if node['Node Type'] == 'Seq Scan':
+            seq_scans.append({
+                'tabela': node.get('Relation Name'),
+                'alias': node.get('Alias'),
+                'filtro': node.get('Filter'),
+                'linhas': node.get('Actual Rows', node.get('Plan Rows')),
+                'linhas_removidas': node.get('Rows Removed by Filter'),
+                'custo_total': node.get('Total Cost'),
+            })
+    return {
+        'custo_total': root.get('Total Cost'),
+        'planejamento_ms': plan.get('Planning Time'),
+        'execucao_ms': plan.get('Execution Time'),
+        'buffers_lidos': root.get('Shared Read Blocks'),
+        'buffers_em_cache': root.get('Shared Hit Blocks'),
+        'no_raiz': root['Node Type'],
+        'tipos_de_no': node_types,
+        'varreduras_sequenciais': seq_scans,
+    }
+
+
+def explain(sql, params, analyze=True):
+    """Executa EXPLAIN em JSON; com ANALYZE a query roda de fato, dentro de uma transação desfeita ao final."""
+    options = 'ANALYZE, BUFFERS, FORMAT JSON' if analyze else 'FORMAT JSON'
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(f"EXPLAIN ({options}) {sql}", params)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0], None
+    except Exception as e:
+        return None, str(e).strip()
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+def monitor_queries(lotes=None):
+    """Renderiza get_query e get_completed_query de cada monitor com os parâmetros usados pelas rotas."""
+    lot_table = get_lot_table()
+    ord_col, qtd_col = _pasfase_columns()
+    yield 'pasfase_compartilhada', None, shared_pasfase_query(fq, lot_table, ord_col, qtd_col), None
+    for fase, module in MONITOR_MODULES.items():
+        name = module.__name__.split('.')[-1]
+        params, error = monitor_params(fase, lot_table, ord_col, qtd_col)
+        if error:
+            params = {'fase': fase}
+        yield f'{name}.get_query', fase, module.get_query(fq, lot_table, ord_col, qtd_col), params
+
+        completed_params = {'fase': fase}
+        lote_filter_clause = ""
+        if lotes:
+            lote_filter_clause = "AND l.lotdes = ANY(%(lotes)s)"
+            completed_params['lotes'] = lotes
+        yield f'{name}.get_completed_query', fase, module.get_completed_query(fq, lot_table, ord_col, qtd_col, lote_filter_clause), completed_params
+
+
+def build_report(analyze=True, lotes=None):
+    """Gera o relatório completo: plano resumido, predicados problemáticos e índices sugeridos por query."""
+    queries = {}
+    suggested = []
+    for key, fase, sql, params in monitor_queries(lotes):
+        print(f"EXPLAIN {key} (fase {fase})...")
+        findings = find_non_sargable(sql)
+        plan, error = explain(sql, params, analyze=analyze)
+        entry = {'fase': fase, 'erro': error, 'predicados_nao_sargaveis': findings}
+        if plan is not None:
+            entry.update(summarize_plan(plan))
+            scanned = {scan['tabela'] for scan in entry['varreduras_sequenciais']}
+            # Só sugere índices para tabelas que de fato foram varridas sequencialmente
+            for finding in findings:
+                finding['tabela_com_seq_scan'] = finding['tabela'] in scanned
+        queries[key] = entry
+        for finding in findings:
+            if plan is None or finding['tabela_com_seq_scan']:
+                if finding['indice_sugerido'] not in suggested:
+                    suggested.append(finding['indice_sugerido'])
+
+    return {
+        'gerado_em': datetime.now().isoformat(timespec='seconds'),
+        'schema': DB_SCHEMA,
+        'analyze': analyze,
+        'consultas': queries,
+        'indices_sugeridos': suggested,
+    }
+
+
+def compare_reports(before, after):
+    """Compara dois relatórios e lista regressões de plano (custo/tempo maiores ou novas varreduras sequenciais)."""
+    regressions = []
+    for key, new in after['consultas'].items():
+        old = before['consultas'].get(key)
+        if old is None or old.get('erro') or new.get('erro'):
+            if old is not None and not old.get('erro') and new.get('erro'):
+                regressions.append({'consulta': key, 'motivo': f"passou a falhar: {new['erro']}"})
+            continue
+
+        for metric in ('custo_total', 'execucao_ms'):
+            old_value, new_value = old.get(metric), new.get(metric)
+            if old_value and new_value and new_value > old_value * REGRESSION_RATIO:
+                regressions.append({
+                    'consulta': key,
+                    'motivo': f"{metric} subiu de {old_value} para {new_value}",
+                })
+
+        old_scans = {scan['tabela'] for scan in old['varreduras_sequenciais']}
+        new_scans = {scan['tabela'] for scan in new['varreduras_sequenciais']} - old_scans
+        if new_scans:
+            regressions.append({
+                'consulta': key,
+                'motivo': f"novas varreduras sequenciais em {', '.join(sorted(t for t in new_scans if t))}",
+            })
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="EXPLAIN das queries dos monitores e sugestões de índices.")
+    parser.add_argument('--output', help="Arquivo JSON de saída (padrão: explain_reports/explain_<data>.json)")
+    parser.add_argument('--no-analyze', action='store_true', help="Apenas planeja as queries, sem executá-las")
+    parser.add_argument('--lotes', help="Lotes (lotdes) separados por vírgula para o filtro das queries de concluídos")
+    parser.add_argument('--compare', nargs=2, metavar=('ANTES', 'DEPOIS'), help="Compara dois relatórios salvos")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0], encoding='utf-8') as f:
+            before = json.load(f)
+        with open(args.compare[1], encoding='utf-8') as f:
+            after = json.load(f)
+        regressions = compare_reports(before, after)
+        for regression in regressions:
+            print(f"[REGRESSÃO] {regression['consulta']}: {regression['motivo']}")
+        if not regressions:
+            print("Nenhuma regressão de plano encontrada")
+        return 1 if regressions else 0
+
+    lotes = [lote.strip() for lote in args.lotes.split(',') if lote.strip()] if args.lotes else None
+    report = build_report(analyze=not args.no_analyze, lotes=lotes)
+
+    output = args.output
+    if not output:
+        os.makedirs(REPORTS_DIR, exist_ok=True)
+        output = os.path.join(REPORTS_DIR, f"explain_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+
+    for key, entry in report['consultas'].items():
+        if entry['erro']:
+            print(f"{key}: ERRO {entry['erro']}")
+            continue
+        tables = ', '.join(sorted({scan['tabela'] for scan in entry['varreduras_sequenciais'] if scan['tabela']})) or '-'
+        print(f"{key}: custo {entry['custo_total']}, execução {entry['execucao_ms']} ms, seq scans: {tables}")
+    if report['indices_sugeridos']:
+        print("\nÍndices sugeridos:")
+        for index_sql in report['indices_sugeridos']:
+            print(f"  {index_sql};")
+    print(f"\nRelatório salvo em {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    # Uso: python explain_monitors.py [--no-analyze] [--lotes L1,L2] [--output arq.json]
+    #      python explain_monitors.py --compare antes.json depois.json
+    sys.exit(main())
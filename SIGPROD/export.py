@@ -0,0 +1,172 @@
+"""Exportação dos monitores (/api/export) em XLSX, CSV ou Parquet a partir do snapshot compartilhado.
+
+As linhas são lidas do snapshot em blocos de EXPORT_CHUNK_ROWS: o XLSX sai de um workbook write-only gravado
+em arquivo temporário, o CSV é enviado bloco a bloco e o Parquet grava um row group por bloco. A memória
+usada não cresce com o número de linhas e nenhuma consulta nova ao banco é feita se o snapshot está válido.
+"""
+import tempfile
+import unicodedata
+from urllib.parse import quote
+import numpy as np
+import pandas as pd
+from flask import Response, jsonify, send_file
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from config import EXPORT_CHUNK_ROWS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet é opcional
+    pa = pq = None
+
+EXPORT_FORMATS = ('xlsx', 'csv', 'parquet')
+
+EXPORT_COLUMNS = {
+    'lote_descricao': 'Lote', 'ordem': 'Ordem', 'produto': 'Produto',
+    'descricao': 'Descrição', 'saldo_pendente': 'Saldo',
+    'data_inicio_prevista': 'Início Previsto', 'data_fim_prevista': 'Fim Previsto'
+}
+
+PHASE_NAMES = {
+    5: 'Corte', 10: 'Prensa', 15: 'Usinagem', 25: 'Maciço', 30: 'Chapa', 35: 'Pintura', 40: 'Garland', 136: 'Tapecaria',
+    998: 'Saida_Montagem', 999: 'Saida_Pintura'
+}
+
+_MIMETYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def export_rows(payload, fase, status_param):
+    """(frame do snapshot, posições das linhas do status pedido, colunas exportadas), sem copiar o frame."""
+    df = payload.frames['details'] if payload.is_grouped else payload.frames['data']
+    if 'status' not in df.columns:
+        return df, np.array([], dtype=int), [col for col in EXPORT_COLUMNS if col in df.columns]
+
+    # Para pintura, ontime inclui futuro
+    if status_param == 'delayed':
+        mask = df['status'] == 'atrasado'
+    elif fase == 35:
+        mask = df['status'].isin(['em_dia', 'futuro'])
+    else:
+        mask = df['status'] == 'em_dia'
+    return df, np.flatnonzero(mask.to_numpy()), [col for col in EXPORT_COLUMNS if col in df.columns]
+
+
+def _chunks(df, positions, columns):
+    """Blocos de linhas com as colunas exportadas; o primeiro existe mesmo sem linhas (cabeçalho)."""
+    for start in range(0, max(len(positions), 1), EXPORT_CHUNK_ROWS):
+        yield df.iloc[positions[start:start + EXPORT_CHUNK_ROWS]][columns]
+
+
+def _cell_values(chunk):
+    """Linhas do bloco como listas de valores Python, com ausentes vazios (como o to_excel do pandas)."""
+    columns = []
+    for col in chunk.columns:
+        series = chunk[col].astype(object)
+        columns.append(series.where(series.notna(), None).tolist())
+    return zip(*columns)
+
+
+def write_xlsx(chunks, file, labels=EXPORT_COLUMNS):
+    """Workbook write-only com cabeçalho em negrito; `labels` dá o título de cada coluna."""
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Relatorio')
+    header_written = False
+    for chunk in chunks:
+        if not header_written:
+            header = []
+            for col in chunk.columns:
+                cell = WriteOnlyCell(sheet, value=labels.get(col, col))
+                cell.font = Font(bold=True)
+                header.append(cell)
+            sheet.append(header)
+            header_written = True
+        for row in _cell_values(chunk):
+            sheet.append(row)
+    workbook.save(file)
+
+
+def iter_csv(chunks, labels=EXPORT_COLUMNS):
+    """CSV para o Excel em português (; e vírgula decimal, com BOM), enviado bloco a bloco."""
+    first = True
+    for chunk in chunks:
+        text = chunk.rename(columns=labels).to_csv(sep=';', decimal=',', index=False, header=first)
+        yield ('\ufeff' + text if first else text).encode('utf-8')
+        first = False
+
+
+def _arrow_chunk(chunk):
+    # Textos e categorias como string em todos os blocos: o schema do primeiro bloco vale para o arquivo todo
+    converted = {}
+    for col in chunk.columns:
+        series = chunk[col]
+        if isinstance(series.dtype, pd.CategoricalDtype) or not pd.api.types.is_numeric_dtype(series):
+            series = series.astype(object).where(series.notna(), None).astype('string')
+        converted[col] = series
+    return pd.DataFrame(converted)
+
+
+def write_parquet(chunks, file):
+    """Parquet com os nomes de coluna originais (para os jobs de análise), um row group por bloco."""
+    writer = None
+    try:
+        for chunk in chunks:
+            frame = _arrow_chunk(chunk)
+            if writer is None:
+                table = pa.Table.from_pandas(frame, preserve_index=False)
+                writer = pq.ParquetWriter(file, table.schema)
+            else:
+                table = pa.Table.from_pandas(frame, schema=writer.schema, preserve_index=False)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _content_disposition(download_name):
+    """Mesmo cabeçalho do send_file: nome ASCII e o nome UTF-8 completo (ex.: maciço)."""
+    simple = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+    return f"attachment; filename=\"{simple}\"; filename*=UTF-8''{quote(download_name)}"
+
+
+def export_format_error(fmt):
+    """Resposta de erro para formato inválido ou indisponível; None se o formato pode ser atendido."""
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"Formato inválido: {fmt}. Use {', '.join(EXPORT_FORMATS)}"}), 400
+    if fmt == 'parquet' and pq is None:
+        return jsonify({"error": "Formato parquet indisponível: pyarrow não instalado"}), 501
+    return None
+
+
+def export_response(payload, fase, status_param, fmt='xlsx'):
+    """Resposta do /api/export no formato pedido (xlsx | csv | parquet)."""
+    error = export_format_error(fmt)
+    if error:
+        return error
+
+    df, positions, columns = export_rows(payload, fase, status_param)
+    phase_name = PHASE_NAMES.get(fase, 'Desconhecido')
+    download_name = f'relatorio_{phase_name.lower()}_{status_param}.{fmt}'
+
+    if fmt == 'csv':
+        response = Response(iter_csv(_chunks(df, positions, columns)), mimetype=_MIMETYPES['csv'])
+        response.headers['Content-Disposition'] = _content_disposition(download_name)
+        return response
+
+    # XLSX e Parquet precisam do arquivo completo (zip/rodapé); o temporário fica em disco, não na memória
+    output = tempfile.TemporaryFile()
+    try:
+        if fmt == 'xlsx':
+            write_xlsx(_chunks(df, positions, columns), output)
+        else:
+            write_parquet(_chunks(df, positions, columns), output)
+    except Exception:
+        output.close()
+        raise
+    output.seek(0)
+    return send_file(output, as_attachment=True, download_name=download_name, mimetype=_MIMETYPES[fmt])
@@ -0,0 +1,268 @@
+"""Jobs de exportação em segundo plano para extrações grandes de concluídos (/api/export_jobs).
+
+O pedido devolve um id na hora; a consulta (get_completed_query) roda num pool limitado de threads, lendo o
+banco em blocos, e o arquivo fica em disco. O id é o hash de (fase, filtros, formato, marca d'água dos dados),
+então o mesmo pedido com os dados inalterados é servido direto do disco, inclusive após um reinício.
+
+A marca d'água é a marca de produção (linhas e xmin por tabela lida) só das ordens dos lotes da extração, a mesma
+do cache de concluídos: apontamentos em outras fases ou em lotes fora do filtro não geram um novo arquivo. Sem
+filtro de lote, qualquer apontamento na fase gera. A data de hoje só entra se o período chega até hoje.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+import pandas as pd
+from config import (
+    fetch_data_from_db, stream_data_from_db, EXPORT_JOB_WORKERS, EXPORT_JOB_MAX_PENDING,
+    EXPORT_JOB_FETCH_ROWS, EXPORT_CACHE_DIR, EXPORT_CACHE_MAX_AGE_SECONDS, EXPORT_CACHE_MAX_BYTES,
+    EXPORT_CACHE_FRESH_SECONDS
+)
+from change_detection import tables_in_sql
+from completed import completed_query, lot_markers_query
+from export import EXPORT_FORMATS, PHASE_NAMES, write_xlsx, write_parquet, iter_csv, pq
+
+COMPLETED_COLUMNS = {
+    'lote_descricao': 'Lote', 'ordem': 'Ordem', 'descricao': 'Descrição', 'qtd_produzida': 'Produzido',
+    'ordquanti': 'Quantidade OP', 'data_conclusao': 'Conclusão', 'reqnumero': 'Requisição'
+}
+
+# Jobs terminados mantidos em memória para consulta de status (o arquivo continua no disco)
+_FINISHED_KEPT = 100
+
+
+def completed_extract_query(monitor_module, fase, lot_table, ord_col, qtd_col, lotes=None, desde=None, ate=None):
+    """(SQL, params) dos concluídos da fase filtrados por lote e período de conclusão, em ordem estável."""
+    completed, params = completed_query(monitor_module, fase, lot_table, ord_col, qtd_col, lotes)
+    conditions = []
+    if desde:
+        conditions.append("c.data_conclusao >= %(desde)s")
+        params['desde'] = desde
+    if ate:
+        conditions.append("c.data_conclusao <= %(ate)s")
+        params['ate'] = ate
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    query = f"""
+        SELECT c.* FROM ({completed}) c
+        {where}
+        ORDER BY c.data_conclusao DESC, c.ordem
+    """
+    return query, params
+
+
+def data_watermark(tables, lot_table, ord_col, lotes=None, ate=None):
+    """Marca d'água dos dados do pedido: muda quando o resultado da extração pode ter mudado.
+
+    Vale também para períodos encerrados: lançamentos retroativos e estornos de devolução mudam as linhas das
+    ordens do lote. Sem o catálogo ou com erro na consulta, o resultado vale por uma janela de tempo.
+    """
+    markers, error = (None, 'sem tabelas') if not tables else fetch_data_from_db(
+        *lot_markers_query(tables, lot_table, ord_col, lotes))
+    if error:
+        return f'janela_{int(time.time() // EXPORT_CACHE_FRESH_SECONDS)}'
+    values = sorted(
+        (str(lote), tabela, int(linhas), None if pd.isna(marca) else str(marca))
+        for lote, tabela, linhas, marca in markers[['lote_descricao', 'tabela', 'linhas', 'marca']].itertuples(index=False)
+    )
+    digest = hashlib.blake2b(repr(values).encode('utf-8'), digest_size=16).hexdigest()
+    # Ordens abertas concluem hoje: só importa se o período não terminou antes de hoje
+    today = date.today().isoformat()
+    if ate and str(ate)[:10] < today:
+        return digest
+    return f'{digest}_{today}'
+
+
+class ExportJobs:
+    """Pool limitado de jobs de exportação com cache dos resultados em disco."""
+
+    def __init__(self, directory, workers, max_pending):
+        self.directory = directory
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='sigprod-export')
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def _path(self, job_id, fmt):
+        return os.path.join(self.directory, f'{job_id}.{fmt}')
+
+    def _cached_file(self, job_id, fmt):
+        """Caminho do resultado em disco se existir e não tiver expirado."""
+        path = self._path(job_id, fmt)
+        try:
+            age = time.time() - os.path.getmtime(path)
+        except OSError:
+            return None
+        return path if age <= EXPORT_CACHE_MAX_AGE_SECONDS else None
+
+    def submit(self, monitor_module, fase, lot_table, ord_col, qtd_col, lotes, desde, ate, fmt):
+        """Cria (ou reaproveita) o job do pedido; retorna (status do job, erro)."""
+        query, params = completed_extract_query(monitor_module, fase, lot_table, ord_col, qtd_col, lotes, desde, ate)
+        filters = {'lotes': sorted(lotes or []), 'desde': str(desde or ''), 'ate': str(ate or '')}
+        watermark = data_watermark(tables_in_sql(query), lot_table, ord_col, lotes, ate)
+        key = json.dumps([fase, lot_table, ord_col, qtd_col, filters, fmt, watermark], sort_keys=True)
+        job_id = hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
+
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job['status'] in ('na_fila', 'executando'):
+                return dict(job), None
+            path = self._cached_file(job_id, fmt)
+            if path is not None:
+                job = self._finished_job(job_id, fase, filters, fmt, path)
+                self._jobs[job_id] = job
+                return dict(job), None
+            pending = sum(1 for j in self._jobs.values() if j['status'] in ('na_fila', 'executando'))
+            if pending >= self.max_pending:
+                return None, f"Muitas exportações em andamento ({pending}); tente novamente em instantes"
+            job = {
+                'id': job_id, 'fase': fase, 'filtros': filters, 'formato': fmt, 'status': 'na_fila',
+                'linhas': 0, 'tamanho_bytes': None, 'erro': None, 'do_cache': False,
+                'criado_em': datetime.now().isoformat(timespec='seconds'), 'concluido_em': None,
+            }
+            self._jobs[job_id] = job
+            self._forget_finished()
+        self._executor.submit(self._run, job_id, query, params, fmt)
+        return dict(job), None
+
+    def _finished_job(self, job_id, fase, filters, fmt, path):
+        return {
+            'id': job_id, 'fase': fase, 'filtros': filters, 'formato': fmt, 'status': 'pronto',
+            'linhas': None, 'tamanho_bytes': os.path.getsize(path), 'erro': None, 'do_cache': True,
+            'criado_em': datetime.fromtimestamp(os.path.getmtime(path)).isoformat(timespec='seconds'),
+            'concluido_em': datetime.fromtimestamp(os.path.getmtime(path)).isoformat(timespec='seconds'),
+        }
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job['status'] in ('pronto', 'erro')]
+        for job_id in finished[:max(0, len(finished) - _FINISHED_KEPT)]:
+            del self._jobs[job_id]
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _chunks(self, job_id, query, params):
+        """Blocos lidos do banco, com as datas em texto como no /api/completed e a contagem de progresso."""
+        rows = 0
+        empty = True
+        for chunk in stream_data_from_db(query, params=params, chunksize=EXPORT_JOB_FETCH_ROWS):
+            if 'data_conclusao' in chunk.columns:
+                chunk['data_conclusao'] = pd.to_datetime(chunk['data_conclusao'], errors='coerce').dt.strftime('%Y-%m-%d')
+            rows += len(chunk)
+            empty = False
+            self._update(job_id, linhas=rows)
+            yield chunk
+        if empty:
+            # O read_sql em blocos pode não gerar bloco nenhum sem linhas: o cabeçalho vem das colunas da própria query
+            header, error = fetch_data_from_db(f"SELECT c.* FROM ({query}) c LIMIT 0", params=params)
+            if error:
+                raise RuntimeError(error)
+            yield header
+
+    def _run(self, job_id, query, params, fmt):
+        self._update(job_id, status='executando')
+        path = self._path(job_id, fmt)
+        partial = f'{path}.parcial'
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(partial, 'wb') as output:
+                chunks = self._chunks(job_id, query, params)
+                if fmt == 'xlsx':
+                    write_xlsx(chunks, output, COMPLETED_COLUMNS)
+                elif fmt == 'parquet':
+                    write_parquet(chunks, output)
+                else:
+                    for block in iter_csv(chunks, COMPLETED_COLUMNS):
+                        output.write(block)
+            # Troca atômica: um download nunca vê um arquivo pela metade
+            os.replace(partial, path)
+            self._update(job_id, status='pronto', tamanho_bytes=os.path.getsize(path),
+                         concluido_em=datetime.now().isoformat(timespec='seconds'))
+        except Exception as e:
+            print(f"Falha no job de exportação {job_id}: {e}")
+            if os.path.exists(partial):
+                os.remove(partial)
+            self._update(job_id, status='erro', erro=str(e), concluido_em=datetime.now().isoformat(timespec='seconds'))
+        finally:
+            self.evict()
+
+    def status(self, job_id):
+        """Status e progresso do job, ou None se desconhecido; o arquivo removido do disco aparece como expirado."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            job = dict(job) if job else None
+        if job is None:
+            # Job de antes de um reinício: o resultado pode continuar no disco
+            path = self.result_path(job_id)
+            if path is None:
+                return None
+            return self._finished_job(job_id, None, None, os.path.splitext(path)[1][1:], path)
+        if job['status'] == 'pronto' and self._cached_file(job_id, job['formato']) is None:
+            job['status'] = 'expirado'
+        return job
+
+    def result_path(self, job_id):
+        """Arquivo pronto do job, ou None se ainda não terminou, falhou ou expirou."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job['status'] != 'pronto':
+                return None
+            formats = [job['formato']] if job else EXPORT_FORMATS
+        for fmt in formats:
+            path = self._cached_file(job_id, fmt)
+            if path is not None:
+                return path
+        return None
+
+    def download_name(self, job_id, path):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            fase = job['fase'] if job else None
+        phase_name = PHASE_NAMES[fase].lower() if fase in PHASE_NAMES else 'extracao'
+        return f'concluidos_{phase_name}_{job_id[:8]}{os.path.splitext(path)[1]}'
+
+    def evict(self):
+        """Remove resultados expirados e, acima do tamanho máximo, os mais antigos."""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        now = time.time()
+        files = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if name.endswith('.parcial'):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if now - stat.st_mtime > EXPORT_CACHE_MAX_AGE_SECONDS:
+                self._remove(path)
+            else:
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= EXPORT_CACHE_MAX_BYTES:
+                break
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"Falha ao remover exportação em cache {path}: {e}")
+
+    def stats(self):
+        with self._lock:
+            jobs = [dict(job) for job in self._jobs.values()]
+        return {'workers': self.workers, 'max_pendentes': self.max_pending, 'parquet_disponivel': pq is not None, 'jobs': jobs}
+
+
+export_jobs = ExportJobs(EXPORT_CACHE_DIR, EXPORT_JOB_WORKERS, EXPORT_JOB_MAX_PENDING)
@@ -0,0 +1,407 @@
+import hashlib
+import json
+import math
+import threading
+import numpy as np
+import pandas as pd
+from data_processing import frame_records
+from compression import CONTENT_ENCODINGS, accepted_encoding, compress, encode_response, variant_etag
+from config import COMPRESSION_ENABLED, COMPRESSION_MIN_BYTES, JSON_INDENT_ENABLED
+from flask import Response, current_app, jsonify, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import pyarrow as pa
+except ImportError:  # formato Arrow é opcional
+    pa = None
+
+# Mesmo tratamento de tipos do jsonify (datas em formato HTTP, Decimal como texto, etc.)
+_flask_default = DefaultJSONProvider.default
+_EMPTY = '""'
+
+# Formatos aceitos no parâmetro `format` das rotas de dados (`rows` é o padrão histórico)
+RESPONSE_FORMATS = ('rows', 'columnar', 'arrow')
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+
+
+def _encode_value(value):
+    """Um valor em JSON compacto como o jsonify faria após fillna('') (ausentes viram "")."""
+    if value is None or value is pd.NaT or value is pd.NA:
+        return _EMPTY
+    if isinstance(value, float) and math.isnan(value):
+        return _EMPTY
+    return json.dumps(value, default=_flask_default, ensure_ascii=True, sort_keys=True, separators=(',', ':'))
+
+
+def _encode_float(value):
+    if math.isnan(value):
+        return _EMPTY
+    return float.__repr__(value) if not math.isinf(value) else json.dumps(value)
+
+
+def _dictionary(series: pd.Series):
+    """(códigos, JSON dos valores distintos) para colunas de texto, data ou categoria; None para as demais.
+
+    O último elemento do dicionário é "" e o código -1 (ausente) aponta para ele.
+    """
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        pass
+    elif pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_numeric_dtype(dtype):
+        return None
+    elif dtype == object and pd.api.types.infer_dtype(series, skipna=True) not in ('string', 'date', 'datetime', 'empty'):
+        # Tipos misturados (1, 1.0, True se igualam no hash) vão valor a valor
+        return None
+    codes, uniques = pd.factorize(series)
+    encoded = [_encode_value(v) for v in uniques.tolist()]
+    encoded.append(_EMPTY)
+    return codes, encoded
+
+
+def _encode_column(series: pd.Series):
+    """Lista com o JSON de cada valor da coluna, codificando cada valor distinto uma única vez."""
+    dictionary = _dictionary(series)
+    if dictionary is not None:
+        codes, encoded = dictionary
+        return np.array(encoded, dtype=object)[codes].tolist()
+    dtype = series.dtype
+    if pd.api.types.is_integer_dtype(dtype) and not series.hasnans:
+        return list(map(str, series.tolist()))
+    if pd.api.types.is_float_dtype(dtype):
+        # Sem factorize: 0.0 e -0.0 seriam agrupados, mas o JSON de ambos difere
+        return [_encode_float(v) for v in series.tolist()]
+    return [_encode_value(v) for v in series.tolist()]
+
+
+def _encoded_rows(df: pd.DataFrame):
+    """JSON de cada linha (chaves ordenadas), montado a partir das colunas já codificadas."""
+    if len(df) == 0:
+        return []
+    columns = sorted(df.columns)
+    if not columns:
+        return ['{}'] * len(df)
+    prefixes = [json.dumps(col, ensure_ascii=True) + ':' for col in columns]
+    encoded_columns = [_encode_column(df[col]) for col in columns]
+    return ['{' + ','.join(map(str.__add__, prefixes, row)) + '}' for row in zip(*encoded_columns)]
+
+
+def encode_records(df: pd.DataFrame) -> str:
+    """Array JSON idêntico ao jsonify(df.fillna('').to_dict('records')) em modo compacto, sem montar dicts por linha."""
+    return '[' + ','.join(_encoded_rows(df)) + ']'
+
+
+# Colunas que identificam uma linha nos deltas (since=); os resumos por OP usam o lote_descricao
+ROW_KEY_COLUMNS = ['ordem', 'produto', 'reqnumero']
+
+
+def row_keys(df: pd.DataFrame):
+    """Chave opaca e única de cada linha; repetições da mesma chave recebem o sufixo #n."""
+    columns = [col for col in ROW_KEY_COLUMNS if col in df.columns] or [col for col in ['lote_descricao'] if col in df.columns]
+    if columns:
+        keys = ['|'.join(values) for values in zip(*[_encode_column(df[col]) for col in columns])]
+    else:
+        keys = [str(position) for position in range(len(df))]
+    seen = {}
+    unique = []
+    for key in keys:
+        count = seen.get(key, 0)
+        seen[key] = count + 1
+        unique.append(key if count == 0 else f'{key}#{count}')
+    return unique
+
+
+def row_index(df: pd.DataFrame):
+    """(chaves, JSON das linhas) do frame, na ordem do frame."""
+    return row_keys(df), _encoded_rows(df)
+
+
+def encode_columnar(df: pd.DataFrame) -> str:
+    """Layout colunar: um array por coluna; textos e datas viram códigos inteiros de um dicionário por coluna.
+
+    {"columns": [...ordem do frame], "data": {col: [...]}, "dictionaries": {col: [...]}, "length": n}.
+    Ausentes seguem o formato de linhas ("").
+    """
+    data, dictionaries = {}, {}
+    for col in df.columns:
+        dictionary = _dictionary(df[col])
+        if dictionary is None:
+            data[col] = '[' + ','.join(_encode_column(df[col])) + ']'
+            continue
+        codes, encoded = dictionary
+        if (codes < 0).any():
+            codes = np.where(codes < 0, len(encoded) - 1, codes)
+        else:
+            encoded = encoded[:-1]
+        data[col] = '[' + ','.join(map(str, codes.tolist())) + ']'
+        dictionaries[col] = '[' + ','.join(encoded) + ']'
+
+    def _object(parts):
+        return '{' + ','.join(json.dumps(key, ensure_ascii=True) + ':' + parts[key] for key in sorted(parts)) + '}'
+
+    columns = json.dumps([str(col) for col in df.columns], ensure_ascii=True, separators=(',', ':'))
+    return f'{{"columns":{columns},"data":{_object(data)},"dictionaries":{_object(dictionaries)},"length":{len(df)}}}'
+
+
+def encode_arrow(df: pd.DataFrame, metadata=None) -> bytes:
+    """Stream Arrow IPC do frame, com colunas de texto codificadas em dicionário."""
+    arrays = []
+    for col in df.columns:
+        try:
+            array = pa.array(df[col], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Colunas object com tipos misturados seguem como texto
+            array = pa.array(df[col].map(lambda v: None if v is None or v != v else str(v)), type=pa.string())
+        if pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+            array = array.dictionary_encode()
+        arrays.append(array)
+    table = pa.Table.from_arrays(arrays, names=[str(col) for col in df.columns], metadata=metadata)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+class MonitorPayload:
+    """Payload de /api/data guardado como frames já formatados e serializado sob demanda uma única vez.
+
+    `frames` é {'data': df} ou {'summary': df, 'details': df}; `body` são os bytes enviados às TVs.
+    """
+
+    def __init__(self, is_grouped, frames):
+        self.is_grouped = is_grouped
+        self.frames = frames
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, key, build):
+        body = self._encoded.get(key)
+        if body is None:
+            with self._lock:
+                body = self._encoded.get(key)
+                if body is None:
+                    body = self._encoded[key] = build()
+        return body
+
+    def _json_body(self, encode):
+        parts = {name: encode(df) for name, df in self.frames.items()}
+        parts['is_grouped'] = 'true' if self.is_grouped else 'false'
+        return ('{' + ','.join(f'"{key}":{parts[key]}' for key in sorted(parts)) + '}\n').encode('ascii')
+
+    @property
+    def body(self):
+        return self._cached('rows', lambda: self._json_body(encode_records))
+
+    @property
+    def columnar_body(self):
+        return self._cached('columnar', lambda: self._json_body(encode_columnar))
+
+    def row_index(self):
+        """{parte: (chaves, JSON das linhas)} usado para calcular deltas entre versões."""
+        return self._cached('row_index', lambda: {name: row_index(df) for name, df in self.frames.items()})
+
+    @staticmethod
+    def delta_key(version, since, previous):
+        return ('delta', version, since if previous is not None else None)
+
+    def delta_body(self, version, since, previous):
+        """Corpo do delta desde `since` (ou completo, sem `previous`), calculado uma vez para todas as telas na mesma versão."""
+        return self._cached(self.delta_key(version, since, previous), lambda: encode_delta(self, version, since, previous))
+
+    def etag(self, key, body):
+        """ETag forte (hash do conteúdo) da codificação, calculada uma vez por snapshot."""
+        return self._cached(('etag', key), lambda: content_etag(body))
+
+    def compressed(self, key, body, encoding):
+        """Corpo da codificação `key` comprimido (gzip/br), uma vez por snapshot e compartilhado entre as TVs."""
+        return self._cached(('compressed', key, encoding), lambda: compress(body, encoding))
+
+    def precompress(self, key, body):
+        """Comprime o corpo em todas as codificações de antemão (no agendador, fora do caminho das requisições)."""
+        if COMPRESSION_ENABLED and len(body) >= COMPRESSION_MIN_BYTES:
+            for encoding in CONTENT_ENCODINGS:
+                self.compressed(key, body, encoding)
+
+    def arrow_body(self, part):
+        metadata = {'is_grouped': 'true' if self.is_grouped else 'false', 'part': part}
+        return self._cached(('arrow', part), lambda: encode_arrow(self.frames[part], metadata))
+
+    def to_dict(self):
+        """Estrutura equivalente em objetos Python (fillna('') + to_dict('records'))."""
+        payload = {"is_grouped": self.is_grouped}
+        for name, df in self.frames.items():
+            payload[name] = frame_records(df)
+        return payload
+
+
+class RecordsSnapshot(MonitorPayload):
+    """Lista de registros (devoluções, concluídos por lote) compartilhada entre requisições e canais.
+
+    `body` é o mesmo array JSON do records_response, codificado uma única vez.
+    """
+
+    def __init__(self, df):
+        super().__init__(False, {'data': df})
+
+    @property
+    def frame(self):
+        return self.frames['data']
+
+    @property
+    def body(self):
+        return self._cached('rows', lambda: (encode_records(self.frame) + '\n').encode('ascii'))
+
+
+def content_etag(body: bytes) -> str:
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def conditional_response(body: bytes, mimetype, etag=None, compressed=None):
+    """Resposta com ETag forte; If-None-Match igual devolve 304 sem corpo (TVs ociosas não baixam nem reprocessam).
+
+    O corpo vai comprimido conforme o Accept-Encoding; `compressed(codificação)` devolve a versão já comprimida
+    do snapshot, sem ele a compressão é feita aqui.
+    """
+    encoding = accepted_encoding(len(body))
+    etag = variant_etag(etag or content_etag(body), encoding)
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        if encoding:
+            body = compressed(encoding) if compressed else compress(body, encoding)
+        response = Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    # Sempre revalidar: o conteúdo muda a cada lançamento de produção
+    response.headers['Cache-Control'] = 'no-cache'
+    return encode_response(response, encoding)
+
+
+def _encode_part_delta(previous, current):
+    """Delta de uma parte: linhas removidas, incluídas/alteradas e, se mudou, a nova ordem das chaves."""
+    old_keys, old_rows = previous
+    keys, rows = current
+    old = dict(zip(old_keys, old_rows))
+    current_keys = set(keys)
+    upsert = [(key, row) for key, row in zip(keys, rows) if old.get(key) != row]
+    remove = [key for key in old_keys if key not in current_keys]
+    parts = {
+        'remove': json.dumps(remove, ensure_ascii=True, separators=(',', ':')),
+        'upsert': '[' + ','.join(f'[{json.dumps(key, ensure_ascii=True)},{row}]' for key, row in upsert) + ']',
+    }
+    # A ordem só vai quando difere de "anteriores sem as removidas, novas no final", que o cliente monta sozinho
+    expected = [key for key in old_keys if key in current_keys] + [key for key in keys if key not in old]
+    if expected != keys:
+        parts['order'] = json.dumps(keys, ensure_ascii=True, separators=(',', ':'))
+    return '{' + ','.join(f'"{name}":{parts[name]}' for name in sorted(parts)) + '}'
+
+
+def encode_delta(payload, version, since=None, previous=None):
+    """Corpo da resposta com since=: delta desde a versão do cliente, ou o payload completo com as chaves das linhas.
+
+    Completo: {"delta": false, "version", "is_grouped", "keys": {parte: [...]}, parte: [linhas]}.
+    Delta: {"delta": true, "version", "since", "is_grouped", "parts": {parte: {"remove", "upsert", "order"?}}}.
+    """
+    current = payload.row_index()
+    parts = {
+        'is_grouped': 'true' if payload.is_grouped else 'false',
+        'version': str(int(version)),
+    }
+    if previous is None:
+        parts['delta'] = 'false'
+        parts['keys'] = '{' + ','.join(
+            f'"{name}":{json.dumps(keys, ensure_ascii=True, separators=(",", ":"))}' for name, (keys, _) in sorted(current.items())
+        ) + '}'
+        for name, (_, rows) in current.items():
+            parts[name] = '[' + ','.join(rows) + ']'
+    else:
+        parts['delta'] = 'true'
+        parts['since'] = str(int(since))
+        parts['parts'] = '{' + ','.join(
+            f'"{name}":{_encode_part_delta(previous.get(name, ([], [])), index)}' for name, index in sorted(current.items())
+        ) + '}'
+    return ('{' + ','.join(f'"{key}":{parts[key]}' for key in sorted(parts)) + '}\n').encode('ascii')
+
+
+def stream_event(event, data, event_id=None):
+    """Evento no formato Server-Sent Events (o JSON compacto não tem quebras de linha)."""
+    lines = [f'id: {event_id}'] if event_id is not None else []
+    lines += [f'event: {event}', f'data: {data}']
+    return '\n'.join(lines) + '\n\n'
+
+
+def delta_response(payload: MonitorPayload, version, since, previous):
+    """Resposta para since=: 304 se o cliente já está na versão atual, senão delta ou payload completo."""
+    encoding = None
+    if since == version:
+        response = Response(status=304)
+    else:
+        body = payload.delta_body(version, since, previous)
+        encoding = accepted_encoding(len(body))
+        if encoding:
+            body = payload.compressed(payload.delta_key(version, since, previous), body, encoding)
+        response = Response(body, mimetype=current_app.json.mimetype)
+    response.headers['X-Snapshot-Version'] = str(version)
+    response.headers['Cache-Control'] = 'no-cache'
+    return encode_response(response, encoding)
+
+
+def _indented_response(obj):
+    """JSON indentado (JSON_INDENT_ENABLED), codificado por requisição mas com o mesmo ETag/304 e compressão."""
+    body = (current_app.json.dumps(obj, indent=2) + '\n').encode('utf-8')
+    return conditional_response(body, current_app.json.mimetype)
+
+
+def _format_error(fmt):
+    """Resposta de erro para formato inválido ou indisponível; None se o formato pode ser atendido."""
+    if fmt not in RESPONSE_FORMATS:
+        return jsonify({"error": f"Formato inválido: {fmt}. Use {', '.join(RESPONSE_FORMATS)}"}), 400
+    if fmt == 'arrow' and pa is None:
+        return jsonify({"error": "Formato arrow indisponível: pyarrow não instalado"}), 501
+    return None
+
+
+def payload_response(payload: MonitorPayload, fmt='rows', part=None):
+    """Resposta do payload no formato pedido, reaproveitando os bytes pré-codificados.
+
+    No formato arrow os monitores agrupados enviam uma tabela por vez (`part`: details ou summary).
+    Com JSON_INDENT_ENABLED o formato de linhas sai indentado.
+    """
+    error = _format_error(fmt)
+    if error:
+        return error
+    if fmt == 'arrow':
+        part = part or ('details' if payload.is_grouped else 'data')
+        if part not in payload.frames:
+            return jsonify({"error": f"Parte inválida: {part}. Use {', '.join(payload.frames)}"}), 400
+        return _snapshot_response(payload, ('arrow', part), payload.arrow_body(part), ARROW_MIMETYPE)
+    if fmt == 'columnar':
+        return _snapshot_response(payload, 'columnar', payload.columnar_body, current_app.json.mimetype)
+    if JSON_INDENT_ENABLED:
+        return _indented_response(payload.to_dict())
+    return _snapshot_response(payload, 'rows', payload.body, current_app.json.mimetype)
+
+
+def _snapshot_response(payload: MonitorPayload, key, body, mimetype):
+    """ETag e versões comprimidas guardadas no snapshot: nada é recalculado por requisição."""
+    return conditional_response(body, mimetype, payload.etag(key, body),
+                                lambda encoding: payload.compressed(key, body, encoding))
+
+
+def records_response(df: pd.DataFrame, fmt='rows'):
+    """Equivalente a jsonify(df.fillna('').to_dict('records')) sem as cópias intermediárias, ou colunar/arrow."""
+    error = _format_error(fmt)
+    if error:
+        return error
+    if fmt == 'arrow':
+        return conditional_response(encode_arrow(df), ARROW_MIMETYPE)
+    if fmt == 'columnar':
+        return conditional_response((encode_columnar(df) + '\n').encode('ascii'), current_app.json.mimetype)
+    if JSON_INDENT_ENABLED:
+        return _indented_response(frame_records(df))
+    return conditional_response((encode_records(df) + '\n').encode('ascii'), current_app.json.mimetype)
+
+
+def snapshot_records_response(snapshot: RecordsSnapshot, fmt='rows'):
+    """records_response de um snapshot compartilhado: no formato de linhas reaproveita corpo, ETag e compressão."""
+    if fmt != 'rows' or JSON_INDENT_ENABLED:
+        return records_response(snapshot.frame, fmt)
+    return _snapshot_response(snapshot, 'rows', snapshot.body, current_app.json.mimetype)
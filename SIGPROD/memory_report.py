@@ -0,0 +1,75 @@
+import resource
+import sys
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from config import MEMORY_REPORT_ENABLED
+
+
+class MemoryReport:
+    """Pico de memória (tracemalloc) por requisição e por atualização de monitor, para dimensionar os workers.
+
+    O tracemalloc é global ao processo: medições simultâneas veem o pico do processo no intervalo,
+    então o valor de cada uma é um limite superior. Buffers alocados fora do Python (ex.: strings em
+    Arrow) não entram na conta; o RSS máximo do processo entra. Modo de diagnóstico, não para uso contínuo.
+    """
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._active = []
+        self._stats = {}
+        if enabled:
+            tracemalloc.start()
+
+    def _fold_peak(self):
+        """Repassa o pico desde o último reset às medições em andamento e reinicia o pico."""
+        peak = tracemalloc.get_traced_memory()[1]
+        for entry in self._active:
+            entry['pico'] = max(entry['pico'], peak)
+        tracemalloc.reset_peak()
+
+    @contextmanager
+    def measure(self, label):
+        if not self.enabled:
+            yield
+            return
+        with self._lock:
+            self._fold_peak()
+            entry = {'inicio': tracemalloc.get_traced_memory()[0], 'pico': 0}
+            self._active.append(entry)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._fold_peak()
+                self._active = [active for active in self._active if active is not entry]
+                self._record(label, entry['pico'] - entry['inicio'])
+
+    def _record(self, label, peak_bytes):
+        stats = self._stats.setdefault(label, {'medicoes': 0, 'soma': 0, 'maximo': 0, 'ultimo': 0})
+        stats['medicoes'] += 1
+        stats['soma'] += peak_bytes
+        stats['maximo'] = max(stats['maximo'], peak_bytes)
+        stats['ultimo'] = peak_bytes
+
+    def stats(self):
+        # ru_maxrss vem em KB no Linux e em bytes no macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        with self._lock:
+            return {
+                'ativo': self.enabled,
+                'rss_max_mb': round(rss / 1e6, 1),
+                'medicoes': {
+                    label: {
+                        'medicoes': s['medicoes'],
+                        'pico_ultimo_mb': round(s['ultimo'] / 1e6, 2),
+                        'pico_max_mb': round(s['maximo'] / 1e6, 2),
+                        'pico_medio_mb': round(s['soma'] / s['medicoes'] / 1e6, 2),
+                    }
+                    for label, s in sorted(self._stats.items())
+                },
+            }
+
+
+memory_report = MemoryReport(MEMORY_REPORT_ENABLED)
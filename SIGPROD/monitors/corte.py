@@ -1,5 +1,45 @@
-from config import fq, table_exists, _pasfase_columns
+from config import fq, table_exists, _pasfase_columns, SHARED_PASFASE_ENABLED
 from data_processing import process_data_generic
+from aggregates import materialized_available, total_historico_source, PASFASE_MV, SHARED_PASFASE_RELATION
+
+def _qtd_fase_baixa_source(fq, ord_col, qtd_col, qtd_alias, shared=False, ordens=None):
+    """Quantidade apontada por ordem na fase de baixa do produto (13 ou 5), conforme o CTE produtos_fases.
+
+    Com `ordens` (nome de um CTE com a coluna ordem), soma só as ordens desse CTE.
+    """
+    scope = f"WHERE EXISTS (SELECT 1 FROM {ordens} f WHERE f.ordem = o.ordem)" if ordens else ""
+    if shared and SHARED_PASFASE_ENABLED:
+        return f"""
+            SELECT 
+                pf.ordem, 
+                SUM(pf.qtd) AS {qtd_alias}
+            FROM {SHARED_PASFASE_RELATION}
+            JOIN produtos_fases prf ON prf.fase_baixa = pf.fase
+            JOIN {fq('ordem')} o ON CAST(o.ordem AS TEXT) = pf.ordem AND o.ordproduto = prf.produto
+            {scope}
+            GROUP BY pf.ordem
+        """
+    if materialized_available(PASFASE_MV):
+        return f"""
+            SELECT 
+                CAST(pf.ordem AS TEXT) AS ordem, 
+                SUM(pf.qtd) AS {qtd_alias}
+            FROM {fq(PASFASE_MV)} pf
+            JOIN produtos_fases prf ON prf.fase_baixa = pf.fase
+            JOIN {fq('ordem')} o ON o.ordem = pf.ordem AND o.ordproduto = prf.produto
+            {scope}
+            GROUP BY pf.ordem
+        """
+    return f"""
+            SELECT 
+                CAST(pf.{ord_col} AS TEXT) AS ordem, 
+                SUM(COALESCE(pf.{qtd_col}, 0)) AS {qtd_alias}
+            FROM {fq('pasfase')} pf
+            JOIN produtos_fases prf ON prf.fase_baixa = pf.fase
+            JOIN {fq('ordem')} o ON o.ordem = pf.{ord_col} AND o.ordproduto = prf.produto
+            {scope}
+            GROUP BY pf.{ord_col}
+        """
 
 def get_query(fq, lot_table, ord_col, qtd_col):
     """Gera a query SQL para o monitor de corte com lógica específica para produtos com fases 5 e 13."""
@@ -18,23 +58,8 @@ def get_query(fq, lot_table, ord_col, qtd_col):
             FROM {fq('processo')} pr
             WHERE pr.fase = 5
         ),
-        qtd_fase AS (
-            SELECT 
-                CAST(pf.{ord_col} AS TEXT) AS ordem, 
-                SUM(COALESCE(pf.{qtd_col}, 0)) AS qtd
-            FROM {fq('pasfase')} pf
-            JOIN produtos_fases prf ON prf.fase_baixa = pf.fase
-            JOIN {fq('ordem')} o ON o.ordem = pf.{ord_col} AND o.ordproduto = prf.produto
-            GROUP BY pf.{ord_col}
-        ),
-        total_historico_por_lote AS (
-            SELECT l.lotdes, SUM(o.ordquanti) as total_qty_lote
-            FROM {fq('ordem')} o JOIN {fq(lot_table)} l ON l.lotcod = o.lotcod
-            WHERE {op_filter}
-            AND EXTRACT(YEAR FROM l.lotdtini) >= 2025
-            AND EXISTS (SELECT 1 FROM {fq('processo')} pr WHERE pr.produto = o.ordproduto AND pr.fase = 5)
-            GROUP BY l.lotdes
-        )
+        qtd_fase AS ({_qtd_fase_baixa_source(fq, ord_col, qtd_col, 'qtd', shared=True)}),
+        total_historico_por_lote AS ({total_historico_source(fq, lot_table, op_filter, '5')})
         SELECT DISTINCT
             o.ordem, o.ordproduto AS produto, p.pronome AS descricao,
             GREATEST(o.ordquanti - COALESCE(q.qtd, 0), 0) AS saldo_pendente,
@@ -59,6 +84,8 @@ def get_query(fq, lot_table, ord_col, qtd_col):
 
 def get_completed_query(fq, lot_table, ord_col, qtd_col, lote_filter_clause=""):
     """Query para dados concluídos do monitor de corte com lógica específica para produtos com fases 5 e 13."""
+    # Com filtro de lote, a quantidade da fase é somada só para as ordens filtradas
+    ordens = 'ordens_filtradas' if lote_filter_clause else None
     return f"""
         WITH produtos_fases AS (
             SELECT DISTINCT
@@ -72,24 +99,7 @@ def get_completed_query(fq, lot_table, ord_col, qtd_col, lote_filter_clause=""):
             FROM {fq('processo')} pr
             WHERE pr.fase = 5
         ),
-        qtd_fase_por_ordem AS (
-            SELECT 
-                CAST(pf.{ord_col} AS TEXT) AS ordem, 
-                SUM(COALESCE(pf.{qtd_col}, 0)) AS qtd_produzida
-            FROM {fq('pasfase')} pf
-            JOIN produtos_fases prf ON prf.fase_baixa = pf.fase
-            JOIN {fq('ordem')} o ON o.ordem = pf.{ord_col} AND o.ordproduto = prf.produto
-            GROUP BY pf.{ord_col}
-        )
-        SELECT DISTINCT
-            of.ordem, p.pronome as descricao, 
-            COALESCE(q.qtd_produzida, 0) AS qtd_produzida,
-            of.ordquanti, of.lote_descricao,
-            CASE 
-                WHEN of.orddtence != DATE '0001-01-01' THEN of.orddtence 
-                ELSE CURRENT_DATE 
-            END AS data_conclusao
-        FROM (
+        ordens_filtradas AS (
             SELECT 
                 o.ordem, o.ordproduto, o.ordquanti, o.orddtence,
                 l.lotdes as lote_descricao
@@ -101,7 +111,17 @@ def get_completed_query(fq, lot_table, ord_col, qtd_col, lote_filter_clause=""):
                 WHERE pr.produto = o.ordproduto AND pr.fase = 5
             )
             {lote_filter_clause}
-        ) of
+        ),
+        qtd_fase_por_ordem AS ({_qtd_fase_baixa_source(fq, ord_col, qtd_col, 'qtd_produzida', ordens=ordens)})
+        SELECT DISTINCT
+            of.ordem, p.pronome as descricao, 
+            COALESCE(q.qtd_produzida, 0) AS qtd_produzida,
+            of.ordquanti, of.lote_descricao,
+            CASE 
+                WHEN of.orddtence != DATE '0001-01-01' THEN of.orddtence 
+                ELSE CURRENT_DATE 
+            END AS data_conclusao
+        FROM ordens_filtradas of
         JOIN {fq('produto')} p ON p.produto = of.ordproduto
         LEFT JOIN qtd_fase_por_ordem q ON CAST(of.ordem AS TEXT) = q.ordem
         WHERE COALESCE(q.qtd_produzida, 0) > 0 
@@ -1,5 +1,23 @@
 from config import fq, table_exists, _pasfase_columns
 from data_processing import process_data_generic
+from aggregates import toqmovi_aggregate_source
+
+def _qtd_produzida_source(fq):
+    """Calcula o débito da produção (transação 3 na toqmovi) das OPs prioritárias."""
+    aggregated = toqmovi_aggregate_source(fq)
+    if aggregated:
+        toqmovi_source, qtd_expr = aggregated, 'm.qtd'
+    else:
+        toqmovi_source, qtd_expr = fq('toqmovi'), 'COALESCE(m.priquanti, 0)'
+    return f"""
+            SELECT
+                TRIM(CAST(m.priordem AS TEXT)) as ordem,
+                SUM({qtd_expr}) as qtd_produzida
+            FROM {toqmovi_source} m
+            WHERE m.pritransac = '3' -- Baixa de produção
+              AND EXISTS (SELECT 1 FROM OPs_Prioritarias op WHERE op.ordem = m.priordem)
+            GROUP BY m.priordem
+        """
 
 def get_query(fq, lot_table, ord_col, qtd_col):
     """
@@ -41,16 +59,7 @@ def get_query(fq, lot_table, ord_col, qtd_col):
                    OR p.pronome ILIKE '%PF107%' OR p.pronome ILIKE '%PT100%')
               AND p.prodpriem = '1'
         ),
-        Qtd_Produzida AS (
-            -- Calcula o débito da produção (transação 3 na toqmovi)
-            SELECT
-                TRIM(CAST(m.priordem AS TEXT)) as ordem,
-                SUM(COALESCE(m.priquanti, 0)) as qtd_produzida
-            FROM {fq('toqmovi')} m
-            WHERE m.pritransac = '3' -- Baixa de produção
-              AND EXISTS (SELECT 1 FROM OPs_Prioritarias op WHERE op.ordem = m.priordem)
-            GROUP BY m.priordem
-        ),
+        Qtd_Produzida AS ({_qtd_produzida_source(fq)}),
         total_historico_por_lote AS (
             -- Agrupa a quantidade total planejada por lote para cálculo de percentual
             SELECT 
@@ -91,6 +100,7 @@ def get_completed_query(fq, lot_table, ord_col, qtd_col, lote_filter_clause=""):
     if not all(table_exists(tbl) for tbl in ['ordem', lot_table, 'produto', 'toqmovi']):
         return "SELECT 1 WHERE 1=0"
 
+    # O filtro de lote entra em cada ramo de OPs_Prioritarias, e Qtd_Produzida só soma essas ordens
     return f"""
         WITH OPs_Prioritarias AS (
             -- Seleciona todas as ordens de Garland com prioridade '1'
@@ -99,6 +109,7 @@ def get_completed_query(fq, lot_table, ord_col, qtd_col, lote_filter_clause=""):
             JOIN {fq(lot_table)} l ON o.lotcod = l.lotcod
             JOIN {fq('produto')} p ON o.ordproduto = p.produto
             WHERE l.lotdes ILIKE '%Garland%' AND p.prodpriem = '1'
+            {lote_filter_clause}
 
             UNION
 
@@ -110,6 +121,7 @@ def get_completed_query(fq, lot_table, ord_col, qtd_col, lote_filter_clause=""):
             WHERE l.lotdes ILIKE '%Solare%'
               AND p.pronome ILIKE '%LERIADO%'
               AND p.prodpriem = '1'
+              {lote_filter_clause}
 
             UNION
 
@@ -122,17 +134,9 @@ def get_completed_query(fq, lot_table, ord_col, qtd_col, lote_filter_clause=""):
               AND (p.pronome ILIKE '%PT105%' OR p.pronome ILIKE '%PT102%' OR p.pronome ILIKE '%PT107%'
                    OR p.pronome ILIKE '%PF107%' OR p.pronome ILIKE '%PT100%')
               AND p.prodpriem = '1'
+              {lote_filter_clause}
         ),
-        Qtd_Produzida AS (
-            -- Calcula o débito da produção (transação 3 na toqmovi)
-            SELECT
-                TRIM(CAST(m.priordem AS TEXT)) as ordem,
-                SUM(COALESCE(m.priquanti, 0)) as qtd_produzida
-            FROM {fq('toqmovi')} m
-            WHERE m.pritransac = '3' -- Baixa de produção
-              AND EXISTS (SELECT 1 FROM OPs_Prioritarias op WHERE op.ordem = m.priordem)
-            GROUP BY m.priordem
-        )
+        Qtd_Produzida AS ({_qtd_produzida_source(fq)})
         SELECT 
             o.ordem, 
             p.pronome as descricao, 
@@ -149,7 +153,6 @@ def get_completed_query(fq, lot_table, ord_col, qtd_col, lote_filter_clause=""):
         JOIN {fq(lot_table)} l ON o.lotcod = l.lotcod
         LEFT JOIN Qtd_Produzida qp ON TRIM(CAST(o.ordem AS TEXT)) = qp.ordem
         WHERE COALESCE(qp.qtd_produzida, 0) > 0 
-        {lote_filter_clause}
         ORDER BY data_conclusao DESC, o.ordem
     """
 
@@ -1,5 +1,6 @@
 from config import fq, table_exists, _pasfase_columns
 from data_processing import process_data_generic
+from aggregates import pasfase_qtd_source, total_historico_source, producao_toqmovi_source, devolucoes_saldo_source
 
 def get_query(fq, lot_table, ord_col, qtd_col):
     """Gera a query SQL para o monitor de maciço."""
@@ -7,47 +8,21 @@ def get_query(fq, lot_table, ord_col, qtd_col):
     
     # Para maciço, inclui devoluções
     devolucoes_cte = f""",
-        devolucoes_saldo AS (
-            SELECT
-                o.lotcod,
-                TRIM(m.priproduto) as produto_key,
-                SUM(CASE WHEN m.pritransac = '4' THEN m.priquanti ELSE -m.priquanti END) as saldo_devolucao
-            FROM {fq('toqmovi')} m
-            JOIN {fq('ordem')} o ON TRIM(CAST(o.ordem AS TEXT)) = TRIM(CAST(m.priordem AS TEXT))
-            WHERE m.priobserv ILIKE '%%*d:%%'
-              AND m.pridata >= '2025-01-01'
-              AND m.pritransac IN ('4', '14')
-            GROUP BY 1, 2
-        )
+        devolucoes_saldo AS ({devolucoes_saldo_source(fq, shared=True)})
         """
     
     # Para maciço, a fonte de produção é a toqmovi com transação '3'
-    qtd_fase_source = f"""
-        SELECT TRIM(CAST(m.priordem AS TEXT)) as ordem, 
-               TRIM(m.priproduto) as produto, 
-               SUM(COALESCE(m.priquanti, 0)) as qtd
-        FROM {fq('toqmovi')} m
-        WHERE m.pritransac = '3' -- Baixa de produção da OP (parcial) para Maciço
-        AND (m.priobserv IS NULL OR m.priobserv NOT ILIKE '%%*d:%%')
-        GROUP BY 1, 2
-    """
+    qtd_fase_source = producao_toqmovi_source(fq)
     
     devolucao_join = f"""
         LEFT JOIN qtd_fase q ON CAST(o.ordem AS TEXT) = q.ordem AND TRIM(o.ordproduto) = q.produto
-        LEFT JOIN devolucoes_saldo ds ON ds.lotcod = o.lotcod AND ds.produto_key = TRIM(o.ordproduto)
+        LEFT JOIN devolucoes_saldo ds ON ds.lotcod = CAST(o.lotcod AS TEXT) AND ds.produto_key = TRIM(o.ordproduto)
     """
     
     return f"""
         WITH qtd_fase AS ({qtd_fase_source})
         {devolucoes_cte},
-        total_historico_por_lote AS (
-            SELECT l.lotdes, SUM(o.ordquanti) as total_qty_lote
-            FROM {fq('ordem')} o JOIN {fq(lot_table)} l ON l.lotcod = o.lotcod
-            WHERE {op_filter}
-            AND EXTRACT(YEAR FROM l.lotdtini) >= 2025
-            AND EXISTS (SELECT 1 FROM {fq('processo')} pr WHERE pr.produto = o.ordproduto AND pr.fase = %(fase)s)
-            GROUP BY l.lotdes
-        ),
+        total_historico_por_lote AS ({total_historico_source(fq, lot_table, op_filter)}),
         dados_filtrados AS (
             SELECT
                 o.ordem, o.ordproduto AS produto, p.pronome AS descricao,
@@ -72,14 +47,12 @@ def get_query(fq, lot_table, ord_col, qtd_col):
 
 def get_completed_query(fq, lot_table, ord_col, qtd_col, lote_filter_clause=""):
     """Query para dados concluídos do monitor de maciço."""
-    qtd_fase_source = f"""
-        SELECT CAST({ord_col} AS TEXT) AS ordem, SUM(COALESCE({qtd_col}, 0)) AS qtd_produzida
-        FROM {fq('pasfase')} WHERE fase = %(fase)s GROUP BY {ord_col}
-    """
+    # Com filtro de lote, a quantidade da fase é somada só para as ordens filtradas
+    ordens = 'ordens_filtradas' if lote_filter_clause else None
+    qtd_fase_source = pasfase_qtd_source(fq, ord_col, qtd_col, 'qtd_produzida', ordens=ordens)
 
     return f"""
-        WITH qtd_fase_por_ordem AS ({qtd_fase_source}),
-        ordens_filtradas AS (
+        WITH ordens_filtradas AS (
             SELECT 
                 o.ordem, o.ordproduto, o.ordquanti, o.orddtence,
                 l.lotdes as lote_descricao
@@ -90,7 +63,8 @@ def get_completed_query(fq, lot_table, ord_col, qtd_col, lote_filter_clause=""):
                 WHERE pr.produto = o.ordproduto AND pr.fase = %(fase)s
             )
             {lote_filter_clause}
-        )
+        ),
+        qtd_fase_por_ordem AS ({qtd_fase_source})
         SELECT 
             of.ordem, p.pronome as descricao, 
             COALESCE(q.qtd_produzida, 0) AS qtd_produzida,
@@ -1,5 +1,6 @@
 from config import fq, table_exists, _pasfase_columns
 from data_processing import process_data_generic
+from aggregates import pasfase_qtd_source, planilha_qtd_source, total_historico_source
 
 def get_query(fq, lot_table, ord_col, qtd_col):
     """Gera a query SQL para o monitor de pintura."""
@@ -7,28 +8,15 @@ def get_query(fq, lot_table, ord_col, qtd_col):
 
     # Pintura (fase 35) usa a tabela 'planilha' se existir
     if table_exists('planilha'):
-        qtd_fase_source = f"""
-            SELECT CAST(plaordem AS TEXT) AS ordem, SUM(COALESCE(CAST(plaquant AS NUMERIC), 0)) AS qtd
-            FROM {fq('planilha')} WHERE plafase = %(fase)s GROUP BY plaordem
-        """
+        qtd_fase_source = planilha_qtd_source(fq, 'plafase = %(fase)s')
         ordem_status_filter = "1=1"  # Ignora o status de encerramento da ordem (orddtence)
     else: # Fallback para pasfase se planilha não existir
-        qtd_fase_source = f"""
-            SELECT CAST({ord_col} AS TEXT) AS ordem, SUM(COALESCE({qtd_col}, 0)) AS qtd
-            FROM {fq('pasfase')} WHERE fase = %(fase)s GROUP BY {ord_col}
-        """
+        qtd_fase_source = pasfase_qtd_source(fq, ord_col, qtd_col)
         ordem_status_filter = "o.orddtence = DATE '0001-01-01'"
 
     return f"""
         WITH qtd_fase AS ({qtd_fase_source}),
-        total_historico_por_lote AS (
-            SELECT l.lotdes, SUM(o.ordquanti) as total_qty_lote
-            FROM {fq('ordem')} o JOIN {fq(lot_table)} l ON l.lotcod = o.lotcod
-            WHERE {op_filter}
-            AND EXTRACT(YEAR FROM l.lotdtini) >= 2025
-            AND EXISTS (SELECT 1 FROM {fq('processo')} pr WHERE pr.produto = o.ordproduto AND pr.fase = %(fase)s)
-            GROUP BY l.lotdes
-        ),
+        total_historico_por_lote AS ({total_historico_source(fq, lot_table, op_filter)}),
         dados_filtrados AS (
             SELECT
                 o.ordem, o.ordproduto AS produto, p.pronome AS descricao,
@@ -53,20 +41,15 @@ def get_query(fq, lot_table, ord_col, qtd_col):
 
 def get_completed_query(fq, lot_table, ord_col, qtd_col, lote_filter_clause=""):
     """Query para dados concluídos do monitor de pintura."""
+    # Com filtro de lote, a quantidade da fase é somada só para as ordens filtradas
+    ordens = 'ordens_filtradas' if lote_filter_clause else None
     if table_exists('planilha'):
-        qtd_fase_source = f"""
-            SELECT CAST(plaordem AS TEXT) AS ordem, SUM(COALESCE(CAST(plaquant AS NUMERIC), 0)) AS qtd_produzida
-            FROM {fq('planilha')} WHERE plafase = %(fase)s GROUP BY plaordem
-        """
+        qtd_fase_source = planilha_qtd_source(fq, 'plafase = %(fase)s', 'qtd_produzida', ordens=ordens)
     else:
-        qtd_fase_source = f"""
-            SELECT CAST({ord_col} AS TEXT) AS ordem, SUM(COALESCE({qtd_col}, 0)) AS qtd_produzida
-            FROM {fq('pasfase')} WHERE fase = %(fase)s GROUP BY {ord_col}
-        """
+        qtd_fase_source = pasfase_qtd_source(fq, ord_col, qtd_col, 'qtd_produzida', ordens=ordens)
 
     return f"""
-        WITH qtd_fase_por_ordem AS ({qtd_fase_source}),
-        ordens_filtradas AS (
+        WITH ordens_filtradas AS (
             SELECT 
                 o.ordem, o.ordproduto, o.ordquanti, o.orddtence,
                 l.lotdes as lote_descricao
@@ -77,7 +60,8 @@ def get_completed_query(fq, lot_table, ord_col, qtd_col, lote_filter_clause=""):
                 WHERE pr.produto = o.ordproduto AND pr.fase = %(fase)s
             )
             {lote_filter_clause}
-        )
+        ),
+        qtd_fase_por_ordem AS ({qtd_fase_source})
         SELECT 
             of.ordem, p.pronome as descricao, 
             COALESCE(q.qtd_produzida, 0) AS qtd_produzida,
@@ -1,5 +1,6 @@
 from config import fq, table_exists, _pasfase_columns
 from data_processing import process_data_generic
+from aggregates import debito_toqmovi_parts
 
 def get_query(fq, lot_table, ord_col, qtd_col):
     """Gera a query SQL para o monitor de saída para montagem."""
@@ -7,6 +8,7 @@ def get_query(fq, lot_table, ord_col, qtd_col):
         return "SELECT 1 WHERE 1=0"
     
     op_filter = "(l.lotdes ILIKE '%%Petra%%' OR l.lotdes ILIKE '%%Solare%%' OR l.lotdes ILIKE '%%Garland%%')"
+    debito_source, debito_qtd, _, debito_filter = debito_toqmovi_parts(fq)
     
     return f"""
         WITH
@@ -38,10 +40,10 @@ def get_query(fq, lot_table, ord_col, qtd_col):
             SELECT
                 TRIM(CAST(m.priordem AS TEXT)) as priordem_key,
                 TRIM(m.priproduto) as priproduto_key,
-                SUM(m.priquanti) as quanti_deb
-            FROM {fq('toqmovi')} m
+                SUM({debito_qtd}) as quanti_deb
+            FROM {debito_source} m
             WHERE EXISTS (SELECT 1 FROM requisicoes_base rb WHERE TRIM(CAST(rb.reqord AS TEXT)) = TRIM(CAST(m.priordem AS TEXT)) AND TRIM(rb.reqproduto) = TRIM(m.priproduto))
-            AND m.pritransac = '14' AND (m.priobserv IS NULL OR m.priobserv = '') AND m.pridata >= '2025-01-01'
+            AND {debito_filter}
             GROUP BY 1, 2
         ),
         dados_saldo AS (
@@ -66,6 +68,9 @@ def get_completed_query(fq, lot_table, ord_col, qtd_col, lote_filter_clause=""):
     """Query para dados concluídos do monitor de saída para montagem."""
     if not all(table_exists(tbl) for tbl in ['toqmovi', 'reqordem']): 
         return "SELECT 1 WHERE 1=0"
+    debito_source, debito_qtd, debito_data, debito_filter = debito_toqmovi_parts(fq)
+    # Com filtro de lote, os débitos são lidos só para as ordens filtradas (comparação direta, sem TRIM/CAST)
+    ordens_scope = "AND EXISTS (SELECT 1 FROM ordens_produtos_relevantes f WHERE f.ordem = m.priordem)" if lote_filter_clause else ""
     
     return f"""
         WITH 
@@ -84,10 +89,10 @@ def get_completed_query(fq, lot_table, ord_col, qtd_col, lote_filter_clause=""):
             GROUP BY o.ordem, r.reqproduto
         ),
         movimentos_concluidos AS (
-            SELECT m.priordem AS ordem, m.priproduto AS produto, SUM(m.priquanti) AS qtd_produzida, MAX(m.pridata) AS data_conclusao
-            FROM {fq('toqmovi')} m
+            SELECT m.priordem AS ordem, m.priproduto AS produto, SUM({debito_qtd}) AS qtd_produzida, MAX({debito_data}) AS data_conclusao
+            FROM {debito_source} m
             JOIN ordens_produtos_relevantes opr ON TRIM(CAST(m.priordem AS TEXT)) = TRIM(CAST(opr.ordem AS TEXT)) AND TRIM(m.priproduto) = TRIM(opr.reqproduto)
-            WHERE m.pritransac = '14' AND (m.priobserv IS NULL OR m.priobserv = '') AND m.pridata >= '2025-01-01'
+            WHERE {debito_filter} {ordens_scope}
             GROUP BY m.priordem, m.priproduto
         ),
         reserva_num AS (
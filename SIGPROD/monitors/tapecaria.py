@@ -1,7 +1,8 @@
 from config import fq, table_exists, _pasfase_columns
-from data_processing import process_data_generic
+from data_processing import process_data_generic, lot_schedule_index, TAPECARIA_KEY
+from aggregates import planilha_qtd_source
+import numpy as np
 import pandas as pd
-import re
 
 def get_query(fq, lot_table, ord_col, qtd_col):
     """Gera a query SQL para o monitor de tapeçaria."""
@@ -16,14 +17,7 @@ def get_query(fq, lot_table, ord_col, qtd_col):
             JOIN {fq(lot_table)} l ON o.lotcod = l.lotcod
             WHERE pr.prccodig = '136' AND EXTRACT(YEAR FROM l.lotdtini) >= 2025
         ),
-        quantidades_planilhadas AS (
-            SELECT 
-                CAST(plaordem AS TEXT) as ordem, 
-                SUM(COALESCE(CAST(plaquant AS NUMERIC), 0)) as qtd_planilhada
-            FROM {fq('planilha')} 
-            WHERE plaopera = '136' 
-            GROUP BY plaordem
-        ),
+        quantidades_planilhadas AS ({planilha_qtd_source(fq, "plaopera = '136'", 'qtd_planilhada')}),
         total_historico_por_lote AS (
             SELECT l.lotdes, SUM(o.ordquanti) as total_qty_lote
             FROM {fq('ordem')} o JOIN {fq(lot_table)} l ON l.lotcod = o.lotcod
@@ -56,7 +50,9 @@ def get_completed_query(fq, lot_table, ord_col, qtd_col, lote_filter_clause=""):
     """Query para dados concluídos do monitor de tapeçaria."""
     if not all(table_exists(tbl) for tbl in ['ordem', 'processo', 'planilha', 'produto', lot_table]):
         return "SELECT 1 WHERE 1=0"
-    
+    # Com filtro de lote, a quantidade planilhada é somada só para as ordens filtradas
+    ordens = 'ordens_com_fase' if lote_filter_clause else None
+
     return f"""
         WITH 
         ordens_com_fase AS (
@@ -67,14 +63,7 @@ def get_completed_query(fq, lot_table, ord_col, qtd_col, lote_filter_clause=""):
             WHERE pr.prccodig = '136' AND EXTRACT(YEAR FROM l.lotdtini) >= 2025
             {lote_filter_clause}
         ),
-        quantidades_planilhadas AS (
-            SELECT 
-                CAST(plaordem AS TEXT) as ordem, 
-                SUM(COALESCE(CAST(plaquant AS NUMERIC), 0)) as qtd_produzida
-            FROM {fq('planilha')} 
-            WHERE plaopera = '136' 
-            GROUP BY plaordem
-        )
+        quantidades_planilhadas AS ({planilha_qtd_source(fq, "plaopera = '136'", 'qtd_produzida', ordens=ordens)})
         SELECT
             ocf.ordem, 
             p.pronome as descricao,
@@ -92,40 +81,13 @@ def get_completed_query(fq, lot_table, ord_col, qtd_col, lote_filter_clause=""):
         ORDER BY data_conclusao DESC, ocf.ordem
     """
 
-def _parse_tapecaria_dates(text: str):
-    """Função de parsing de data específica para tapeçaria."""
-    if not text: return None, None
-    try:
-        def to_iso(s: str):
-            parts = s.split('/')
-            if len(parts) != 3: return None
-            dd, mm, yy = parts
-            if len(yy) == 2: yy = '20' + yy
-            return f"{yy}-{mm}-{dd}"
-
-        pattern_tapecaria = r"TAPECARIA\(136\):\s*(\d{2}/\d{2}/\d{2,4})\s*-\s*(\d{2}/\d{2}/\d{2,4})"
-        m_tapecaria = re.search(pattern_tapecaria, str(text), flags=re.IGNORECASE)
-        if m_tapecaria:
-            return to_iso(m_tapecaria.group(1)), to_iso(m_tapecaria.group(2))
-        
-        pattern_tapecaria_single = r"TAPECARIA\(136\):\s*(\d{2}/\d{2}/\d{2,4})"
-        m_tapecaria_single = re.search(pattern_tapecaria_single, str(text), flags=re.IGNORECASE)
-        if m_tapecaria_single:
-            iso_date = to_iso(m_tapecaria_single.group(1))
-            return iso_date, iso_date
-        
-        return None, None
-    except Exception:
-        return None, None
-
 def process_data(df: pd.DataFrame, fase):
     """Processa os dados especificamente para o monitor de tapeçaria."""
     if df.empty: return df
 
     # 1. Parse de Datas
     if 'lote_trans' in df.columns:
-        dates = df['lote_trans'].fillna('').apply(_parse_tapecaria_dates)
-        df[['data_inicio_prevista', 'data_fim_prevista']] = pd.DataFrame(dates.tolist(), index=df.index)
+        df['data_inicio_prevista'], df['data_fim_prevista'] = lot_schedule_index.phase_dates(df, TAPECARIA_KEY)
         
         df['corte_dtini'] = pd.to_datetime(df['data_inicio_prevista'], errors='coerce')
         df['orddtprev'] = pd.to_datetime(df['data_fim_prevista'], errors='coerce')
@@ -143,22 +105,27 @@ def process_data(df: pd.DataFrame, fase):
     delayed_mask = (df['orddtprev'].notna()) & (df['orddtprev'] < today)
     df.loc[delayed_mask, 'status'] = 'atrasado'
     
-    # 3. Lógica de filtragem específica para tapeçaria
-    df_atrasado = df[df['status'] == 'atrasado']
-    df_nao_atrasado = df[df['status'] != 'atrasado'].copy()
-    df_em_dia = pd.DataFrame()
+    # 3. Lógica de filtragem específica para tapeçaria (máscaras sobre o frame, uma única seleção no final)
+    atrasado_mask = df['status'] == 'atrasado'
+    nao_atrasado_mask = ~atrasado_mask
+    em_dia_mask = None
 
-    if not df_nao_atrasado.empty:
-        df_ativas_ou_futuras_proximas = df_nao_atrasado[df_nao_atrasado['corte_dtini'] <= today]
+    if nao_atrasado_mask.any():
+        ativas_ou_futuras_proximas = nao_atrasado_mask & (df['corte_dtini'] <= today)
         
-        if not df_ativas_ou_futuras_proximas.empty:
-             df_em_dia = df_ativas_ou_futuras_proximas
+        if ativas_ou_futuras_proximas.any():
+             em_dia_mask = ativas_ou_futuras_proximas
         else:
-            proxima_data_inicio = df_nao_atrasado['corte_dtini'].min()
+            proxima_data_inicio = df.loc[nao_atrasado_mask, 'corte_dtini'].min()
             if pd.notna(proxima_data_inicio):
-                df_em_dia = df_nao_atrasado[df_nao_atrasado['corte_dtini'] == proxima_data_inicio]
+                em_dia_mask = nao_atrasado_mask & (df['corte_dtini'] == proxima_data_inicio)
 
-    if not df_atrasado.empty or not df_em_dia.empty:
-        return pd.concat([df_atrasado, df_em_dia])
+    # Atrasadas primeiro, depois as em dia (mesma ordem do concat anterior)
+    positions = [np.flatnonzero(atrasado_mask.to_numpy())]
+    if em_dia_mask is not None:
+        positions.append(np.flatnonzero(em_dia_mask.to_numpy()))
+    positions = np.concatenate(positions)
+    if len(positions):
+        return df.iloc[positions]
     else:
         return pd.DataFrame(columns=df.columns)
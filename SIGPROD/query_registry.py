@@ -0,0 +1,161 @@
+import hashlib
+import json
+import re
+import threading
+import time
+import pandas as pd
+from config import engine, fq, DB_SCHEMA, schema_catalog, PREPARED_PLAN_SAMPLE_EVERY
+
+# Tokens do estilo pyformat das queries dos monitores: o escape %% e os placeholders %(fase)s
+_PARAM_RE = re.compile(r'%%|%\((\w+)\)s')
+
+
+def _to_server_side(sql):
+    """Converte os placeholders %(nome)s em $n para o PREPARE e desfaz o escape de %%.
+
+    Uma passada da esquerda para a direita, como a interpolação do psycopg2: o texto enviado ao PREPARE é o mesmo
+    da execução sem prepared statement (ex.: LIKE '%%x%%' vira LIKE '%x%') e %%(x)s não é lido como placeholder.
+    """
+    param_names = []
+
+    def replace(match):
+        name = match.group(1)
+        if name is None:
+            return '%'
+        if name not in param_names:
+            param_names.append(name)
+        return f'${param_names.index(name) + 1}'
+
+    return _PARAM_RE.sub(replace, sql), param_names
+
+
+class QueryRegistry:
+    """SQL dos monitores compilado uma vez por combinação de schema/lote/pasfase e executado como prepared statement."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._compiled = {}
+        self._catalog_version = None
+        self._generation = 0
+        self._stats = {}
+
+    def invalidate(self):
+        """Descarta as queries compiladas; as conexões do pool fazem DEALLOCATE ALL no próximo uso."""
+        with self._lock:
+            self._compiled.clear()
+            self._generation += 1
+
+    def compile(self, monitor_name, module, lot_table, ord_col, qtd_col):
+        """Retorna a query compilada do monitor, gerando o SQL apenas na primeira vez para a combinação."""
+        catalog_version = schema_catalog.version
+        # A versão do catálogo entra na chave: um SQL gerado com o catálogo antigo nunca é servido depois da troca
+        key = (monitor_name, DB_SCHEMA, lot_table, ord_col, qtd_col, catalog_version)
+        with self._lock:
+            if catalog_version != self._catalog_version:
+                self._compiled.clear()
+                self._generation += 1
+                self._catalog_version = catalog_version
+            compiled = self._compiled.get(key)
+        if compiled is not None:
+            return compiled
+
+        sql, param_names = _to_server_side(module.get_query(fq, lot_table, ord_col, qtd_col))
+        digest = hashlib.sha1(json.dumps(key).encode('utf-8') + sql.encode('utf-8')).hexdigest()[:12]
+        compiled = {
+            'name': f'sigprod_{monitor_name}_{digest}',
+            'sql': sql,
+            'param_names': param_names,
+        }
+        with self._lock:
+            if catalog_version == self._catalog_version:
+                self._compiled[key] = compiled
+        return compiled
+
+    def execute(self, monitor_name, module, lot_table, ord_col, qtd_col, params):
+        """Executa a query do monitor via EXECUTE em uma conexão do pool. Retorna (df, erro)."""
+        compiled = self.compile(monitor_name, module, lot_table, ord_col, qtd_col)
+        name = compiled['name']
+        args = ', '.join(f'%({p})s' for p in compiled['param_names'])
+        execute_sql = f"EXECUTE {name}({args})" if args else f"EXECUTE {name}"
+
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            # info é preservado pelo pool enquanto a conexão física existir
+            if connection.info.get('sigprod_generation') != self._generation:
+                cursor.execute("DEALLOCATE ALL")
+                connection.info['sigprod_prepared'] = set()
+                connection.info['sigprod_generation'] = self._generation
+            prepared = connection.info['sigprod_prepared']
+
+            if name not in prepared:
+                started = time.perf_counter()
+                cursor.execute(f"PREPARE {name} AS {compiled['sql']}")
+                prepare_ms = (time.perf_counter() - started) * 1000
+                prepared.add(name)
+                self._record(monitor_name, prepare_ms=prepare_ms, planning_ms=self._explain_planning(cursor, execute_sql, params))
+            elif self._plan_sample_due(monitor_name):
+                # Depois das primeiras execuções o Postgres pode passar ao plano genérico: amostra de novo
+                self._record(monitor_name, planning_ms=self._explain_planning(cursor, execute_sql, params))
+
+            started = time.perf_counter()
+            cursor.execute(execute_sql, params)
+            rows = cursor.fetchall()
+            execution_ms = (time.perf_counter() - started) * 1000
+            columns = [col[0] for col in cursor.description]
+            connection.commit()
+            self._record(monitor_name, execution_ms=execution_ms)
+            return pd.DataFrame.from_records(rows, columns=columns, coerce_float=True), None
+        except Exception as e:
+            connection.rollback()
+            print(f"Erro ao executar a query preparada do monitor {monitor_name}: {e}")
+            return None, f"Erro ao executar a consulta: {e}"
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _explain_planning(cursor, execute_sql, params):
+        """Tempo de planejamento do EXECUTE (EXPLAIN sem ANALYZE apenas planeja; o SUMMARY informa o tempo)."""
+        cursor.execute(f"EXPLAIN (SUMMARY, FORMAT JSON) {execute_sql}", params)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0].get('Planning Time')
+
+    def _plan_sample_due(self, monitor_name):
+        with self._lock:
+            stats = self._stats.get(monitor_name)
+            return (bool(stats) and PREPARED_PLAN_SAMPLE_EVERY > 0 and stats['execucoes'] > 0
+                    and stats['execucoes'] % PREPARED_PLAN_SAMPLE_EVERY == 0)
+
+    def _record(self, monitor_name, prepare_ms=None, planning_ms=None, execution_ms=None):
+        with self._lock:
+            stats = self._stats.setdefault(monitor_name, {
+                'preparacoes': 0,
+                'ultimo_prepare_ms': None,
+                'ultimo_planejamento_ms': None,
+                'amostras_planejamento': 0,
+                'execucoes': 0,
+                'ultima_execucao_ms': None,
+                'media_execucao_ms': None,
+            })
+            if prepare_ms is not None:
+                stats['preparacoes'] += 1
+                stats['ultimo_prepare_ms'] = round(prepare_ms, 2)
+            if planning_ms is not None:
+                stats['amostras_planejamento'] += 1
+                stats['ultimo_planejamento_ms'] = round(planning_ms, 2)
+            if execution_ms is not None:
+                count = stats['execucoes']
+                average = stats['media_execucao_ms'] or 0.0
+                stats['execucoes'] = count + 1
+                stats['ultima_execucao_ms'] = round(execution_ms, 2)
+                stats['media_execucao_ms'] = round((average * count + execution_ms) / (count + 1), 2)
+
+    def stats(self):
+        """Tempo de preparação/planejamento versus execução por monitor (planejamento amostrado a cada N execuções)."""
+        with self._lock:
+            return {name: dict(values) for name, values in self._stats.items()}
+
+
+query_registry = QueryRegistry()
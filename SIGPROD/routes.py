@@ -1,14 +1,47 @@
-from flask import jsonify, request, send_file, render_template, send_from_directory
+from flask import g, jsonify, make_response, request, send_file, render_template, Response, stream_with_context
+import json
+from datetime import date
 import pandas as pd
-import io
-from config import fq, table_exists, _pasfase_columns, fetch_data_from_db, get_lot_table
-from data_processing import format_dataframe_for_json
-
-# Importar todos os módulos de monitor
-from monitors import corte, prensa, usinagem, macico, chapa, saida_montagem, saida_pintura, pintura, tapecaria, garland
+from config import table_exists, _pasfase_columns, fetch_data_from_db, get_lot_table, REFRESH_SCHEDULER_ENABLED, REFRESH_INTERVAL_SECONDS, STREAM_HEARTBEAT_SECONDS, STREAM_RETRY_MS
+from data_processing import format_dataframe_for_json, lot_schedule_index
+from json_encoding import payload_response, records_response, snapshot_records_response, delta_response, stream_event
+from snapshots import MONITOR_MODULES, get_production_snapshot, get_devolucoes_snapshot, change_stats, snapshot_versions, snapshot_notifier
+from channels import parse_channels, parse_cursor, format_cursor, channel_update, channel_message, batch_body
+from scheduler import refresh_scheduler
+from query_registry import query_registry
+from toqmovi_ledger import toqmovi_ledger
+from change_detection import change_tracker
+from memory_report import memory_report
+from compression import static_assets
+from export import export_response, export_format_error
+from export_jobs import export_jobs
+from completed import parse_lotes, completed_query, parse_page, fetch_page, cached_completed, completed_cache
+
+def _monitor_response(key, payload):
+    """Resposta do /api/data: delta desde a versão do cliente com since=, senão o payload no formato pedido."""
+    since = request.args.get('since', type=int)
+    if since is None:
+        # format=rows (padrão) | columnar | arrow; no arrow, `parte` escolhe details/summary dos agrupados
+        return payload_response(payload, request.args.get('format', default='rows'), request.args.get('parte'))
+    version, previous = snapshot_versions.resolve(key, payload, since)
+    return delta_response(payload, version, since, previous)
 
 def register_routes(app):
     """Registra todas as rotas da aplicação."""
+
+    # --- Relatório de memória por requisição (MEMORY_REPORT_ENABLED) ---
+    if memory_report.enabled:
+        @app.before_request
+        def start_memory_measure():
+            fase = request.args.get('fase')
+            g.memory_measure = memory_report.measure(f"{request.path}?fase={fase}" if fase else request.path)
+            g.memory_measure.__enter__()
+
+        @app.teardown_request
+        def stop_memory_measure(exc):
+            measure = g.pop('memory_measure', None)
+            if measure is not None:
+                measure.__exit__(None, None, None)
     
     # --- Rotas de Renderização ---
     @app.route('/')
@@ -63,74 +96,16 @@ def register_routes(app):
             return jsonify({"error": f"Tabela de lote '{lot_table}' não encontrada"}), 500
 
         ord_col, qtd_col = _pasfase_columns()
-        query = garland.get_query(fq, lot_table, ord_col, qtd_col)
-        df, error = fetch_data_from_db(query, params={'fase': 40})
+        payload, error = get_production_snapshot(40, lot_table, ord_col, qtd_col)
         if error:
             return jsonify({"error": error}), 500
 
-        if df is None or df.empty:
-            return jsonify({"is_grouped": False, "data": []})
-
-        df_processed = garland.process_data(df.copy(), 40)
-
-        # Para Garland, aplicar agrupamento como outros monitores
-        if not df_processed.empty:
-            df_details = df_processed.copy()
-            
-            df_details['op_group'] = df_details['lote_descricao'].str.extract(r'((?:OP|O\.P\.?)\s?\d+/\d+)', expand=False).fillna(df_details['lote_descricao'])
-            
-            agg_rules = {
-                'saldo_pendente': ('saldo_pendente', 'sum'),
-                'corte_dtini': ('corte_dtini', 'min'),
-                'orddtprev': ('orddtprev', 'min'),
-            }
-            if 'devolucao_saldo' in df_details.columns:
-                agg_rules['devolucao_saldo'] = ('devolucao_saldo', 'sum')
-
-            df_summary = df_details.groupby('op_group').agg(**agg_rules).reset_index()
-
-            sub_op_totals = df_details.drop_duplicates(subset=['lote_descricao'])
-            total_historico_map = sub_op_totals.groupby('op_group')['total_historico_lote'].sum()
-            
-            df_summary['total_historico_lote'] = df_summary['op_group'].map(total_historico_map)
-            df_summary = df_summary.rename(columns={'op_group': 'lote_descricao'})
-            
-            today = pd.to_datetime('today').normalize()
-            df_summary['status'] = 'futuro'
-            on_time_mask = (df_summary['corte_dtini'].notna()) & (df_summary['orddtprev'].notna()) & (df_summary['corte_dtini'] <= today) & (df_summary['orddtprev'] >= today)
-            df_summary.loc[on_time_mask, 'status'] = 'em_dia'
-            
-            delayed_mask = (df_summary['orddtprev'].notna()) & (df_summary['orddtprev'] < today)
-            df_summary.loc[delayed_mask, 'status'] = 'atrasado'
-            
-            for df_to_format in [df_summary, df_details]:
-                if not df_to_format.empty:
-                    sort_cols = ['corte_dtini']
-                    if 'ordem' in df_to_format.columns: 
-                        sort_cols.append('ordem')
-                    else: 
-                        sort_cols.append('lote_descricao')
-                    
-                    df_to_format.sort_values(by=sort_cols, na_position='last', inplace=True)
-                    date_cols = [col for col in ['orddtprev', 'orddtence', 'lotdtini', 'lotdtpre', 'corte_dtini', 'data_inicio_prevista', 'data_fim_prevista'] if col in df_to_format.columns]
-                    for col in date_cols:
-                        if pd.api.types.is_datetime64_any_dtype(df_to_format[col]):
-                            df_to_format[col] = df_to_format[col].dt.strftime('%Y-%m-%d')
-            
-            return jsonify({
-                "is_grouped": True,
-                "summary": df_summary.fillna('').to_dict('records'),
-                "details": df_details.fillna('').to_dict('records')
-            })
-
-        return jsonify({
-            "is_grouped": False,
-            "data": df_processed.fillna('').to_dict('records')
-        })
+        return _monitor_response((40, lot_table, ord_col, qtd_col), payload)
 
     @app.route('/static/<path:filename>')
     def static_files(filename):
-        return send_from_directory('static', filename)
+        # tailwind.css, js e fontes vão comprimidos (gzip/br) conforme o Accept-Encoding
+        return static_assets.response(filename)
 
     # --- Rotas da API ---
     @app.route('/api/data', methods=['GET'])
@@ -142,215 +117,196 @@ def register_routes(app):
         
         ord_col, qtd_col = _pasfase_columns()
 
-        # Selecionar o módulo correto baseado na fase
-        monitor_modules = {
-            5: corte,
-            10: prensa,
-            15: usinagem,
-            25: macico,
-            30: chapa,
-            35: pintura,
-            40: garland,
-            136: tapecaria,
-            998: saida_montagem,
-            999: saida_pintura
-        }
-        
-        monitor_module = monitor_modules.get(fase)
-        if not monitor_module:
+        if fase not in MONITOR_MODULES:
             return jsonify({"error": f"Monitor não encontrado para fase {fase}"}), 400
 
-        query = monitor_module.get_query(fq, lot_table, ord_col, qtd_col)
-        df, error = fetch_data_from_db(query, params={'fase': fase})
+        # Snapshot compartilhado: TVs da mesma fase reaproveitam a mesma consulta
+        payload, error = get_production_snapshot(fase, lot_table, ord_col, qtd_col)
         if error: 
             return jsonify({"error": error}), 500
-        
-        if df is None or df.empty:
-            return jsonify({"is_grouped": False, "data": []})
-
-        df_processed = monitor_module.process_data(df.copy(), fase)
-
-        # Para os monitores que agrupam OPs (Maciço, Chapa, Pintura, Saída Pintura, Saída Montagem, Garland)
-        if fase in [25, 30, 35, 40, 998, 999, 136] and not df_processed.empty:
-            df_details = df_processed.copy()
-            
-            df_details['op_group'] = df_details['lote_descricao'].str.extract(r'((?:OP|O\.P\.?)\s?\d+/\d+)', expand=False).fillna(df_details['lote_descricao'])
-            
-            agg_rules = {
-                'saldo_pendente': ('saldo_pendente', 'sum'),
-                'corte_dtini': ('corte_dtini', 'min'),
-                'orddtprev': ('orddtprev', 'min'),
-            }
-            if 'devolucao_saldo' in df_details.columns:
-                agg_rules['devolucao_saldo'] = ('devolucao_saldo', 'sum')
-
-            df_summary = df_details.groupby('op_group').agg(**agg_rules).reset_index()
-
-            sub_op_totals = df_details.drop_duplicates(subset=['lote_descricao'])
-            total_historico_map = sub_op_totals.groupby('op_group')['total_historico_lote'].sum()
-            
-            df_summary['total_historico_lote'] = df_summary['op_group'].map(total_historico_map)
-            df_summary = df_summary.rename(columns={'op_group': 'lote_descricao'})
-            
-            today = pd.to_datetime('today').normalize()
-            df_summary['status'] = 'futuro'
-            on_time_mask = (df_summary['corte_dtini'].notna()) & (df_summary['orddtprev'].notna()) & (df_summary['corte_dtini'] <= today) & (df_summary['orddtprev'] >= today)
-            df_summary.loc[on_time_mask, 'status'] = 'em_dia'
-            
-            delayed_mask = (df_summary['orddtprev'].notna()) & (df_summary['orddtprev'] < today)
-            df_summary.loc[delayed_mask, 'status'] = 'atrasado'
-            
-            for df_to_format in [df_summary, df_details]:
-                if not df_to_format.empty:
-                    sort_cols = ['corte_dtini']
-                    if 'ordem' in df_to_format.columns: 
-                        sort_cols.append('ordem')
-                    else: 
-                        sort_cols.append('lote_descricao')
-                    
-                    df_to_format.sort_values(by=sort_cols, na_position='last', inplace=True)
-                    date_cols = [col for col in ['orddtprev', 'orddtence', 'lotdtini', 'lotdtpre', 'corte_dtini', 'data_inicio_prevista', 'data_fim_prevista'] if col in df_to_format.columns]
-                    for col in date_cols:
-                        if pd.api.types.is_datetime64_any_dtype(df_to_format[col]):
-                            df_to_format[col] = df_to_format[col].dt.strftime('%Y-%m-%d')
-            
-            return jsonify({
-                "is_grouped": True,
-                "summary": df_summary.fillna('').to_dict('records'),
-                "details": df_details.fillna('').to_dict('records')
-            })
-
-        # Para os outros monitores, a estrutura de dados continua a mesma
-        if not df_processed.empty:
-            df_processed.sort_values(by=['corte_dtini', 'ordem'], na_position='last', inplace=True)
-            date_cols = [col for col in ['orddtprev', 'orddtence', 'lotdtini', 'lotdtpre', 'corte_dtini', 'data_inicio_prevista', 'data_fim_prevista'] if col in df_processed.columns]
-            for col in date_cols:
-                if pd.api.types.is_datetime64_any_dtype(df_processed[col]):
-                    df_processed[col] = df_processed[col].dt.strftime('%Y-%m-%d')
 
+        # since=<versão> devolve só as linhas alteradas desde a versão que o cliente já tem
+        return _monitor_response((fase, lot_table, ord_col, qtd_col), payload)
+
+    @app.route('/api/stream', methods=['GET'])
+    def stream_production_data():
+        """Push via Server-Sent Events: um evento `snapshot` (delta desde o Last-Event-ID) a cada resultado novo da fase.
+
+        Todas as conexões leem o mesmo snapshot publicado pelo agendador; nenhuma consulta extra ao banco.
+        """
+        fase = request.args.get('fase', default=5, type=int)
+        if fase not in MONITOR_MODULES:
+            return jsonify({"error": f"Monitor não encontrado para fase {fase}"}), 400
+        lot_table = get_lot_table()
+        if not table_exists(lot_table):
+            return jsonify({"error": f"Tabela de lote '{lot_table}' não encontrada"}), 500
+        ord_col, qtd_col = _pasfase_columns()
+        key = (fase, lot_table, ord_col, qtd_col)
+        # Na reconexão o navegador reenvia o id do último evento recebido
+        last_event_id = request.headers.get('Last-Event-ID', default=request.args.get('since'))
+        since = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+
+        def events():
+            nonlocal since
+            yield f"retry: {STREAM_RETRY_MS}\n\n"
+            generations = {key: snapshot_notifier.generation(key)}
+            while True:
+                payload, error = get_production_snapshot(fase, lot_table, ord_col, qtd_col)
+                if error:
+                    yield stream_event('erro', json.dumps({"error": error}))
+                else:
+                    version, previous = snapshot_versions.resolve(key, payload, since)
+                    if version != since:
+                        body = payload.delta_body(version, since, previous)
+                        yield stream_event('snapshot', body.decode('ascii').rstrip('\n'), version)
+                        since = version
+                new_generations = snapshot_notifier.wait(generations, STREAM_HEARTBEAT_SECONDS)
+                if new_generations == generations:
+                    yield stream_event('heartbeat', '{}')
+                generations = new_generations
+
+        return Response(stream_with_context(events()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    @app.route('/api/stream/multi', methods=['GET'])
+    def stream_channels():
+        """Várias fases e tipos de monitor numa só conexão SSE: canais=data:5,data:136,devolucoes:25,completed:30.
+
+        Cada evento `snapshot` traz {"canal", "dados"} de um canal que mudou; o id do evento é o cursor com a
+        versão de todos os canais, reenviado pelo navegador na reconexão (Last-Event-ID).
+        """
+        channels, error = parse_channels(request.args.get('canais'))
+        if error:
+            return jsonify({"error": error}), 400
+        lot_table = get_lot_table()
+        if not table_exists(lot_table):
+            return jsonify({"error": f"Tabela de lote '{lot_table}' não encontrada"}), 500
+        ord_col, qtd_col = _pasfase_columns()
+        cursor = parse_cursor(request.headers.get('Last-Event-ID', default=request.args.get('cursor')))
+        # Os canais data acordam com a publicação do agendador; devoluções e concluídos são conferidos a cada volta
+        keys = [(fase, lot_table, ord_col, qtd_col) for _, kind, fase in channels if kind == 'data']
+
+        def events():
+            yield f"retry: {STREAM_RETRY_MS}\n\n"
+            generations = {key: snapshot_notifier.generation(key) for key in keys}
+            while True:
+                for channel in channels:
+                    name = channel[0]
+                    version, body, error = channel_update(channel, cursor.get(name), lot_table, ord_col, qtd_col)
+                    if error:
+                        yield stream_event('erro', json.dumps({"canal": name, "error": error}))
+                    elif body is not None:
+                        cursor[name] = version
+                        yield stream_event('snapshot', channel_message(name, body), format_cursor(cursor))
+                new_generations = snapshot_notifier.wait(generations, STREAM_HEARTBEAT_SECONDS)
+                if new_generations == generations:
+                    yield stream_event('heartbeat', '{}')
+                generations = new_generations
+
+        return Response(stream_with_context(events()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    @app.route('/api/batch', methods=['GET'])
+    def get_batch():
+        """Versão em polling do /api/stream/multi: uma requisição devolve os canais alterados desde `cursor`."""
+        channels, error = parse_channels(request.args.get('canais'))
+        if error:
+            return jsonify({"error": error}), 400
+        lot_table = get_lot_table()
+        if not table_exists(lot_table):
+            return jsonify({"error": f"Tabela de lote '{lot_table}' não encontrada"}), 500
+        ord_col, qtd_col = _pasfase_columns()
+        body = batch_body(channels, parse_cursor(request.args.get('cursor')), lot_table, ord_col, qtd_col)
+        return Response(body, mimetype='application/json', headers={'Cache-Control': 'no-cache'})
+
+    @app.route('/api/refresh_status', methods=['GET'])
+    def get_refresh_status():
+        """Métricas do agendador: duração da última atualização, último sucesso e falhas por monitor."""
         return jsonify({
-            "is_grouped": False,
-            "data": df_processed.fillna('').to_dict('records')
+            "ativo": REFRESH_SCHEDULER_ENABLED,
+            "intervalo_s": REFRESH_INTERVAL_SECONDS,
+            "monitores": refresh_scheduler.stats(),
+            "tarefas": refresh_scheduler.task_stats(),
+            "ledger_toqmovi": toqmovi_ledger.stats(),
+            "deteccao_mudancas": {**change_tracker.stats(), "monitores": change_stats()}
         })
 
+    @app.route('/api/lot_schedule', methods=['GET'])
+    def get_lot_schedule():
+        """Cronograma de todas as fases por lote, a partir do índice já montado pelos monitores."""
+        lotes_param = request.args.get('lotes')
+        lotes = {lote.strip() for lote in lotes_param.split(',') if lote.strip()} if lotes_param else None
+        return jsonify(lot_schedule_index.timeline(lotes))
+
+    @app.route('/api/memory_report', methods=['GET'])
+    def get_memory_report():
+        """Pico de memória por rota/fase e por atualização de monitor, para dimensionar os workers."""
+        return jsonify(memory_report.stats())
+
+    @app.route('/api/query_stats', methods=['GET'])
+    def get_query_stats():
+        """Tempos de preparação/planejamento e de execução das queries preparadas por monitor."""
+        return jsonify(query_registry.stats())
+
     @app.route('/api/completed', methods=['GET'])
     def get_completed_data():
+        """Concluídos da fase; com limite (em ordens), paginado por (data_conclusao, ordem).
+
+        A página seguinte é pedida com cursor=<X-Next-Cursor>; sem esse cabeçalho não há mais páginas.
+        """
         fase = request.args.get('fase', default=5, type=int)
-        lotes_param = request.args.get('lotes')
         lot_table = get_lot_table()
         if not table_exists(lot_table): 
             return jsonify({"error": f"Tabela de lote '{lot_table}' não encontrada"}), 500
-        
-        params = {'fase': fase}
-        lote_filter_clause = ""
-        if lotes_param:
-            lotes_list = [lote.strip() for lote in lotes_param.split(',') if lote.strip()]
-            if lotes_list:
-                lote_filter_clause = "AND l.lotdes = ANY(%(lotes)s)"
-                params['lotes'] = lotes_list
+
+        (limite, cursor), error = parse_page(request.args.get('limite'), request.args.get('cursor'))
+        if error:
+            return jsonify({"error": error}), 400
 
         # Selecionar o módulo correto baseado na fase
-        monitor_modules = {
-            5: corte,
-            10: prensa,
-            15: usinagem,
-            25: macico,
-            30: chapa,
-            35: pintura,
-            40: garland,
-            136: tapecaria,
-            998: saida_montagem,
-            999: saida_pintura
-        }
-        
-        monitor_module = monitor_modules.get(fase)
+        monitor_module = MONITOR_MODULES.get(fase)
         if not monitor_module:
             return jsonify({"error": f"Monitor não encontrado para fase {fase}"}), 400
 
         ord_col, qtd_col = _pasfase_columns()
-        query = monitor_module.get_completed_query(fq, lot_table, ord_col, qtd_col, lote_filter_clause)
-        
-        df, error = fetch_data_from_db(query, params=params)
+        lotes = parse_lotes(request.args.get('lotes'))
+        next_cursor = None
+        if limite is None and lotes:
+            # Montado das peças por lote em cache; só os lotes ausentes ou com produção nova vão ao banco
+            df, error = cached_completed(monitor_module, fase, lot_table, ord_col, qtd_col, lotes)
+        else:
+            query, params = completed_query(monitor_module, fase, lot_table, ord_col, qtd_col, lotes)
+            if limite is not None:
+                (df, next_cursor), error = fetch_page(query, params, limite, cursor)
+            else:
+                df, error = fetch_data_from_db(query, params=params)
         if error: 
             return jsonify({"error": str(error)}), 500
         
         if not df.empty: 
             df['data_conclusao'] = pd.to_datetime(df['data_conclusao'], errors='coerce').dt.strftime('%Y-%m-%d')
         
-        return jsonify(df.fillna('').to_dict('records'))
+        response = make_response(records_response(df, request.args.get('format', default='rows')))
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
+
+    @app.route('/api/completed_cache', methods=['GET'])
+    def get_completed_cache_stats():
+        """Acertos, faltas e memória do cache de concluídos por (fase, lote)."""
+        return jsonify(completed_cache.stats())
 
     @app.route('/api/devolucoes', methods=['GET'])
     def get_devolucoes_data():
         fase = request.args.get('fase', type=int)
+        fmt = request.args.get('format', default='rows')
 
-        if fase not in [999, 25, 30]:
-            return jsonify([])
-
-        lot_table = get_lot_table()
-        required_tables = [lot_table, 'toqmovi', 'grmotper', 'produto', 'ordem', 'processo']
-        if not all(table_exists(tbl) for tbl in required_tables):
-            missing = [tbl for tbl in required_tables if not table_exists(tbl)]
-            return jsonify({"error": f"Tabelas necessárias não encontradas: {', '.join(missing)}"}), 500
-
-        op_filter = "(l.lotdes ILIKE '%%Petra%%' OR l.lotdes ILIKE '%%Solare%%' OR l.lotdes ILIKE '%%Garland%%')"
-
-        phase_filter_clause = ""
-        if fase == 25:
-            phase_filter_clause = f"AND EXISTS (SELECT 1 FROM {fq('processo')} pr WHERE pr.produto = s.priproduto AND pr.fase = 25)"
-        elif fase == 30:
-            phase_filter_clause = f"AND EXISTS (SELECT 1 FROM {fq('processo')} pr WHERE pr.produto = s.priproduto AND pr.fase = 30)"
-
-        query = f"""
-            WITH
-            movimentos AS (
-                SELECT
-                    m.priordem,
-                    m.priproduto,
-                    m.priquanti,
-                    m.pritransac,
-                    m.pridata,
-                    CAST(SUBSTRING(m.priobserv FROM '\\*d:([0-9]+)') AS INTEGER) as motivo_codigo
-                FROM {fq('toqmovi')} m
-                WHERE m.priobserv ILIKE '%%*d:%%'
-                  AND m.pridata >= '2025-01-01'
-                  AND m.pritransac IN ('4', '14')
-            ),
-            saldos_por_motivo AS (
-                SELECT
-                    priordem,
-                    priproduto,
-                    motivo_codigo,
-                    SUM(CASE WHEN pritransac = '4' THEN priquanti ELSE 0 END) as total_devolvido,
-                    SUM(CASE WHEN pritransac = '14' THEN priquanti ELSE 0 END) as total_debitado,
-                    MAX(CASE WHEN pritransac = '4' THEN pridata ELSE NULL END) as ultima_data_devolucao
-                FROM movimentos
-                GROUP BY priordem, priproduto, motivo_codigo
-            )
-            SELECT
-                l.lotdes as lote_descricao,
-                s.priordem as ordem,
-                p.pronome as descricao,
-                s.ultima_data_devolucao as data,
-                GREATEST(s.total_devolvido - s.total_debitado, 0) as quantidade,
-                gmp.gmpdescri as motivo
-            FROM saldos_por_motivo s
-            JOIN {fq('produto')} p ON TRIM(p.produto) = TRIM(s.priproduto)
-            JOIN {fq('ordem')} o ON TRIM(CAST(o.ordem AS TEXT)) = TRIM(CAST(s.priordem AS TEXT))
-            JOIN {fq(lot_table)} l ON o.lotcod = l.lotcod
-            LEFT JOIN {fq('grmotper')} gmp ON gmp.gmpcodigo = s.motivo_codigo
-            WHERE GREATEST(s.total_devolvido - s.total_debitado, 0) > 0 AND {op_filter}
-            {phase_filter_clause}
-            ORDER BY s.ultima_data_devolucao DESC;
-        """
-
-        df, error = fetch_data_from_db(query)
+        # Snapshot compartilhado entre as telas e o canal devolucoes:<fase> do /api/stream/multi (vazio fora de 25/30/999)
+        snapshot, error = get_devolucoes_snapshot(fase, get_lot_table())
         if error:
-            return jsonify({"error": str(error)}), 500
+            return jsonify({"error": error}), 500
 
-        if not df.empty:
-            df['data'] = pd.to_datetime(df['data'], errors='coerce').dt.strftime('%d/%m/%Y')
-        
-        return jsonify(df.fillna('').to_dict('records'))
+        return snapshot_records_response(snapshot, fmt)
 
     @app.route('/api/export', methods=['GET'])
     def export_data():
@@ -365,58 +321,65 @@ def register_routes(app):
         
         ord_col, qtd_col = _pasfase_columns()
 
-        # Selecionar o módulo correto baseado na fase
-        monitor_modules = {
-            5: corte,
-            10: prensa,
-            15: usinagem,
-            25: macico,
-            30: chapa,
-            35: pintura,
-            40: garland,
-            136: tapecaria,
-            998: saida_montagem,
-            999: saida_pintura
-        }
-        
-        monitor_module = monitor_modules.get(fase)
-        if not monitor_module:
+        if fase not in MONITOR_MODULES:
             return f"Monitor não encontrado para fase {fase}", 400
 
-        query = monitor_module.get_query(fq, lot_table, ord_col, qtd_col)
-        df, error = fetch_data_from_db(query, params={'fase': fase})
+        # Snapshot compartilhado com as TVs: sem nova consulta quando ele está válido
+        payload, error = get_production_snapshot(fase, lot_table, ord_col, qtd_col)
         if error: 
             return error, 500
-        
-        df_processed = monitor_module.process_data(df.copy(), fase)
-        
-        status_map = {'delayed': 'atrasado', 'ontime': 'em_dia'}
-        target_status = status_map.get(status_param)
-        
-        #Para pintura, ontime inclui futuro
-        if fase == 35 and status_param == 'ontime':
-            final_df = df_processed[df_processed['status'].isin(['em_dia', 'futuro'])]
-        else:
-            final_df = df_processed[df_processed['status'] == target_status]
-
-        export_columns = {
-            'lote_descricao': 'Lote', 'ordem': 'Ordem', 'produto': 'Produto',
-            'descricao': 'Descrição', 'saldo_pendente': 'Saldo', 
-            'data_inicio_prevista': 'Início Previsto', 'data_fim_prevista': 'Fim Previsto'
-        }
-        cols_to_export = [col for col in export_columns.keys() if col in final_df.columns]
-        final_df_export = final_df[cols_to_export].rename(columns=export_columns)
-
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            final_df_export.to_excel(writer, index=False, sheet_name='Relatorio')
-        output.seek(0)
-        
-        phase_map = {
-            5: 'Corte', 10: 'Prensa', 15: 'Usinagem', 25: 'Maciço', 30: 'Chapa', 35: 'Pintura', 40: 'Garland', 136: 'Tapecaria',
-            998: 'Saida_Montagem', 999: 'Saida_Pintura'
-        }
-        phase_name = phase_map.get(fase, 'Desconhecido')
-        
-        return send_file(output, as_attachment=True, download_name=f'relatorio_{phase_name.lower()}_{status_param}.xlsx', mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
+        # format=xlsx (padrão) | csv | parquet
+        return export_response(payload, fase, status_param, request.args.get('format', default='xlsx'))
+
+    # --- Exportações em segundo plano (extrações grandes de concluídos) ---
+    @app.route('/api/export_jobs', methods=['POST'])
+    def submit_export_job():
+        """Agenda a extração de concluídos: fase, lotes, desde/ate (aaaa-mm-dd) e format (csv | xlsx | parquet).
+
+        Responde 202 com o id do job, ou 200 se o mesmo resultado já está em disco.
+        """
+        fase = request.values.get('fase', type=int)
+        fmt = request.values.get('format', default='csv')
+        monitor_module = MONITOR_MODULES.get(fase)
+        if not monitor_module:
+            return jsonify({"error": f"Monitor não encontrado para fase {fase}"}), 400
+        error = export_format_error(fmt)
+        if error:
+            return error
+        try:
+            desde = date.fromisoformat(request.values['desde']) if request.values.get('desde') else None
+            ate = date.fromisoformat(request.values['ate']) if request.values.get('ate') else None
+        except ValueError:
+            return jsonify({"error": "Datas inválidas: use desde/ate no formato aaaa-mm-dd"}), 400
+        lotes = parse_lotes(request.values.get('lotes'))
+
+        lot_table = get_lot_table()
+        if not table_exists(lot_table):
+            return jsonify({"error": f"Tabela de lote '{lot_table}' não encontrada"}), 500
+        ord_col, qtd_col = _pasfase_columns()
+
+        job, error = export_jobs.submit(monitor_module, fase, lot_table, ord_col, qtd_col, lotes, desde, ate, fmt)
+        if error:
+            return jsonify({"error": error}), 503
+        return jsonify(job), 200 if job['status'] == 'pronto' else 202
+
+    @app.route('/api/export_jobs', methods=['GET'])
+    def list_export_jobs():
+        return jsonify(export_jobs.stats())
+
+    @app.route('/api/export_jobs/<job_id>', methods=['GET'])
+    def get_export_job(job_id):
+        """Status (na_fila, executando, pronto, erro, expirado) e linhas já gravadas."""
+        job = export_jobs.status(job_id)
+        if job is None:
+            return jsonify({"error": f"Job de exportação não encontrado: {job_id}"}), 404
+        return jsonify(job)
+
+    @app.route('/api/export_jobs/<job_id>/download', methods=['GET'])
+    def download_export_job(job_id):
+        path = export_jobs.result_path(job_id)
+        if path is None:
+            return jsonify({"error": f"Exportação {job_id} não está pronta ou expirou"}), 404
+        return send_file(path, as_attachment=True, download_name=export_jobs.download_name(job_id, path))
 
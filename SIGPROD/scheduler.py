@@ -0,0 +1,202 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from werkzeug.serving import is_running_from_reloader
+from config import (
+    get_lot_table, _pasfase_columns, table_exists, REFRESH_SCHEDULER_ENABLED, REFRESH_INTERVAL_SECONDS, REFRESH_WORKERS,
+    MATERIALIZED_AGGREGATES_ENABLED, MATERIALIZED_REFRESH_SECONDS, TOQMOVI_LEDGER_ENABLED, TOQMOVI_LEDGER_REFRESH_SECONDS,
+    CHANGE_NOTIFY_ENABLED
+)
+from memory_report import memory_report
+from snapshots import MONITOR_MODULES, compute_production_payload, publish_snapshot, shared_pasfase_cache, devolucoes_balances_cache, snapshot_versions
+from change_detection import change_tracker
+from aggregates import maintain_materialized_aggregates
+from toqmovi_ledger import toqmovi_ledger
+
+
+def _empty_stats():
+    return {
+        'ultima_duracao_s': None,
+        'ultimo_sucesso': None,
+        'falhas': 0,
+        'ultimo_erro': None,
+    }
+
+
+class RefreshScheduler:
+    """Recalcula todos os monitores em uma cadência fixa e publica os snapshots prontos.
+
+    Também executa tarefas periódicas de manutenção (ex.: atualização de agregados) num executor próprio de uma
+    thread, para que um REFRESH ou uma reconstrução do ledger não ocupe os workers dos monitores.
+    """
+
+    def __init__(self, interval_seconds, workers, refresh_monitors=True):
+        self.interval_seconds = interval_seconds
+        self.workers = workers
+        self.refresh_monitors = refresh_monitors
+        self._executor = None
+        self._maintenance_executor = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            fase: {'modulo': module.__name__.split('.')[-1], **_empty_stats()}
+            for fase, module in MONITOR_MODULES.items()
+        }
+        self._tasks = {}
+        self._task_stats = {}
+
+    def add_task(self, name, interval_seconds, func):
+        """Registra uma tarefa periódica; `func()` retorna None em caso de sucesso ou a mensagem de erro."""
+        with self._stats_lock:
+            self._tasks[name] = {'interval': interval_seconds, 'func': func, 'next_run': 0.0, 'future': None}
+            self._task_stats[name] = _empty_stats()
+
+    def start(self):
+        """Inicia a thread do agendador (idempotente)."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='sigprod-refresh')
+        self._maintenance_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sigprod-maintenance')
+        self._thread = threading.Thread(target=self._run, name='sigprod-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        if self._executor:
+            self._executor.shutdown(wait=True)
+        if self._maintenance_executor:
+            self._maintenance_executor.shutdown(wait=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            self._run_due_tasks()
+            if self.refresh_monitors:
+                try:
+                    self.run_cycle()
+                except Exception as e:
+                    print(f"Falha no ciclo de atualização dos monitores: {e}")
+            elapsed = time.monotonic() - started
+            self._stop.wait(max(self.interval_seconds - elapsed, 0))
+
+    def _run_due_tasks(self):
+        """Dispara no executor de manutenção as tarefas vencidas que não estejam em execução."""
+        now = time.monotonic()
+        for name, task in list(self._tasks.items()):
+            if task['future'] is not None and not task['future'].done():
+                continue
+            if now < task['next_run']:
+                continue
+            task['next_run'] = now + task['interval']
+            task['future'] = self._maintenance_executor.submit(self._run_task, name, task['func'])
+
+    def _run_task(self, name, func):
+        started = time.monotonic()
+        try:
+            error = func()
+        except Exception as e:
+            error = f"Erro na tarefa {name}: {e}"
+        self._record(self._task_stats[name], time.monotonic() - started, error)
+        if error:
+            print(f"Falha na tarefa de manutenção {name}: {error}")
+
+    def run_cycle(self):
+        """Executa um ciclo completo: todas as fases no pool, publicando cada uma ao terminar."""
+        lot_table = get_lot_table()
+        if not table_exists(lot_table):
+            print(f"Tabela de lote '{lot_table}' não encontrada; ciclo de atualização ignorado")
+            return
+        ord_col, qtd_col = _pasfase_columns()
+        # A passada compartilhada da pasfase é refeita uma vez por ciclo e reaproveitada pelos monitores
+        shared_pasfase_cache.invalidate()
+        # Idem para o motor de devoluções (maciço, chapa e /api/devolucoes)
+        devolucoes_balances_cache.invalidate()
+        # Uma consulta de contadores por ciclo decide quais monitores precisam da query pesada
+        change_tracker.invalidate()
+        futures = [
+            self._executor.submit(self._refresh_monitor, fase, lot_table, ord_col, qtd_col)
+            for fase in MONITOR_MODULES
+        ]
+        for future in futures:
+            future.result()
+
+    def _refresh_monitor(self, fase, lot_table, ord_col, qtd_col):
+        started = time.monotonic()
+        try:
+            with memory_report.measure(f'atualizacao fase {fase}'):
+                payload, error = compute_production_payload(fase, lot_table, ord_col, qtd_col)
+                if error is None:
+                    # Serializa e comprime aqui, fora do caminho das requisições; as TVs recebem os bytes prontos.
+                    # O payload completo com chaves é o que as telas baixam ao abrir (since=0) e ao reconectar.
+                    payload.precompress('rows', payload.body)
+                    version, _ = snapshot_versions.resolve((fase, lot_table, ord_col, qtd_col), payload)
+                    payload.precompress(payload.delta_key(version, None, None), payload.delta_body(version, None, None))
+        except Exception as e:
+            payload, error = None, f"Erro ao atualizar monitor: {e}"
+        duration = time.monotonic() - started
+
+        if error is None:
+            publish_snapshot((fase, lot_table, ord_col, qtd_col), payload)
+        else:
+            print(f"Falha ao atualizar monitor da fase {fase}: {error}")
+        self._record(self._stats[fase], duration, error)
+
+    def _record(self, stats, duration, error):
+        with self._stats_lock:
+            stats['ultima_duracao_s'] = round(duration, 3)
+            if error is None:
+                stats['ultimo_sucesso'] = datetime.now().isoformat(timespec='seconds')
+                stats['ultimo_erro'] = None
+            else:
+                stats['falhas'] += 1
+                stats['ultimo_erro'] = error
+
+    def stats(self):
+        """Retorna uma cópia das métricas por monitor (duração, último sucesso e falhas)."""
+        with self._stats_lock:
+            return {fase: dict(values) for fase, values in self._stats.items()}
+
+    def task_stats(self):
+        """Retorna uma cópia das métricas das tarefas de manutenção."""
+        with self._stats_lock:
+            return {name: dict(values) for name, values in self._task_stats.items()}
+
+
+refresh_scheduler = RefreshScheduler(REFRESH_INTERVAL_SECONDS, REFRESH_WORKERS, refresh_monitors=REFRESH_SCHEDULER_ENABLED)
+
+
+_services_started = False
+_services_lock = threading.Lock()
+
+
+def start_background_services(use_reloader=False):
+    """Registra as tarefas de manutenção e inicia o agendador e o ouvinte LISTEN/NOTIFY, uma vez por processo.
+
+    Com o reloader do Werkzeug (app.run(debug=True)) o módulo do app é importado também no processo observador,
+    que não atende requisições: com use_reloader=True os serviços sobem só no processo filho.
+    """
+    global _services_started
+    if use_reloader and not is_running_from_reloader():
+        return
+    with _services_lock:
+        if _services_started:
+            return
+        _services_started = True
+
+    # Tarefas periódicas de manutenção
+    if MATERIALIZED_AGGREGATES_ENABLED:
+        refresh_scheduler.add_task('agregados_materializados', MATERIALIZED_REFRESH_SECONDS, maintain_materialized_aggregates)
+    if TOQMOVI_LEDGER_ENABLED:
+        refresh_scheduler.add_task('ledger_toqmovi', TOQMOVI_LEDGER_REFRESH_SECONDS, toqmovi_ledger.refresh)
+
+    # Modo push da detecção de mudanças (requer os gatilhos de change_detection.py)
+    if CHANGE_NOTIFY_ENABLED:
+        change_tracker.start_listener()
+
+    # Iniciar o agendador (atualização dos monitores, se habilitada, e tarefas de manutenção)
+    refresh_scheduler.start()
@@ -0,0 +1,452 @@
+import threading
+import time
+import weakref
+import pandas as pd
+from config import fq, fetch_data_from_db, table_exists, schema_catalog, SNAPSHOT_TTL_SECONDS, REFRESH_MAX_STALENESS_SECONDS, PREPARED_STATEMENTS_ENABLED, SHARED_PASFASE_ENABLED, SHARED_DEVOLUCOES_ENABLED, CHANGE_DETECTION_ENABLED, CHANGE_MAX_REUSE_SECONDS, LEAN_FRAMES_ENABLED, DELTA_HISTORY_VERSIONS, COMPLETED_COUNTS_TTL_SECONDS
+from query_registry import query_registry
+from aggregates import SHARED_PASFASE_FASES, SHARED_DEVOLUCOES_FASES, shared_pasfase_query, devolucoes_por_motivo_source, devolucoes_balance_query
+from change_detection import change_tracker, tables_in_sql
+from data_processing import summarize_grouped, lean_frame, _sort_and_format_dates
+from json_encoding import MonitorPayload, RecordsSnapshot
+from devolucoes import DevolucaoBalances
+
+# Importar todos os módulos de monitor
+from monitors import corte, prensa, usinagem, macico, chapa, saida_montagem, saida_pintura, pintura, tapecaria, garland
+
+# Mapa fase -> módulo de monitor
+MONITOR_MODULES = {
+    5: corte,
+    10: prensa,
+    15: usinagem,
+    25: macico,
+    30: chapa,
+    35: pintura,
+    40: garland,
+    136: tapecaria,
+    998: saida_montagem,
+    999: saida_pintura
+}
+
+# Monitores que agrupam OPs (Maciço, Chapa, Pintura, Garland, Tapeçaria, Saída Montagem, Saída Pintura)
+GROUPED_FASES = [25, 30, 35, 40, 998, 999, 136]
+
+# Telas com quadro de devoluções (Saída Pintura, Maciço, Chapa)
+DEVOLUCOES_FASES = [999, 25, 30]
+
+
+class _Flight:
+    """Cálculo em andamento para uma chave; os demais chamadores aguardam o resultado."""
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = (None, None)
+
+
+class SnapshotCache:
+    """Cache de snapshots com TTL onde falhas de cache concorrentes são coalescidas (single-flight)."""
+
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._inflight = {}
+
+    def get_or_compute(self, key, compute):
+        """Retorna (valor, erro) da chave, calculando-o uma única vez mesmo com chamadas simultâneas.
+
+        `compute` deve retornar uma tupla (valor, erro). Erros são repassados a todos os
+        chamadores que aguardavam, mas nunca são armazenados no cache.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                return entry[1], None
+            flight = self._inflight.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+
+        if not is_leader:
+            flight.event.wait()
+            return flight.result
+
+        try:
+            value, error = compute()
+        except Exception as e:
+            print(f"Falha ao calcular snapshot {key}: {e}")
+            value, error = None, f"Erro ao calcular snapshot: {e}"
+
+        with self._lock:
+            if error is None:
+                self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            del self._inflight[key]
+        flight.result = (value, error)
+        flight.event.set()
+        return value, error
+
+    def invalidate(self, key=None):
+        """Descarta uma chave específica ou, sem argumento, todo o cache."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+production_cache = SnapshotCache(SNAPSHOT_TTL_SECONDS)
+
+# Snapshots publicados pelo agendador: chave -> (instante da publicação, payload).
+# O dicionário nunca é alterado no lugar; cada publicação troca a referência inteira.
+_published = {}
+_publish_lock = threading.Lock()
+
+
+class SnapshotNotifier:
+    """Acorda as conexões de /api/stream das chaves assinadas a cada publicação do agendador."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._generations = {}
+
+    def generation(self, key):
+        with self._condition:
+            return self._generations.get(key, 0)
+
+    def notify(self, key):
+        with self._condition:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            self._condition.notify_all()
+
+    def wait(self, generations, timeout):
+        """Aguarda uma publicação em qualquer chave de `generations` ({chave: geração}).
+
+        Retorna as gerações atuais; iguais às recebidas se o tempo esgotou.
+        """
+        def current():
+            return {key: self._generations.get(key, 0) for key in generations}
+
+        with self._condition:
+            self._condition.wait_for(lambda: current() != generations, timeout)
+            return current()
+
+
+snapshot_notifier = SnapshotNotifier()
+
+
+def publish_snapshot(key, payload):
+    """Publica atomicamente um snapshot pronto para JSON calculado fora do caminho da requisição."""
+    global _published
+    with _publish_lock:
+        updated = dict(_published)
+        updated[key] = (time.monotonic(), payload)
+        _published = updated
+    snapshot_notifier.notify(key)
+
+
+def latest_snapshot(key, max_age=REFRESH_MAX_STALENESS_SECONDS):
+    """Retorna o último snapshot publicado para a chave, ou None se ausente ou velho demais."""
+    entry = _published.get(key)
+    if entry is None or time.monotonic() - entry[0] > max_age:
+        return None
+    return entry[1]
+
+
+class SnapshotVersions:
+    """Histórico curto das versões de cada monitor servidas a clientes com since=, para responder só o que mudou.
+
+    Cada versão guarda apenas o índice de linhas já codificadas (não os frames). Os números partem do relógio,
+    então um since anterior a um reinício do servidor nunca coincide com uma versão nova.
+    """
+
+    def __init__(self, size):
+        self.size = max(1, size)
+        self._lock = threading.Lock()
+        self._next = time.time_ns() // 1_000_000
+        self._history = {}
+
+    def resolve(self, key, payload, since=None):
+        """(versão atual do payload, índice de linhas da versão `since` ou None se desconhecida)."""
+        with self._lock:
+            history = self._history.get(key, [])
+            latest = history[-1] if history else None
+            if latest is None or latest['payload']() is not payload:
+                latest = None
+        if latest is None:
+            latest = self._register(key, payload)
+        if since is None or since == latest['versao']:
+            return latest['versao'], None
+        with self._lock:
+            previous = next((entry for entry in self._history.get(key, []) if entry['versao'] == since), None)
+        return latest['versao'], previous['linhas'] if previous else None
+
+    def _register(self, key, payload):
+        etag = payload.etag('rows', payload.body)
+        with self._lock:
+            history = self._history.setdefault(key, [])
+            if history and history[-1]['etag'] == etag:
+                # Mesmo conteúdo recalculado (ex.: novo ciclo sem mudanças): mantém o número da versão
+                history[-1]['payload'] = weakref.ref(payload)
+                return history[-1]
+        index = payload.row_index()
+        with self._lock:
+            history = self._history.setdefault(key, [])
+            if history and history[-1]['etag'] == etag:
+                return history[-1]
+            entry = {'versao': self._next, 'payload': weakref.ref(payload), 'etag': etag, 'linhas': index}
+            self._next += 1
+            history.append(entry)
+            del history[:-self.size]
+            return entry
+
+
+snapshot_versions = SnapshotVersions(DELTA_HISTORY_VERSIONS)
+
+# Resultado da passada compartilhada da pasfase; o agendador o invalida no início de cada ciclo
+shared_pasfase_cache = SnapshotCache(SNAPSHOT_TTL_SECONDS)
+# Resultado do motor de devoluções (DevolucaoBalances); também invalidado pelo agendador a cada ciclo
+devolucoes_balances_cache = SnapshotCache(SNAPSHOT_TTL_SECONDS)
+
+
+def get_devolucoes_balances(lot_table):
+    """Retorna (DevolucaoBalances, erro): uma leitura da toqmovi compartilhada por maciço, chapa e /api/devolucoes."""
+    def build():
+        df, error = fetch_data_from_db(devolucoes_balance_query(fq, lot_table))
+        if error:
+            return None, error
+        return DevolucaoBalances(df), None
+    return devolucoes_balances_cache.get_or_compute(lot_table, build)
+
+
+def monitor_params(fase, lot_table, ord_col, qtd_col):
+    """Parâmetros da query do monitor: a fase e, quando aplicável, a fatia da passada compartilhada da pasfase
+    e os saldos do motor de devoluções.
+
+    Retorna (params, erro).
+    """
+    params = {'fase': fase}
+    if SHARED_DEVOLUCOES_ENABLED and fase in SHARED_DEVOLUCOES_FASES:
+        balances, error = get_devolucoes_balances(lot_table)
+        if error:
+            return None, error
+        params.update(balances.saldo_params())
+    fases = SHARED_PASFASE_FASES.get(fase)
+    if not SHARED_PASFASE_ENABLED or fases is None:
+        return params, None
+
+    df, error = shared_pasfase_cache.get_or_compute(
+        (lot_table, ord_col, qtd_col),
+        lambda: fetch_data_from_db(shared_pasfase_query(fq, lot_table, ord_col, qtd_col))
+    )
+    if error:
+        return None, error
+    part = df[df['fase'].isin(fases)]
+    params['pf_ordens'] = part['ordem'].tolist()
+    params['pf_fases'] = part['fase'].astype(int).tolist()
+    params['pf_qtds'] = part['qtd'].tolist()
+    return params, None
+
+
+def fetch_monitor_frame(fase, lot_table, ord_col, qtd_col):
+    """Busca os dados brutos do monitor da fase, via prepared statement quando habilitado."""
+    monitor_module = MONITOR_MODULES[fase]
+    params, error = monitor_params(fase, lot_table, ord_col, qtd_col)
+    if error:
+        return None, error
+    if PREPARED_STATEMENTS_ENABLED:
+        monitor_name = monitor_module.__name__.split('.')[-1]
+        df, error = query_registry.execute(monitor_name, monitor_module, lot_table, ord_col, qtd_col, params)
+    else:
+        query = monitor_module.get_query(fq, lot_table, ord_col, qtd_col)
+        df, error = fetch_data_from_db(query, params=params)
+    if LEAN_FRAMES_ENABLED and error is None:
+        lean_frame(df)
+    return df, error
+
+
+def build_production_payload(fase, lot_table, ord_col, qtd_col):
+    """Executa a query do monitor, processa e monta o payload de /api/data (MonitorPayload)."""
+    monitor_module = MONITOR_MODULES[fase]
+    df, error = fetch_monitor_frame(fase, lot_table, ord_col, qtd_col)
+    if error:
+        return None, error
+
+    if df is None or df.empty:
+        return MonitorPayload(False, {'data': pd.DataFrame()}), None
+
+    # O frame bruto não é reutilizado: o processamento e o resumo trabalham sobre ele sem cópias
+    df_processed = monitor_module.process_data(df, fase)
+    if LEAN_FRAMES_ENABLED and not df_processed.empty:
+        # O status é calculado no processamento; os frames ficam guardados no snapshot até o próximo ciclo
+        lean_frame(df_processed, ['status'])
+
+    if fase in GROUPED_FASES and not df_processed.empty:
+        df_summary, df_details = summarize_grouped(df_processed)
+        return MonitorPayload(True, {'summary': df_summary, 'details': df_details}), None
+
+    # Para os outros monitores, a estrutura de dados continua a mesma
+    if not df_processed.empty:
+        _sort_and_format_dates(df_processed)
+
+    return MonitorPayload(False, {'data': df_processed}), None
+
+
+# Tabelas lidas por monitor, por versão do catálogo (o SQL muda com views/ledger presentes)
+_monitor_tables = {}
+# Último payload calculado por chave: chave -> (impressão digital, payload, instante do cálculo)
+_fingerprinted = {}
+_fingerprint_lock = threading.Lock()
+_change_stats = {}
+
+
+def monitor_tables(fase, lot_table, ord_col, qtd_col):
+    """Tabelas cuja alteração pode mudar o resultado do monitor da fase."""
+    key = (fase, lot_table, ord_col, qtd_col, schema_catalog.version)
+    tables = _monitor_tables.get(key)
+    if tables is None:
+        sql = MONITOR_MODULES[fase].get_query(fq, lot_table, ord_col, qtd_col)
+        if SHARED_PASFASE_ENABLED and fase in SHARED_PASFASE_FASES:
+            sql += shared_pasfase_query(fq, lot_table, ord_col, qtd_col)
+        if SHARED_DEVOLUCOES_ENABLED and fase in SHARED_DEVOLUCOES_FASES:
+            sql += devolucoes_balance_query(fq, lot_table)
+        tables = tables_in_sql(sql)
+        _monitor_tables[key] = tables
+    return tables
+
+
+def compute_production_payload(fase, lot_table, ord_col, qtd_col):
+    """Como build_production_payload, mas reaproveita o último resultado se nenhuma tabela lida mudou."""
+    if not CHANGE_DETECTION_ENABLED:
+        return build_production_payload(fase, lot_table, ord_col, qtd_col)
+
+    key = (fase, lot_table, ord_col, qtd_col)
+    fingerprint = change_tracker.fingerprint(monitor_tables(fase, lot_table, ord_col, qtd_col))
+    with _fingerprint_lock:
+        stats = _change_stats.setdefault(fase, {'reaproveitados': 0, 'recalculados': 0})
+        previous = _fingerprinted.get(key)
+        if (fingerprint is not None and previous is not None and previous[0] == fingerprint
+                and time.monotonic() - previous[2] < CHANGE_MAX_REUSE_SECONDS):
+            stats['reaproveitados'] += 1
+            return previous[1], None
+
+    payload, error = build_production_payload(fase, lot_table, ord_col, qtd_col)
+    with _fingerprint_lock:
+        stats['recalculados'] += 1
+        if error is None and fingerprint is not None:
+            _fingerprinted[key] = (fingerprint, payload, time.monotonic())
+    return payload, error
+
+
+def change_stats():
+    """Quantas atualizações por fase reaproveitaram o resultado anterior versus recalcularam."""
+    with _fingerprint_lock:
+        return {fase: dict(values) for fase, values in _change_stats.items()}
+
+
+def get_production_snapshot(fase, lot_table, ord_col, qtd_col):
+    """Retorna (payload, erro) da fase, compartilhando o snapshot entre todas as TVs."""
+    key = (fase, lot_table, ord_col, qtd_col)
+    payload = latest_snapshot(key)
+    if payload is not None:
+        return payload, None
+    return production_cache.get_or_compute(key, lambda: compute_production_payload(fase, lot_table, ord_col, qtd_col))
+
+
+# Devoluções e contagem de concluídos: compartilhadas entre /api/devolucoes e os canais do /api/stream/multi
+devolucoes_cache = SnapshotCache(SNAPSHOT_TTL_SECONDS)
+completed_counts_cache = SnapshotCache(COMPLETED_COUNTS_TTL_SECONDS)
+
+
+def devolucoes_query(fase, lot_table):
+    """Saldo de devoluções por OP/motivo dos lotes Petra/Solare/Garland; nas fases 25 e 30 só produtos com essa fase."""
+    op_filter = "(l.lotdes ILIKE '%%Petra%%' OR l.lotdes ILIKE '%%Solare%%' OR l.lotdes ILIKE '%%Garland%%')"
+
+    phase_filter_clause = ""
+    if fase == 25:
+        phase_filter_clause = f"AND EXISTS (SELECT 1 FROM {fq('processo')} pr WHERE pr.produto = s.priproduto AND pr.fase = 25)"
+    elif fase == 30:
+        phase_filter_clause = f"AND EXISTS (SELECT 1 FROM {fq('processo')} pr WHERE pr.produto = s.priproduto AND pr.fase = 30)"
+
+    return f"""
+        WITH
+        saldos_por_motivo AS ({devolucoes_por_motivo_source(fq)})
+        SELECT
+            l.lotdes as lote_descricao,
+            s.priordem as ordem,
+            p.pronome as descricao,
+            s.ultima_data_devolucao as data,
+            GREATEST(s.total_devolvido - s.total_debitado, 0) as quantidade,
+            gmp.gmpdescri as motivo
+        FROM saldos_por_motivo s
+        JOIN {fq('produto')} p ON TRIM(p.produto) = TRIM(s.priproduto)
+        JOIN {fq('ordem')} o ON TRIM(CAST(o.ordem AS TEXT)) = TRIM(CAST(s.priordem AS TEXT))
+        JOIN {fq(lot_table)} l ON o.lotcod = l.lotcod
+        LEFT JOIN {fq('grmotper')} gmp ON gmp.gmpcodigo = s.motivo_codigo
+        WHERE GREATEST(s.total_devolvido - s.total_debitado, 0) > 0 AND {op_filter}
+        {phase_filter_clause}
+        ORDER BY s.ultima_data_devolucao DESC;
+    """
+
+
+def build_devolucoes_snapshot(fase, lot_table):
+    """Executa a consulta de devoluções da fase e formata as datas; retorna (RecordsSnapshot, erro)."""
+    required_tables = [lot_table, 'toqmovi', 'grmotper', 'produto', 'ordem', 'processo']
+    missing = [tbl for tbl in required_tables if not table_exists(tbl)]
+    if missing:
+        return None, f"Tabelas necessárias não encontradas: {', '.join(missing)}"
+
+    df, error = fetch_data_from_db(devolucoes_query(fase, lot_table))
+    if error:
+        return None, str(error)
+
+    if not df.empty:
+        df['data'] = pd.to_datetime(df['data'], errors='coerce').dt.strftime('%d/%m/%Y')
+    return RecordsSnapshot(df), None
+
+
+def get_devolucoes_snapshot(fase, lot_table):
+    """Retorna (RecordsSnapshot, erro) das devoluções da fase; fases sem quadro de devoluções têm lista vazia."""
+    if fase not in DEVOLUCOES_FASES:
+        return RecordsSnapshot(pd.DataFrame()), None
+    if SHARED_DEVOLUCOES_ENABLED:
+        missing = [tbl for tbl in [lot_table, 'toqmovi', 'grmotper', 'produto', 'ordem', 'processo'] if not table_exists(tbl)]
+        if missing:
+            return None, f"Tabelas necessárias não encontradas: {', '.join(missing)}"
+        balances, error = get_devolucoes_balances(lot_table)
+        if error:
+            return None, str(error)
+        return balances.snapshot(fase), None
+    return devolucoes_cache.get_or_compute((fase, lot_table), lambda: build_devolucoes_snapshot(fase, lot_table))
+
+
+# Query devolvida pelo get_completed_query dos monitores quando faltam tabelas
+EMPTY_COMPLETED_QUERY = "SELECT 1 WHERE 1=0"
+COMPLETED_COUNTS_COLUMNS = ['lote_descricao', 'ordens', 'qtd_produzida']
+
+
+def build_completed_counts_snapshot(fase, lot_table, ord_col, qtd_col):
+    """OPs concluídas e quantidade produzida por lote, agregadas no banco sobre a query de concluídos da fase.
+
+    As saídas (998/999) têm uma linha por (ordem, produto), por isso as ordens são contadas sem repetição.
+    """
+    completed = MONITOR_MODULES[fase].get_completed_query(fq, lot_table, ord_col, qtd_col, "")
+    if completed.strip() == EMPTY_COMPLETED_QUERY:
+        # Monitor sem as tabelas necessárias: contagem vazia em vez de erro
+        return RecordsSnapshot(pd.DataFrame(columns=COMPLETED_COUNTS_COLUMNS)), None
+    query = f"""
+        SELECT c.lote_descricao, COUNT(DISTINCT c.ordem) AS ordens, SUM(c.qtd_produzida) AS qtd_produzida
+        FROM ({completed}) c
+        GROUP BY c.lote_descricao
+        ORDER BY c.lote_descricao
+    """
+    df, error = fetch_data_from_db(query, params={'fase': fase})
+    if error:
+        return None, str(error)
+    return RecordsSnapshot(df), None
+
+
+def get_completed_counts_snapshot(fase, lot_table, ord_col, qtd_col):
+    """Retorna (RecordsSnapshot, erro) da contagem de concluídos por lote, compartilhada entre as telas."""
+    key = (fase, lot_table, ord_col, qtd_col)
+    return completed_counts_cache.get_or_compute(
+        key, lambda: build_completed_counts_snapshot(fase, lot_table, ord_col, qtd_col)
+    )
@@ -0,0 +1,128 @@
+// Estado local dos monitores alimentado pelo /api/stream (SSE), pelo /api/stream/multi ou pelo /api/data com since=<versão>.
+// A primeira resposta traz o payload completo com as chaves das linhas; as seguintes trazem só
+// as linhas removidas/incluídas/alteradas, aplicadas sobre o estado guardado.
+(function (global) {
+    const createState = (response) => {
+        const state = { version: response.version, isGrouped: response.is_grouped, parts: {} };
+        Object.keys(response.keys).forEach(name => {
+            const rows = new Map();
+            response.keys[name].forEach((key, i) => rows.set(key, response[name][i]));
+            state.parts[name] = { order: response.keys[name], rows };
+        });
+        return state;
+    };
+
+    const patchState = (state, response) => {
+        if (!state || response.since !== state.version) {
+            throw new Error('Delta fora de sequência');
+        }
+        // Partes ausentes da resposta deixaram de existir (ex.: monitor agrupado que ficou vazio)
+        const parts = {};
+        Object.keys(response.parts).forEach(name => {
+            const part = state.parts[name] || { order: [], rows: new Map() };
+            const delta = response.parts[name];
+            delta.remove.forEach(key => part.rows.delete(key));
+            const added = [];
+            delta.upsert.forEach(([key, row]) => {
+                if (!part.rows.has(key)) added.push(key);
+                part.rows.set(key, row);
+            });
+            part.order = delta.order || part.order.filter(key => part.rows.has(key)).concat(added);
+            parts[name] = part;
+        });
+        state.parts = parts;
+        state.version = response.version;
+        state.isGrouped = response.is_grouped;
+        return state;
+    };
+
+    // Aplica a resposta ao estado e devolve { state, data } com `data` no mesmo formato do /api/data sem since
+    global.applyMonitorDelta = (state, response) => {
+        const next = response.delta ? patchState(state, response) : createState(response);
+        const data = { is_grouped: next.isGrouped };
+        Object.keys(next.parts).forEach(name => {
+            const part = next.parts[name];
+            data[name] = part.order.map(key => part.rows.get(key));
+        });
+        return { state: next, data };
+    };
+
+    // Conexão SSE com /api/stream: `onData` recebe cada snapshot/delta e `onHeartbeat` os sinais de vida.
+    // O navegador reconecta sozinho (com Last-Event-ID); se o stream não existir ou falhar, chama `onFallback` uma vez.
+    global.openMonitorStream = (url, onData, onHeartbeat, onFallback) => {
+        let fellBack = false;
+        const fallback = (source) => {
+            if (fellBack) return;
+            fellBack = true;
+            if (source) source.close();
+            onFallback();
+        };
+        if (!global.EventSource) {
+            fallback(null);
+            return null;
+        }
+        const source = new EventSource(url);
+        source.addEventListener('snapshot', (event) => {
+            try {
+                onData(JSON.parse(event.data));
+            } catch (error) {
+                console.error('Erro ao aplicar snapshot do stream:', error);
+                fallback(source);
+            }
+        });
+        source.addEventListener('heartbeat', () => onHeartbeat());
+        source.addEventListener('erro', (event) => console.error('Erro no stream:', event.data));
+        source.onerror = () => {
+            if (source.readyState === EventSource.CLOSED) fallback(source);
+        };
+        return source;
+    };
+
+    // Vários canais (`data:5`, `devolucoes:25`, `completed:30`) numa só conexão com /api/stream/multi;
+    // sem SSE, o mesmo conjunto é consultado em /api/batch a cada `pollMs`. `onChannel(canal, dados)` recebe os
+    // dados já no formato das rotas individuais (deltas dos canais data aplicados aqui). Retorna uma função que encerra.
+    global.openChannels = (apiBase, channels, onChannel, onHeartbeat, pollMs) => {
+        const query = `canais=${encodeURIComponent(channels.join(','))}`;
+        const states = {};
+        let cursor = '';
+        let timer = null;
+        const deliver = (name, payload) => {
+            if (name.startsWith('data:')) {
+                const result = global.applyMonitorDelta(states[name], payload);
+                states[name] = result.state;
+                onChannel(name, result.data);
+            } else {
+                onChannel(name, payload);
+            }
+        };
+        const poll = async () => {
+            try {
+                const resp = await fetch(`${apiBase}/batch?${query}&cursor=${encodeURIComponent(cursor)}`);
+                if (!resp.ok) throw new Error(`HTTP ${resp.status}`);
+                const batch = await resp.json();
+                Object.keys(batch.canais).forEach(name => deliver(name, batch.canais[name]));
+                Object.keys(batch.erros).forEach(name => console.error(`Erro no canal ${name}:`, batch.erros[name]));
+                cursor = batch.cursor;
+                onHeartbeat();
+            } catch (error) {
+                // Delta fora de sequência ou falha de rede: recomeça do zero na próxima consulta
+                console.error('Erro ao consultar canais:', error);
+                cursor = '';
+            }
+        };
+        const startPolling = () => {
+            poll();
+            timer = setInterval(poll, pollMs);
+        };
+        const source = global.openMonitorStream(
+            `${apiBase}/stream/multi?${query}`,
+            (message) => deliver(message.canal, message.dados),
+            onHeartbeat,
+            startPolling
+        );
+        return () => {
+            if (source) source.close();
+            if (timer) clearInterval(timer);
+        };
+    };
+})(window);
@@ -0,0 +1,5 @@
+"""Testes das partes em Python puro do SIGPROD (sem banco): os módulos ficam na raiz do SIGPROD."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
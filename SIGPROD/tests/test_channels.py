@@ -0,0 +1,67 @@
+import json
+import pytest
+import channels
+
+
+def test_parse_cursor_ignora_itens_vazios_e_sem_versao():
+    assert channels.parse_cursor('data:5=1712, devolucoes:25=ab12,,completed:30=,=9') == {
+        'data:5': '1712', 'devolucoes:25': 'ab12'
+    }
+    assert channels.parse_cursor(None) == {}
+    assert channels.parse_cursor('') == {}
+
+
+def test_cursor_formatado_volta_igual():
+    cursor = {'data:5': '1712', 'completed:30': 'ff00'}
+    assert channels.parse_cursor(channels.format_cursor(cursor)) == cursor
+
+
+def test_parse_channels_remove_repetidos_e_valida_fase():
+    parsed, error = channels.parse_channels('data:5, devolucoes:25,data:5')
+    assert error is None
+    assert parsed == [('data:5', 'data', 5), ('devolucoes:25', 'devolucoes', 25)]
+    assert channels.parse_channels('devolucoes:5')[1] == "Fase 5 sem canal devolucoes"
+    assert channels.parse_channels('x:5')[0] is None
+    assert channels.parse_channels('')[0] is None
+
+
+@pytest.fixture
+def canais(monkeypatch):
+    """channel_update falso: versão atual e corpo de cada canal, ou erro."""
+    estado = {
+        'data:5': ('8', b'{"delta":false,"version":8}\n', None),
+        'devolucoes:25': ('ab12', b'[{"ordem":1}]\n', None),
+        'completed:30': (None, None, 'sem conexão'),
+    }
+
+    def update(channel, since, lot_table, ord_col, qtd_col):
+        version, body, error = estado[channel[0]]
+        if version is not None and version == since:
+            return version, None, None
+        return version, body, error
+
+    monkeypatch.setattr(channels, 'channel_update', update)
+    return estado
+
+
+def _canais(param):
+    parsed, error = channels.parse_channels(param)
+    assert error is None
+    return parsed
+
+
+def test_batch_body_envia_so_os_canais_alterados(canais):
+    body = channels.batch_body(_canais('data:5,devolucoes:25'), {'devolucoes:25': 'ab12'}, 'lotprod', 'ordem', 'qtd')
+    batch = json.loads(body)
+    assert batch['canais'] == {'data:5': {'delta': False, 'version': 8}}
+    assert channels.parse_cursor(batch['cursor']) == {'data:5': '8', 'devolucoes:25': 'ab12'}
+    assert batch['erros'] == {}
+
+
+def test_batch_body_erro_mantem_o_cursor_do_canal(canais):
+    cursor = {'completed:30': 'velho', 'data:99': 'fora'}
+    batch = json.loads(channels.batch_body(_canais('data:5,completed:30'), cursor, 'lotprod', 'ordem', 'qtd'))
+    assert list(batch['canais']) == ['data:5']
+    assert batch['erros'] == {'completed:30': 'sem conexão'}
+    # Canais fora da inscrição saem do cursor; o canal com erro continua na versão do cliente
+    assert channels.parse_cursor(batch['cursor']) == {'data:5': '8', 'completed:30': 'velho'}
@@ -0,0 +1,138 @@
+from datetime import date
+import pandas as pd
+import pytest
+import completed
+
+
+class _Monitor:
+    @staticmethod
+    def get_completed_query(fq, lot_table, ord_col, qtd_col, lote_filter_clause=""):
+        return "SELECT * FROM pasfase"
+
+
+@pytest.fixture
+def banco(monkeypatch):
+    """Banco falso: concluídos por lote e a marca de produção (linhas, xmin) de cada lote."""
+    estado = {
+        'concluidos': pd.DataFrame({
+            'ordem': [1, 2, 3, 4],
+            'descricao': ['P1', 'P2', 'P3', 'P4'],
+            'lote_descricao': ['A', 'A', 'B', 'B'],
+            'data_conclusao': [date(2025, 5, 3), date(2025, 5, 1), date(2025, 5, 2), date(2025, 4, 30)],
+        }),
+        'marcas': {'A': (10, 100), 'B': (20, 200)},
+        'consultas': [],
+    }
+
+    def fetch(query, params=None):
+        if 'ordens_lote' in query:
+            rows = [(lote, 'pasfase', *estado['marcas'][lote]) for lote in params['lotes'] if lote in estado['marcas']]
+            return pd.DataFrame(rows, columns=['lote_descricao', 'tabela', 'linhas', 'marca']), None
+        estado['consultas'].append(list(params['lotes']))
+        df = estado['concluidos']
+        df = df[df['lote_descricao'].isin(params['lotes'])]
+        return df.sort_values(['data_conclusao', 'ordem'], ascending=[False, True]).reset_index(drop=True), None
+
+    monkeypatch.setattr(completed, 'fetch_data_from_db', fetch)
+    monkeypatch.setattr(completed, 'tables_in_sql', lambda sql: ['ordem', 'pasfase'])
+    monkeypatch.setattr(completed, 'COMPLETED_CACHE_ENABLED', True)
+    completed.completed_cache.clear()
+    yield estado
+    completed.completed_cache.clear()
+
+
+def _pedir(lotes):
+    df, error = completed.cached_completed(_Monitor, 10, 'lotprod', 'ordem', 'qtd', lotes)
+    assert error is None
+    return df
+
+
+def test_lotes_em_cache_nao_vao_ao_banco(banco):
+    _pedir(['A', 'B'])
+    df = _pedir(['B', 'A'])
+    assert banco['consultas'] == [['A', 'B']]
+    assert df['ordem'].tolist() == [1, 3, 2, 4]
+
+
+def test_apontamento_no_lote_a_mantem_a_peca_do_lote_b(banco):
+    _pedir(['A', 'B'])
+    banco['marcas']['A'] = (11, 150)
+    banco['concluidos'].loc[1, 'data_conclusao'] = date(2025, 5, 5)
+    df = _pedir(['A', 'B'])
+    assert banco['consultas'] == [['A', 'B'], ['A']]
+    assert df['ordem'].tolist() == [2, 1, 3, 4]
+
+
+def test_lote_sem_linhas_no_monitor_tambem_e_invalidado(banco):
+    # Lotes fora do monitor (ex.: só concluídos) também têm marca: uma devolução muda as linhas do lote
+    banco['marcas']['C'] = (5, 50)
+    _pedir(['C'])
+    banco['marcas']['C'] = (6, 60)
+    _pedir(['C'])
+    assert banco['consultas'] == [['C'], ['C']]
+
+
+def test_sem_catalogo_consulta_direto(banco, monkeypatch):
+    monkeypatch.setattr(completed, 'tables_in_sql', lambda sql: [])
+    _pedir(['A'])
+    _pedir(['A'])
+    assert banco['consultas'] == [['A'], ['A']]
+    assert completed.completed_cache.stats()['pecas'] == 0
+
+
+def test_parse_page_valida_limite_e_cursor(monkeypatch):
+    monkeypatch.setattr(completed, 'COMPLETED_PAGE_MAX_ORDERS', 50)
+    assert completed.parse_page(None, None) == ((None, None), None)
+    assert completed.parse_page('10', None) == ((10, None), None)
+    assert completed.parse_page('10', '2025-03-14|123456') == ((10, ('2025-03-14', '123456')), None)
+    assert completed.parse_page(None, '2025-03-14|1')[1] == "Parâmetro cursor exige limite"
+    assert completed.parse_page('x', None)[1] == "Limite inválido: x"
+    assert completed.parse_page('0', None)[1] == "Limite deve estar entre 1 e 50"
+    assert completed.parse_page('51', None)[1] == "Limite deve estar entre 1 e 50"
+    assert completed.parse_page('10', '14/03/2025|1')[1] == "Cursor inválido: 14/03/2025|1"
+    assert completed.parse_page('10', '2025-03-14')[1] == "Cursor inválido: 2025-03-14"
+    assert completed.parse_page('10', '2025-03-14|')[1] == "Cursor inválido: 2025-03-14|"
+
+
+def _pagina(linhas):
+    return pd.DataFrame(linhas, columns=['data_conclusao', 'ordem', 'produto'])
+
+
+def test_split_page_sem_linha_seguinte_nao_tem_cursor():
+    page, next_cursor, cut = completed.split_page(_pagina([('2025-05-03', 1, 'a'), ('2025-05-02', 2, 'a')]), 2)
+    assert len(page) == 2
+    assert next_cursor is None and cut is None
+
+
+def test_split_page_cursor_na_ultima_linha_da_pagina():
+    df = _pagina([('2025-05-03', 1, 'a'), ('2025-05-02', 2, 'a'), ('2025-05-02', 3, 'a')])
+    page, next_cursor, cut = completed.split_page(df, 2)
+    assert page['ordem'].tolist() == [1, 2]
+    assert next_cursor == '2025-05-02|2'
+    assert cut is None
+    assert completed.parse_page('2', next_cursor) == ((2, ('2025-05-02', '2')), None)
+
+
+def test_split_page_indica_a_ordem_cortada_pelo_limite():
+    df = _pagina([('2025-05-03', 1, 'a'), ('2025-05-02', 2, 'a'), ('2025-05-02', 2, 'b')])
+    page, next_cursor, cut = completed.split_page(df, 2)
+    assert next_cursor == '2025-05-02|2'
+    assert cut == ('2025-05-02', 2)
+
+
+def test_fetch_page_completa_a_ordem_cortada(monkeypatch):
+    df = _pagina([('2025-05-03', 1, 'a'), ('2025-05-02', 2, 'a'), ('2025-05-02', 2, 'b'), ('2025-05-02', 2, 'c')])
+    consultas = []
+
+    def fetch(query, params=None):
+        consultas.append(params)
+        if 'ordem_pagina' in params:
+            return df[df['ordem'] == params['ordem_pagina']].reset_index(drop=True), None
+        return df.iloc[:params['limite_pagina']].reset_index(drop=True), None
+
+    monkeypatch.setattr(completed, 'fetch_data_from_db', fetch)
+    (page, next_cursor), error = completed.fetch_page("SELECT * FROM concluidos", {'fase': 10}, 2)
+    assert error is None
+    assert page['produto'].tolist() == ['a', 'a', 'b', 'c']
+    assert next_cursor == '2025-05-02|2'
+    assert len(consultas) == 2
@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+import pandas as pd
+import pytest
+import data_processing
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    """Relógio monotônico controlado pelo teste."""
+    agora = {'t': 1000.0}
+    monkeypatch.setattr(data_processing, 'time', SimpleNamespace(monotonic=lambda: agora['t']))
+    return agora
+
+
+def _lotes(*pares):
+    return pd.DataFrame(list(pares), columns=['lote_descricao', 'lote_trans'])
+
+
+def _chaves(index):
+    return set(index._lots)
+
+
+def test_phase_dates_processa_cada_texto_uma_vez(relogio, monkeypatch):
+    index = data_processing.LotScheduleIndex(retention_seconds=3600)
+    processados = []
+    parse = index._parse_texts
+    monkeypatch.setattr(index, '_parse_texts', lambda texts: processados.append(list(texts)) or parse(texts))
+
+    df = _lotes(('L1', 'CORTE: 01/02/25 - 05/02/25'), ('L1', 'CORTE: 01/02/25 - 05/02/25'), ('L2', 'PRENSA: 03/02/2025 - 04/02/2025'))
+    start, end = index.phase_dates(df, 'CORTE')
+    assert start.tolist() == ['2025-02-01', '2025-02-01', None]
+    assert end.tolist() == ['2025-02-05', '2025-02-05', None]
+    index.phase_dates(df, 'PRENSA')
+    assert processados == [['CORTE: 01/02/25 - 05/02/25', 'PRENSA: 03/02/2025 - 04/02/2025']]
+
+
+def test_lotes_fora_dos_monitores_expiram_apos_a_retencao(relogio):
+    index = data_processing.LotScheduleIndex(retention_seconds=600)
+    index.phase_dates(_lotes(('L1', 'CORTE: 01/02/25 - 05/02/25'), ('L2', 'CORTE: 02/02/25 - 06/02/25')), 'CORTE')
+
+    # L1 continua nos monitores; L2 some
+    relogio['t'] += 400
+    index.phase_dates(_lotes(('L1', 'CORTE: 01/02/25 - 05/02/25')), 'CORTE')
+    assert _chaves(index) == {('L1', 'CORTE: 01/02/25 - 05/02/25'), ('L2', 'CORTE: 02/02/25 - 06/02/25')}
+
+    relogio['t'] += 400
+    index.phase_dates(_lotes(('L1', 'CORTE: 01/02/25 - 05/02/25')), 'CORTE')
+    assert _chaves(index) == {('L1', 'CORTE: 01/02/25 - 05/02/25')}
+
+
+def test_texto_alterado_substitui_o_cronograma_do_lote(relogio):
+    index = data_processing.LotScheduleIndex(retention_seconds=600)
+    index.phase_dates(_lotes(('L1', 'CORTE: 01/02/25 - 05/02/25')), 'CORTE')
+    relogio['t'] += 10
+    index.phase_dates(_lotes(('L1', 'CORTE: 03/02/25 - 07/02/25')), 'CORTE')
+    assert index.timeline() == [{'lote_descricao': 'L1', 'fases': {'CORTE': {'inicio': '2025-02-03', 'fim': '2025-02-07'}}}]
+
+    # A poda só roda um minuto depois da anterior; o texto antigo sai após a retenção
+    relogio['t'] += 700
+    index.phase_dates(_lotes(('L1', 'CORTE: 03/02/25 - 07/02/25')), 'CORTE')
+    assert _chaves(index) == {('L1', 'CORTE: 03/02/25 - 07/02/25')}
+    assert index.timeline(['L2']) == []
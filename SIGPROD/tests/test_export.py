@@ -0,0 +1,28 @@
+import pandas as pd
+from export import EXPORT_COLUMNS, iter_csv
+
+
+def _csv(chunks, labels=EXPORT_COLUMNS):
+    return b''.join(iter_csv(chunks, labels))
+
+
+def test_csv_com_bom_ponto_e_virgula_e_virgula_decimal():
+    chunk = pd.DataFrame({'lote_descricao': ['L1'], 'ordem': [10], 'descricao': ['Peça; lateral'], 'saldo_pendente': [2.5]})
+    data = _csv([chunk])
+    assert data.startswith(b'\xef\xbb\xbf')
+    lines = data.decode('utf-8-sig').splitlines()
+    assert lines == ['Lote;Ordem;Descrição;Saldo', 'L1;10;"Peça; lateral";2,5']
+
+
+def test_csv_em_blocos_tem_um_bom_e_um_cabecalho():
+    chunks = [pd.DataFrame({'ordem': [1, 2], 'saldo_pendente': [0.5, 1.0]}), pd.DataFrame({'ordem': [3], 'saldo_pendente': [1.25]})]
+    data = _csv(chunks)
+    assert data.count(b'\xef\xbb\xbf') == 1
+    assert data.decode('utf-8-sig').splitlines() == ['Ordem;Saldo', '1;0,5', '2;1,0', '3;1,25']
+
+
+def test_extracao_vazia_mantem_o_cabecalho():
+    # Os jobs de exportação mandam um bloco vazio com as colunas da query quando não há linhas
+    header = pd.DataFrame(columns=['lote_descricao', 'ordem', 'data_conclusao'])
+    data = _csv([header], {'lote_descricao': 'Lote', 'ordem': 'Ordem', 'data_conclusao': 'Conclusão'})
+    assert data.decode('utf-8-sig').splitlines() == ['Lote;Ordem;Conclusão']
@@ -0,0 +1,59 @@
+from datetime import date
+import pandas as pd
+import pytest
+import export_jobs
+
+
+@pytest.fixture
+def marcas(monkeypatch):
+    """Banco falso: marca de produção (linhas, xmin) por lote; None simula a consulta com erro."""
+    estado = {'lotes': {'A': (10, 100), 'B': (20, 200)}, 'pedidos': []}
+
+    def fetch(query, params=None):
+        assert 'ordens_lote' in query
+        if estado['lotes'] is None:
+            return None, 'sem conexão'
+        estado['pedidos'].append(params.get('lotes'))
+        lotes = params.get('lotes') or list(estado['lotes'])
+        rows = [(lote, 'pasfase', *estado['lotes'][lote]) for lote in lotes]
+        return pd.DataFrame(rows, columns=['lote_descricao', 'tabela', 'linhas', 'marca']), None
+
+    monkeypatch.setattr(export_jobs, 'fetch_data_from_db', fetch)
+    return estado
+
+
+def _marca(lotes=None, ate=None):
+    return export_jobs.data_watermark(['ordem', 'pasfase'], 'lotprod', 'ordem', lotes, ate)
+
+
+def test_apontamento_fora_dos_lotes_da_extracao_mantem_a_marca(marcas):
+    antes = _marca(['A'], date(2025, 1, 31))
+    marcas['lotes']['B'] = (21, 250)
+    assert _marca(['A'], date(2025, 1, 31)) == antes
+    assert marcas['pedidos'][-1] == ['A']
+
+
+def test_apontamento_nos_lotes_da_extracao_muda_a_marca(marcas):
+    antes = _marca(['A'], date(2025, 1, 31))
+    marcas['lotes']['A'] = (10, 101)
+    assert _marca(['A'], date(2025, 1, 31)) != antes
+
+
+def test_sem_filtro_de_lote_vale_a_fase_inteira(marcas):
+    antes = _marca(ate=date(2025, 1, 31))
+    marcas['lotes']['B'] = (21, 250)
+    assert _marca(ate=date(2025, 1, 31)) != antes
+    assert marcas['pedidos'][-1] is None
+
+
+def test_data_de_hoje_so_entra_em_periodo_aberto(marcas):
+    hoje = date.today().isoformat()
+    assert not _marca(['A'], date(2025, 1, 31)).endswith(hoje)
+    assert _marca(['A']).endswith(hoje)
+    assert _marca(['A'], date.today()).endswith(hoje)
+
+
+def test_erro_na_consulta_usa_a_janela_de_tempo(marcas):
+    marcas['lotes'] = None
+    assert _marca(['A']).startswith('janela_')
+    assert export_jobs.data_watermark([], 'lotprod', 'ordem', ['A']).startswith('janela_')
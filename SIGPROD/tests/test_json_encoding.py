@@ -0,0 +1,105 @@
+import json
+import os
+import shutil
+import subprocess
+import pandas as pd
+import pytest
+from json_encoding import MonitorPayload, encode_delta
+
+MONITOR_DELTA_JS = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', 'js', 'monitor_delta.js')
+
+
+def apply_monitor_delta(state, response):
+    """Mesma semântica do applyMonitorDelta do static/js/monitor_delta.js: (estado, dados)."""
+    if not response['delta']:
+        state = {
+            'version': response['version'], 'is_grouped': response['is_grouped'],
+            'parts': {name: (list(keys), dict(zip(keys, response[name]))) for name, keys in response['keys'].items()},
+        }
+    else:
+        if state is None or response['since'] != state['version']:
+            raise ValueError('Delta fora de sequência')
+        parts = {}
+        for name, delta in response['parts'].items():
+            order, rows = state['parts'].get(name, ([], {}))
+            for key in delta['remove']:
+                rows.pop(key, None)
+            added = []
+            for key, row in delta['upsert']:
+                if key not in rows:
+                    added.append(key)
+                rows[key] = row
+            order = delta.get('order') or [key for key in order if key in rows] + added
+            parts[name] = (order, rows)
+        state = {'version': response['version'], 'is_grouped': response['is_grouped'], 'parts': parts}
+    data = {'is_grouped': state['is_grouped']}
+    for name, (order, rows) in state['parts'].items():
+        data[name] = [rows[key] for key in order]
+    return state, data
+
+
+def _payload(rows, grouped=False):
+    df = pd.DataFrame(rows, columns=['ordem', 'produto', 'qtd'])
+    if grouped:
+        return MonitorPayload(True, {'summary': df[['ordem']].drop_duplicates(), 'details': df})
+    return MonitorPayload(False, {'data': df})
+
+
+# Versões sucessivas de um monitor: alteração, inclusão, exclusão, reordenação, repetição de chave e agrupamento
+VERSOES = [
+    _payload([(1, 'A', 10), (2, 'A', 5), (3, 'B', 0)]),
+    _payload([(1, 'A', 12), (2, 'A', 5), (3, 'B', 0), (4, 'C', 1)]),
+    _payload([(1, 'A', 12), (4, 'C', 1)]),
+    _payload([(4, 'C', 2), (1, 'A', 12), (5, None, 3)]),
+    _payload([(4, 'C', 2), (4, 'C', 3), (1, 'A', 12)]),
+    _payload([(4, 'C', 2), (6, 'D', 1)], grouped=True),
+    _payload([(6, 'D', 1)]),
+]
+
+
+def _bodies():
+    """Corpo completo da primeira versão e os deltas de cada versão desde a anterior."""
+    bodies = [encode_delta(VERSOES[0], 1)]
+    for version, (previous, payload) in enumerate(zip(VERSOES, VERSOES[1:]), start=2):
+        bodies.append(encode_delta(payload, version, version - 1, previous.row_index()))
+    return bodies
+
+
+def test_deltas_aplicados_reconstroem_o_payload_completo():
+    state = None
+    for payload, body in zip(VERSOES, _bodies()):
+        state, data = apply_monitor_delta(state, json.loads(body))
+        assert data == json.loads(payload.body)
+
+
+def test_delta_so_leva_as_linhas_alteradas():
+    response = json.loads(_bodies()[1])
+    assert response['delta'] is True and response['since'] == 1
+    part = response['parts']['data']
+    assert part['remove'] == []
+    assert [row for _, row in part['upsert']] == [{'ordem': 1, 'produto': 'A', 'qtd': 12}, {'ordem': 4, 'produto': 'C', 'qtd': 1}]
+    assert 'order' not in part
+
+
+def test_delta_fora_de_sequencia_e_rejeitado():
+    state, _ = apply_monitor_delta(None, json.loads(_bodies()[0]))
+    with pytest.raises(ValueError):
+        apply_monitor_delta(state, json.loads(_bodies()[2]))
+
+
+@pytest.mark.skipif(shutil.which('node') is None, reason='node não instalado')
+def test_monitor_delta_js_reconstroi_o_payload_completo():
+    script = f"""
+        globalThis.window = globalThis;
+        require({json.dumps(MONITOR_DELTA_JS)});
+        const lines = require('fs').readFileSync(0, 'utf8').trim().split('\\n');
+        let state = null;
+        const out = lines.map(line => {{
+            const result = window.applyMonitorDelta(state, JSON.parse(line));
+            state = result.state;
+            return result.data;
+        }});
+        process.stdout.write(JSON.stringify(out));
+    """
+    result = subprocess.run(['node', '-e', script], input=b''.join(_bodies()), capture_output=True, check=True)
+    assert json.loads(result.stdout) == [json.loads(payload.body) for payload in VERSOES]
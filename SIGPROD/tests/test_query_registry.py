@@ -0,0 +1,27 @@
+from query_registry import _to_server_side
+
+
+def test_placeholders_viram_posicionais_na_ordem_de_aparicao():
+    sql, names = _to_server_side("SELECT * FROM t WHERE a = %(fase)s AND b = ANY(%(lotes)s) AND c = %(fase)s")
+    assert sql == "SELECT * FROM t WHERE a = $1 AND b = ANY($2) AND c = $1"
+    assert names == ['fase', 'lotes']
+
+
+def test_like_com_percentual_escapado():
+    sql, names = _to_server_side("SELECT * FROM lote l WHERE l.lotdes ILIKE '%%Petra%%' AND l.fase = %(fase)s")
+    assert sql == "SELECT * FROM lote l WHERE l.lotdes ILIKE '%Petra%' AND l.fase = $1"
+    assert names == ['fase']
+
+
+def test_mesmo_texto_da_interpolacao_pyformat():
+    # O psycopg2 interpola como o operador % do Python: o PREPARE deve receber o mesmo texto
+    original = "SELECT '100%%', x LIKE '%%(a)s%%', %(a)s, %(b)s WHERE y LIKE 'x%%'"
+    sql, names = _to_server_side(original)
+    assert sql == original % {name: f'${i + 1}' for i, name in enumerate(names)}
+    assert names == ['a', 'b']
+
+
+def test_escape_seguido_de_parenteses_nao_e_placeholder():
+    sql, names = _to_server_side("SELECT '%%(fase)s'")
+    assert sql == "SELECT '%(fase)s'"
+    assert names == []
@@ -0,0 +1,145 @@
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from config import engine, fq, table_exists, invalidate_schema_cache, TOQMOVI_LEDGER_REBUILD_SECONDS, TOQMOVI_LEDGER_RESCAN_DAYS
+from aggregates import TOQMOVI_LEDGER, toqmovi_aggregate_select
+from change_detection import change_tracker
+
+
+class ToqmoviLedger:
+    """Saldos diários da toqmovi mantidos a partir de uma marca d'água (último dia já ingerido).
+
+    Cada atualização recalcula os `rescan_days` dias antes da marca d'água, o próprio dia (que ainda pode receber
+    lançamentos), os posteriores e os movimentos sem data; o custo acompanha o volume recente, não o acumulado do
+    ano. Alterações mais antigas que a janela entram na reconstrução completa, feita na primeira atualização de
+    cada processo (um reinício não a adia) e depois a cada `rebuild_seconds`.
+    """
+
+    def __init__(self, rebuild_seconds, rescan_days):
+        self.rebuild_seconds = rebuild_seconds
+        self.rescan_days = rescan_days
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        # None: nenhuma reconstrução neste processo, então a primeira atualização reconstrói
+        self._last_rebuild = None
+        self._source_fingerprint = None
+        self._stats = {
+            'marca_dagua': None,
+            'linhas_ultimo_delta': None,
+            'atualizacoes': 0,
+            'reconstrucoes': 0,
+            'ultima_reconstrucao': None,
+        }
+
+    def refresh(self, full=False):
+        """Incorpora os movimentos novos ao ledger (ou o reconstrói). Retorna erro ou None."""
+        if not table_exists('toqmovi'):
+            return "Tabela 'toqmovi' não encontrada"
+        with self._lock:
+            if not table_exists(TOQMOVI_LEDGER):
+                return self._create()
+            rebuild = (full or self._last_rebuild is None
+                       or time.monotonic() - self._last_rebuild >= self.rebuild_seconds)
+            # Sem movimentos novos na toqmovi não há delta a incorporar
+            fingerprint = change_tracker.fingerprint(['toqmovi'])
+            if not rebuild and fingerprint is not None and fingerprint == self._source_fingerprint:
+                return None
+            error = self._execute(None, rebuild=rebuild)
+            if error is None:
+                self._source_fingerprint = fingerprint
+            return error
+
+    def _create(self):
+        # Tabela criada e populada na mesma transação: os monitores nunca a enxergam vazia
+        statements = [
+            f"CREATE TABLE IF NOT EXISTS {fq(TOQMOVI_LEDGER)} AS {toqmovi_aggregate_select(fq, by_day=True)}",
+            f"CREATE INDEX IF NOT EXISTS {TOQMOVI_LEDGER}_dia_idx ON {fq(TOQMOVI_LEDGER)} (dia)",
+            f"CREATE INDEX IF NOT EXISTS {TOQMOVI_LEDGER}_pritransac_tipo_idx ON {fq(TOQMOVI_LEDGER)} (pritransac, tipo)",
+        ]
+        error = self._execute(statements, rebuild=True)
+        if error is None:
+            invalidate_schema_cache()
+        return error
+
+    def _execute(self, statements, rebuild):
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            if statements:
+                cursor.execute(statements[0])
+                delta_rows = cursor.rowcount
+                for statement in statements[1:]:
+                    cursor.execute(statement)
+            else:
+                # Bloqueia outros escritores (outra instância do app), mas não as leituras dos monitores
+                cursor.execute(f"LOCK TABLE {fq(TOQMOVI_LEDGER)} IN SHARE ROW EXCLUSIVE MODE")
+                watermark = None
+                if not rebuild:
+                    cursor.execute(f"SELECT MAX(dia) FROM {fq(TOQMOVI_LEDGER)}")
+                    watermark = cursor.fetchone()[0]
+                if watermark is None:
+                    rebuild = True
+                    cursor.execute(f"DELETE FROM {fq(TOQMOVI_LEDGER)}")
+                else:
+                    # Janela antes da marca d'água e movimentos sem data: lançamentos retroativos e estornos recentes
+                    watermark -= timedelta(days=self.rescan_days)
+                    cursor.execute(
+                        f"DELETE FROM {fq(TOQMOVI_LEDGER)} WHERE dia >= DATE '{watermark.isoformat()}' OR dia IS NULL"
+                    )
+                cursor.execute(f"INSERT INTO {fq(TOQMOVI_LEDGER)} {toqmovi_aggregate_select(fq, by_day=True, since=watermark)}")
+                delta_rows = cursor.rowcount
+            if rebuild:
+                cursor.execute(f"ANALYZE {fq(TOQMOVI_LEDGER)}")
+            cursor.execute(f"SELECT MAX(dia) FROM {fq(TOQMOVI_LEDGER)}")
+            new_watermark = cursor.fetchone()[0]
+            connection.commit()
+        except Exception as e:
+            connection.rollback()
+            return f"Erro ao atualizar o ledger da toqmovi: {e}"
+        finally:
+            connection.close()
+
+        if rebuild:
+            self._last_rebuild = time.monotonic()
+        with self._stats_lock:
+            self._stats['marca_dagua'] = new_watermark.isoformat() if new_watermark else None
+            self._stats['linhas_ultimo_delta'] = delta_rows
+            self._stats['atualizacoes'] += 1
+            if rebuild:
+                self._stats['reconstrucoes'] += 1
+                self._stats['ultima_reconstrucao'] = datetime.now().isoformat(timespec='seconds')
+        return None
+
+    def drop(self):
+        """Remove o ledger; os monitores voltam à view materializada ou à toqmovi."""
+        with self._lock:
+            connection = engine.raw_connection()
+            try:
+                connection.cursor().execute(f"DROP TABLE IF EXISTS {fq(TOQMOVI_LEDGER)}")
+                connection.commit()
+            finally:
+                connection.close()
+        invalidate_schema_cache()
+
+    def stats(self):
+        """Marca d'água atual, tamanho do último delta e contagem de reconstruções."""
+        with self._stats_lock:
+            return dict(self._stats)
+
+
+toqmovi_ledger = ToqmoviLedger(TOQMOVI_LEDGER_REBUILD_SECONDS, TOQMOVI_LEDGER_RESCAN_DAYS)
+
+
+if __name__ == '__main__':
+    # Uso: python toqmovi_ledger.py [refresh|rebuild|drop]
+    command = sys.argv[1] if len(sys.argv) > 1 else 'refresh'
+    if command in ('refresh', 'rebuild'):
+        error = toqmovi_ledger.refresh(full=command == 'rebuild')
+        print(error or f"Ledger atualizado: {toqmovi_ledger.stats()}")
+    elif command == 'drop':
+        toqmovi_ledger.drop()
+        print("Ledger removido")
+    else:
+        print(f"Comando desconhecido: {command}")
+        sys.exit(1)